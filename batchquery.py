@@ -0,0 +1,236 @@
+"""Module batchquery:
+    This module answers many concurrent queries in batches. Queries are submitted from any thread
+    and get a QueryFuture back. A dispatcher thread groups the queries waiting when it is free
+    (up to --batch-size, waiting at most --wait-ms for more) and answers a batch with
+    retrieveDocuments over a SharedPostings of the batch: the dictionary is searched once for the
+    distinct terms of the batch, and every posting list is decoded from the memory mapped postings
+    once, the first time a query of the batch needs it, and handed to every other query of the batch
+    using it. A future is completed as soon as its query is answered, without waiting for the rest
+    of its batch.
+
+    Conjunctive queries read their postings in place with posting cursors, and a sharded index is
+    searched query by query through its coordinator, so they gain no shared reads.
+
+    python 2 has no asyncio, so the dispatcher is a thread and the futures are Event based.
+
+    usage: python batchquery.py <index-dir> [--batch-size N] [--wait-ms MS] < queries
+        answers the query lines of stdin, in the syntax of server.py, as json lines in the order
+        they finish, and prints the throughput and latencies on stderr
+	"""
+
+import sys
+import time
+import json
+import Queue
+import threading
+import argparse
+import retrieve
+import searchindex
+import server
+import metrics
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_WAIT_SECONDS = 0.002
+
+class QueryFuture(object):
+    """ The results of a submitted query, set by the dispatcher once the query is answered"""
+
+    def __init__(self, query_dict, k, conjunctive):
+        self.query_dict = query_dict
+        self.k = k
+        self.conjunctive = conjunctive
+        self.submit_time = time.time()
+        self.latency = None
+        self.results = None
+        self.error = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def result(self, timeout = None):
+        """ Waits for the query to be answered and returns its (document name, score) list, or raises its error"""
+        if not self.finished.wait(timeout):
+            raise RuntimeError("ERROR:[SearchEngine] The query was not answered in time.")
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+    def addDoneCallback(self, callback):
+        """ Calls callback(future) once the query is answered, at once if it already is"""
+        with self.lock:
+            if not self.finished.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self, results = None, error = None):
+        self.latency = time.time() - self.submit_time
+        with self.lock:
+            self.results = results
+            self.error = error
+            self.finished.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+class SharedPostings(object):
+    """ The dictionary records and the decoded posting lists of the terms of a batch of queries. It has the topDocuments
+        method of searchindex.SearchIndex, so retrieveDocuments answers the queries of the batch with it"""
+
+    def __init__(self, index, query_dicts):
+        self.index = index
+        batch_terms = {}
+        for query_dict in query_dicts:
+            batch_terms.update(query_dict)
+        self.records = index.searchTerms(batch_terms)
+        # term -> (term, max weight, document ids, weights) of readPostings
+        self.posting_lists = {}
+
+    def topDocuments(self, query_dict, k, conjunctive = False):
+        """ Same as searchindex.SearchIndex.topDocuments, decoding only the posting lists no query of the batch decoded yet"""
+        # built in query order as searchTerms builds it, so the scores are summed in the same order
+        results_from_dictionary = dict((term, self.records[term]) for term in query_dict if term in self.records)
+        if conjunctive:
+            return self.index.rankConjunctive(query_dict, results_from_dictionary, k)
+        unread_records = dict((term, record) for term, record in results_from_dictionary.iteritems() if term not in self.posting_lists)
+        metrics.count('shared_posting_lists', len(results_from_dictionary) - len(unread_records))
+        if unread_records:
+            for posting_list in self.index.readPostings(unread_records):
+                self.posting_lists[posting_list[0]] = posting_list
+        return self.index.rankPostingLists(query_dict, [self.posting_lists[term] for term in results_from_dictionary], k)
+
+def answerBatch(index, futures):
+    """ Answers a batch of queries, completing every future as soon as its query is answered"""
+    batch_index = index
+    if isinstance(index, searchindex.SearchIndex):
+        batch_index = SharedPostings(index, [future.query_dict for future in futures])
+    for future in futures:
+        try:
+            future.finish(retrieve.retrieveDocuments(future.query_dict, future.k, index = batch_index, display = False, conjunctive = future.conjunctive))
+        except searchindex.INDEX_ERRORS as error:
+            future.finish(error = error)
+
+class BatchQueryEngine(object):
+    """ Answers the submitted queries in batches on a dispatcher thread"""
+
+    def __init__(self, index, batch_size = DEFAULT_BATCH_SIZE, wait_seconds = DEFAULT_WAIT_SECONDS):
+        self.index = index
+        self.batch_size = batch_size
+        self.wait_seconds = wait_seconds
+        self.queue = Queue.Queue()
+        self.batches = 0
+        self.closed = False
+        self.dispatcher = threading.Thread(target = self.dispatch)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+    def submit(self, query_dict, k = 10, conjunctive = False):
+        """ Queues a preprocessed query. Returns its QueryFuture"""
+        if self.closed:
+            raise ValueError("ERROR:[SearchEngine] The batch query engine was closed.")
+        future = QueryFuture(query_dict, k, conjunctive)
+        self.queue.put(future)
+        return future
+
+    def nextBatch(self):
+        """ Waits for a query, then takes the queries arriving within wait_seconds, up to batch_size.
+            Returns the batch and whether the engine was closed"""
+        future = self.queue.get()
+        if future is None:
+            return [], True
+        batch = [future]
+        deadline = time.time() + self.wait_seconds
+        while len(batch) < self.batch_size:
+            try:
+                future = self.queue.get(timeout = max(0.0, deadline - time.time()))
+            except Queue.Empty:
+                break
+            if future is None:
+                return batch, True
+            batch.append(future)
+        return batch, False
+
+    def dispatch(self):
+        "This function answers the batches of queries until the engine is closed"
+        closing = False
+        while not closing:
+            batch, closing = self.nextBatch()
+            if batch:
+                self.batches += 1
+                metrics.count('query_batches')
+                with metrics.span('batch'):
+                    answerBatch(self.index, batch)
+
+    def close(self):
+        """ Answers the queries already submitted, then stops the dispatcher"""
+        self.closed = True
+        self.queue.put(None)
+        self.dispatcher.join()
+
+def parseArguments():
+    "This function parses the command line"
+    parser = argparse.ArgumentParser(description = "Answers the query lines of stdin in batches sharing their postings reads")
+    parser.add_argument("index_directory")
+    parser.add_argument("--stopwords", default = "stopwords.txt", help = "stop words file")
+    parser.add_argument("--batch-size", type = int, default = DEFAULT_BATCH_SIZE, help = "most queries answered in one batch")
+    parser.add_argument("--wait-ms", type = float, default = DEFAULT_WAIT_SECONDS * 1000, help = "longest wait for more queries before a batch is answered")
+    metrics.addArgument(parser)
+    arguments = parser.parse_args()
+    if arguments.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    return arguments
+
+def main():
+    "This function is the base caller of the batch query engine"
+    arguments = parseArguments()
+    metrics.configure(arguments.metrics)
+    stopwords = retrieve.getStopWordsList(arguments.stopwords)
+    index = server.openIndex(arguments.index_directory)
+    engine = BatchQueryEngine(index, arguments.batch_size, arguments.wait_ms / 1000.0)
+    output_lock = threading.Lock()
+    latencies = []
+
+    def writeAnswer(line, future):
+        if future.error is not None:
+            answer = {'query': line.strip(), 'error': str(future.error)}
+        else:
+            latencies.append(future.latency * 1000)
+            answer = {'query': line.strip(), 'results': future.results, 'latency_ms': future.latency * 1000}
+        with output_lock:
+            sys.stdout.write(json.dumps(answer) + '\n')
+
+    start_time = time.time()
+    try:
+        # readline instead of iterating the file, which reads ahead and would hold back queries
+        for line in iter(sys.stdin.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                query_dict, k, conjunctive = server.parseQueryLine(line, stopwords)
+            except (ValueError, IndexError) as error:
+                with output_lock:
+                    sys.stdout.write(json.dumps({'query': line.strip(), 'error': str(error)}) + '\n')
+                continue
+            engine.submit(query_dict, k, conjunctive).addDoneCallback(lambda future, line = line: writeAnswer(line, future))
+    finally:
+        engine.close()
+        index.close()
+    seconds = time.time() - start_time
+    latencies.sort()
+    statistics = {'queries': len(latencies), 'batches': engine.batches, 'seconds': seconds}
+    if latencies:
+        statistics.update({
+            'queries_per_second': len(latencies) / seconds if seconds else None,
+            'mean_ms': sum(latencies) / len(latencies),
+            'p50_ms': latencies[len(latencies) // 2],
+            'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'max_ms': latencies[-1],
+        })
+    sys.stderr.write(json.dumps(statistics) + '\n')
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""Module benchmark:
+    This module benchmarks every stage of the search engine on a synthetic corpus from corpusgen.py:
+        generate   corpusgen.py writes the html pages (only when the corpus does not exist yet)
+        tokenize   tokenize.py
+        calcwts    calcwts.py
+        index      index.py
+        pipeline   pipeline.py, the one pass index build
+        sim        sim.py on the first --sim-documents tokenized files
+        sim_kmeans sim.py --kmeans on the same files, the k-means clustering instead of the agglomerative one
+        query      retrieve.py and retrieveWt.py queries through server.py --batch, without the cache
+        batch_query      the same queries through batchquery.py, which shares postings reads in a batch
+        process_query    the first --process-queries plain queries, one retrieve.py process per query
+    Every stage runs as its own process, and its wall time and peak resident memory (from wait4)
+    are recorded. The results of a run are appended as one json line to the results file, with the
+    commit, the machine and the corpus parameters, so runs can be compared across commits and
+    corpus sizes. With --metrics every stage runs with metrics.py on, and the result also holds the
+    time of its spans and its counters.
+
+    usage: python benchmark.py <work-dir> [--documents N] [--stages tokenize,index,...] [--results FILE]
+	"""
+
+import sys
+import os
+import time
+import json
+import glob
+import shutil
+import random
+import platform
+import argparse
+import subprocess
+import multiprocessing
+import corpusgen
+import sparseweights
+import metrics
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+STAGES = ['generate', 'tokenize', 'calcwts', 'index', 'pipeline', 'sim', 'sim_kmeans', 'query', 'batch_query', 'process_query']
+# Files tokenize.py writes next to the tokenized documents, moved away so they are not indexed as documents
+TOKENIZE_STATISTICS_FILES = ['tokens.txt', 'sorted_by_name.txt', 'sorted_by_count.txt', 'timingFile.txt']
+
+def runProcess(arguments, work_directory, log_name, input_path = None, collect_metrics = False, run_directory = None):
+    """ Runs a python script of the search engine in run_directory, by default work_directory. Returns its wall time in seconds and
+        peak resident memory in KB. With collect_metrics the script writes its spans and counters to logs/<log_name>.metrics.json"""
+    stdin_file = open(input_path, 'r') if input_path else open(os.devnull, 'r')
+    log_path = os.path.join(work_directory, 'logs', log_name + '.log')
+    environment = dict(os.environ)
+    environment.pop(metrics.ENVIRONMENT_VARIABLE, None)
+    if collect_metrics:
+        environment[metrics.ENVIRONMENT_VARIABLE] = metricsPath(work_directory, log_name)
+    with stdin_file:
+        with open(log_path, 'w') as log_file:
+            process_start_time = time.time()
+            process = subprocess.Popen([sys.executable] + arguments, cwd = run_directory or work_directory, stdin = stdin_file, stdout = log_file, stderr = subprocess.STDOUT, env = environment)
+            # wait4 instead of wait, for the resource usage of the child
+            pid, status, resource_usage = os.wait4(process.pid, 0)
+            seconds = time.time() - process_start_time
+    process.returncode = status
+    if status != 0:
+        raise RuntimeError("ERROR:[SearchEngine] Benchmark stage " + log_name + " failed, see " + log_path)
+    # ru_maxrss is in KB on Linux
+    return seconds, resource_usage.ru_maxrss
+
+def metricsPath(work_directory, log_name):
+    return os.path.join(work_directory, 'logs', log_name + '.metrics.json')
+
+def script(name):
+    return os.path.join(SOURCE_DIRECTORY, name)
+
+def directorySize(directory, pattern = '*'):
+    """ Returns the number of files and the total bytes of the files of a directory matching pattern"""
+    paths = glob.glob(os.path.join(directory, pattern))
+    return len(paths), sum(os.path.getsize(path) for path in paths)
+
+def stageResult(seconds, peak_rss_kb, documents, input_bytes):
+    return {
+        'seconds': seconds,
+        'peak_rss_kb': peak_rss_kb,
+        'documents_per_second': documents / seconds if seconds else None,
+        'megabytes_per_second': input_bytes / (1024.0 * 1024.0) / seconds if seconds else None,
+    }
+
+def makeQueries(vocabulary, count, seed, weighted):
+    """ Returns query lines of 1 to 3 words drawn from the frequent and middle ranks of the vocabulary"""
+    generator = random.Random(seed)
+    ranks = min(len(vocabulary), 5000)
+    queries = []
+    for query_number in range(0, count):
+        words = [vocabulary[generator.randint(0, ranks - 1)] for word in range(0, generator.randint(1, 3))]
+        if weighted:
+            queries.append('wt ' + ' '.join(str(generator.choice([0.5, 1, 2])) + ' ' + word for word in words))
+        else:
+            queries.append(' '.join(words))
+    return queries
+
+def queryLatencies(log_path):
+    """ Returns the latencies in milliseconds of the answers in a server.py --batch log"""
+    latencies = []
+    with open(log_path, 'r') as log_file:
+        for line in log_file:
+            if line.startswith('{'):
+                answer = json.loads(line)
+                if 'latency_ms' in answer:
+                    latencies.append(answer['latency_ms'])
+    return sorted(latencies)
+
+def latencyResult(seconds, peak_rss_kb, latencies):
+    return {
+        'seconds': seconds,
+        'peak_rss_kb': peak_rss_kb,
+        'queries': len(latencies),
+        'queries_per_second': len(latencies) / seconds if seconds else None,
+        'mean_ms': sum(latencies) / len(latencies) if latencies else None,
+        'p50_ms': latencies[len(latencies) // 2] if latencies else None,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else None,
+    }
+
+def currentCommit():
+    """ Returns the commit of the source tree, or None outside a git checkout"""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = SOURCE_DIRECTORY, stderr = devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmark(arguments):
+    """ Runs the selected stages. Returns the result record"""
+    work_directory = os.path.abspath(arguments.work_directory)
+    html_directory = os.path.join(work_directory, 'html')
+    tokenized_directory = os.path.join(work_directory, 'tokenized')
+    for directory in [work_directory, os.path.join(work_directory, 'logs')]:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    # the scripts read the stop words from their working directory
+    shutil.copy(os.path.join(SOURCE_DIRECTORY, 'stopwords.txt'), work_directory)
+
+    corpus = {'documents': arguments.documents, 'vocabulary': arguments.vocabulary, 'words': arguments.words, 'zipf': arguments.zipf, 'seed': arguments.seed}
+    stages = {}
+    if 'generate' in arguments.stages and not os.path.exists(html_directory):
+        seconds, peak_rss_kb = runProcess([script('corpusgen.py'), html_directory, '--documents', str(arguments.documents), '--vocabulary', str(arguments.vocabulary), '--words', str(arguments.words), '--zipf', str(arguments.zipf), '--seed', str(arguments.seed)], work_directory, 'generate', collect_metrics = arguments.metrics)
+        # throughput of the pages written
+        stages['generate'] = stageResult(seconds, peak_rss_kb, *directorySize(html_directory, '*.html'))
+    documents, html_bytes = directorySize(html_directory, '*.html')
+    corpus['html_bytes'] = html_bytes
+    if documents != arguments.documents:
+        raise ValueError("ERROR:[SearchEngine] " + html_directory + " holds " + str(documents) + " pages, not " + str(arguments.documents) + ". Use a new work directory.")
+
+    workers = ['--workers', str(arguments.workers)]
+    vectorized = ['--vectorized'] if arguments.vectorized else []
+    if 'tokenize' in arguments.stages:
+        shutil.rmtree(tokenized_directory, ignore_errors = True)
+        os.makedirs(tokenized_directory)
+        seconds, peak_rss_kb = runProcess([script('tokenize.py'), html_directory, tokenized_directory] + workers, work_directory, 'tokenize', collect_metrics = arguments.metrics)
+        statistics_directory = os.path.join(work_directory, 'tokenize_statistics')
+        shutil.rmtree(statistics_directory, ignore_errors = True)
+        os.makedirs(statistics_directory)
+        for filename in TOKENIZE_STATISTICS_FILES:
+            if os.path.exists(os.path.join(tokenized_directory, filename)):
+                shutil.move(os.path.join(tokenized_directory, filename), statistics_directory)
+        stages['tokenize'] = stageResult(seconds, peak_rss_kb, documents, html_bytes)
+    tokenized_documents, tokenized_bytes = directorySize(tokenized_directory)
+    corpus['tokenized_bytes'] = tokenized_bytes
+
+    if 'calcwts' in arguments.stages:
+        seconds, peak_rss_kb = runProcess([script('calcwts.py'), tokenized_directory, os.path.join(work_directory, 'weights')] + vectorized, work_directory, 'calcwts', collect_metrics = arguments.metrics)
+        stages['calcwts'] = stageResult(seconds, peak_rss_kb, tokenized_documents, tokenized_bytes)
+    if 'index' in arguments.stages:
+        seconds, peak_rss_kb = runProcess([script('index.py')] + vectorized + [tokenized_directory, os.path.join(work_directory, 'index')], work_directory, 'index', collect_metrics = arguments.metrics)
+        stages['index'] = stageResult(seconds, peak_rss_kb, tokenized_documents, tokenized_bytes)
+    if 'pipeline' in arguments.stages:
+        seconds, peak_rss_kb = runProcess([script('pipeline.py'), html_directory, os.path.join(work_directory, 'pipeline_index')] + workers + vectorized, work_directory, 'pipeline', collect_metrics = arguments.metrics)
+        stages['pipeline'] = stageResult(seconds, peak_rss_kb, documents, html_bytes)
+    if 'sim' in arguments.stages or 'sim_kmeans' in arguments.stages:
+        sample_directory = os.path.join(work_directory, 'sim_sample')
+        shutil.rmtree(sample_directory, ignore_errors = True)
+        os.makedirs(sample_directory)
+        for path in sorted(glob.glob(os.path.join(tokenized_directory, '*')))[:arguments.sim_documents]:
+            shutil.copy(path, sample_directory)
+        sample_documents, sample_bytes = directorySize(sample_directory)
+    if 'sim' in arguments.stages:
+        seconds, peak_rss_kb = runProcess([script('sim.py'), sample_directory] + vectorized, work_directory, 'sim', collect_metrics = arguments.metrics)
+        stages['sim'] = stageResult(seconds, peak_rss_kb, sample_documents, sample_bytes)
+    if 'sim_kmeans' in arguments.stages:
+        seconds, peak_rss_kb = runProcess([script('sim.py'), sample_directory, '--kmeans', str(arguments.kmeans_clusters), '--workers', str(arguments.workers)] + vectorized, work_directory, 'sim_kmeans', collect_metrics = arguments.metrics)
+        stages['sim_kmeans'] = stageResult(seconds, peak_rss_kb, sample_documents, sample_bytes)
+    index_directory = os.path.join(work_directory, 'index')
+    if 'query' in arguments.stages or 'batch_query' in arguments.stages or 'process_query' in arguments.stages:
+        vocabulary = corpusgen.CorpusGenerator(arguments.vocabulary, arguments.words, arguments.zipf, arguments.seed).vocabulary
+        for queries_name, weighted in [('query', False), ('query_weighted', True)]:
+            with open(os.path.join(work_directory, queries_name + '.txt'), 'w') as queries_file:
+                queries_file.write('\n'.join(makeQueries(vocabulary, arguments.queries, arguments.seed, weighted)) + '\n')
+    if 'query' in arguments.stages:
+        for stage_name in ['query', 'query_weighted']:
+            seconds, peak_rss_kb = runProcess([script('server.py'), index_directory, '--batch', '--cache-entries', '0'], work_directory, stage_name, os.path.join(work_directory, stage_name + '.txt'), collect_metrics = arguments.metrics)
+            stages[stage_name] = latencyResult(seconds, peak_rss_kb, queryLatencies(os.path.join(work_directory, 'logs', stage_name + '.log')))
+    if 'batch_query' in arguments.stages:
+        for stage_name, queries_name in [('batch_query', 'query'), ('batch_query_weighted', 'query_weighted')]:
+            seconds, peak_rss_kb = runProcess([script('batchquery.py'), index_directory], work_directory, stage_name, os.path.join(work_directory, queries_name + '.txt'), collect_metrics = arguments.metrics)
+            stages[stage_name] = latencyResult(seconds, peak_rss_kb, queryLatencies(os.path.join(work_directory, 'logs', stage_name + '.log')))
+    if 'process_query' in arguments.stages:
+        # retrieve.py searches the index of its working directory, with the stop words found there
+        shutil.copy(os.path.join(SOURCE_DIRECTORY, 'stopwords.txt'), index_directory)
+        with open(os.path.join(work_directory, 'query.txt'), 'r') as queries_file:
+            queries = [line.split() for line in queries_file if line.strip()][:arguments.process_queries]
+        latencies = []
+        peak_rss_kb = 0
+        for query in queries:
+            seconds, query_rss_kb = runProcess([script('retrieve.py')] + query, work_directory, 'process_query', run_directory = index_directory)
+            latencies.append(seconds * 1000)
+            peak_rss_kb = max(peak_rss_kb, query_rss_kb)
+        stages['process_query'] = latencyResult(sum(latencies) / 1000, peak_rss_kb, sorted(latencies))
+
+    if arguments.metrics:
+        # the spans and counters of every stage, from the metrics files the scripts wrote
+        for stage_name, stage in stages.iteritems():
+            if os.path.exists(metricsPath(work_directory, stage_name)):
+                with open(metricsPath(work_directory, stage_name), 'r') as metrics_file:
+                    stage_metrics = json.load(metrics_file)
+                stage['spans'] = stage_metrics['spans']
+                stage['counters'] = stage_metrics['counters']
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': currentCommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'workers': arguments.workers,
+        'vectorized': arguments.vectorized,
+        'corpus': corpus,
+        'stages': stages,
+    }
+
+def printResult(result):
+    """ Prints the stages of a result record as a table"""
+    print "%-20s %10s %12s %12s %10s" % ("stage", "seconds", "peak RSS MB", "docs/s", "MB/s")
+    for stage_name in STAGES + ['query_weighted', 'batch_query_weighted']:
+        if stage_name not in result['stages']:
+            continue
+        stage = result['stages'][stage_name]
+        if 'queries' in stage:
+            print "%-20s %10.3f %12.1f %12s %10s  p50 %.2f ms  p99 %.2f ms  %.1f queries/s" % (stage_name, stage['seconds'], stage['peak_rss_kb'] / 1024.0, "", "", stage['p50_ms'] or 0, stage['p99_ms'] or 0, stage['queries_per_second'] or 0)
+        else:
+            print "%-20s %10.3f %12.1f %12.1f %10.2f" % (stage_name, stage['seconds'], stage['peak_rss_kb'] / 1024.0, stage['documents_per_second'] or 0, stage['megabytes_per_second'] or 0)
+
+def parseArguments():
+    "This function parses the command line"
+    parser = argparse.ArgumentParser(description = "Benchmarks the search engine stages on a synthetic corpus")
+    parser.add_argument("work_directory", help = "holds the corpus, the outputs of every stage and their logs. A corpus already there is reused")
+    parser.add_argument("--documents", type = int, default = corpusgen.DEFAULT_DOCUMENTS, help = "number of pages")
+    parser.add_argument("--vocabulary", type = int, default = corpusgen.DEFAULT_VOCABULARY, help = "number of distinct words")
+    parser.add_argument("--words", type = int, default = corpusgen.DEFAULT_WORDS, help = "mean number of words per page")
+    parser.add_argument("--zipf", type = float, default = corpusgen.DEFAULT_ZIPF_EXPONENT, help = "exponent of the Zipfian word frequencies")
+    parser.add_argument("--seed", type = int, default = corpusgen.DEFAULT_SEED, help = "random seed of the corpus and the queries")
+    parser.add_argument("--stages", default = ','.join(STAGES), help = "comma separated stages to run, of " + ','.join(STAGES))
+    parser.add_argument("--workers", type = int, default = 1, help = "processes for tokenize.py, pipeline.py and the sim_kmeans stage")
+    parser.add_argument("--vectorized", action = "store_true", help = "pass --vectorized to calcwts.py, index.py, pipeline.py and sim.py")
+    parser.add_argument("--sim-documents", type = int, default = 1000, help = "documents clustered by sim.py")
+    parser.add_argument("--kmeans-clusters", type = int, default = 20, help = "clusters of the sim_kmeans stage")
+    parser.add_argument("--queries", type = int, default = 200, help = "plain and weighted queries each")
+    parser.add_argument("--process-queries", type = int, default = 20, help = "queries run one process each by the process_query stage")
+    parser.add_argument("--metrics", action = "store_true", help = "run the stages with metrics on and add their spans and counters to the result")
+    parser.add_argument("--results", help = "json lines file the result is appended to, by default results.jsonl in the work directory")
+    arguments = parser.parse_args()
+    arguments.stages = arguments.stages.split(',')
+    for stage_name in arguments.stages:
+        if stage_name not in STAGES:
+            parser.error("unknown stage " + stage_name)
+    if (arguments.vectorized or 'sim_kmeans' in arguments.stages) and not sparseweights.isAvailable():
+        parser.error("--vectorized and the sim_kmeans stage need numpy and scipy")
+    return arguments
+
+def main():
+    "This function is the base caller of the benchmark suite"
+    arguments = parseArguments()
+    result = runBenchmark(arguments)
+    results_path = arguments.results or os.path.join(arguments.work_directory, 'results.jsonl')
+    with open(results_path, 'a') as results_file:
+        results_file.write(json.dumps(result, sort_keys = True) + '\n')
+    printResult(result)
+    print "Results appended to", results_path
+
+if __name__ == "__main__":
+    sys.exit(main())
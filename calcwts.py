@@ -9,6 +9,9 @@ import os
 from collections import defaultdict
 import glob
 import math
+import argparse
+import sparseweights
+import metrics
 
 start_time = time.time()
 
@@ -22,15 +25,25 @@ def getStopWordsList():
             stopwords[line.rstrip("\n")] = 1;
     return stopwords
 
+@metrics.timed('stopword_filtering')
+def filterTokens(tokens, stopwords):
+    """ Returns the stripped tokens that are neither stop words nor of length 1"""
+    return [token for token in (token.strip() for token in tokens) if len(token) > 1 and token not in stopwords]
+
+# stop words are filtered out as the terms are counted. With metrics on they are filtered up front, so that the
+# stopword_filtering span times the filter on its own, within the read_documents span
+@metrics.timed('read_documents')
 def calculateTermFreqAndInverseDocFreq(input_directory, term_frequency, inverse_document_frequency, term_count_in_corpus):
-    stopwords = getstopwordslist()
+    stopwords = getStopWordsList()
     # for each input file, build token_freqency. also build inverse_document_frequency simultaneously.
-    for input_file in os.listdir(input_directory):
+    for input_file in sorted(os.listdir(input_directory)):
         with open(os.path.join(input_directory, input_file), "r") as filestream:
             # Re-initialize dict tokens_in_file for each file. Used to build inverse_document_frequency
             tokens_in_file = defaultdict(int)
-            for line in filestream:
-                tokens = line.split(",")
+            line_tokens = (line.split(",") for line in filestream)
+            if metrics.enabled:
+                line_tokens = [filterTokens([token for tokens in line_tokens for token in tokens], stopwords)]
+            for tokens in line_tokens:
                 for token in tokens:
                     # Ignore stopwords
                     token = token.strip()
@@ -70,11 +83,23 @@ def findMaxFrequencyTerm(term_dict):
 
     return max_term
 
-def calculateWeights(term_weights, term_frequency, inverse_document_frequency, output_directory, term_count_in_corpus):
+@metrics.timed('weight_computation')
+def calculateWeights(term_weights, term_frequency, inverse_document_frequency, output_directory, term_count_in_corpus, vectorized = False):
     # create output_directory if doesn't exist
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
+    if vectorized:
+        sparseweights.calculateWeightsVectorized(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+        for filename, term_dict in term_frequency.iteritems():
+            document_weights = term_weights.get(filename, {})
+            with open(os.path.join(output_directory, filename + '_weights'), 'w') as output_file:
+                # write in the order of the term frequencies, as below
+                for term in term_dict:
+                    if term in document_weights:
+                        output_file.write(term + '\t' + str(document_weights[term]) + '\n')
+        return
+
     number_of_documents = len(term_frequency)
     # Calculate Normalized Term Frequency
     for filename, term_dict in term_frequency.iteritems():
@@ -88,14 +113,28 @@ def calculateWeights(term_weights, term_frequency, inverse_document_frequency, o
                 term_weights[filename][term] *= math.log(number_of_documents / inverse_document_frequency[term])
                 output_file.write(term + '\t' + str(term_weights[filename][term]) + '\n')
 
+def parseArguments():
+    "This function parses the command line: calcwts.py <input-dir> <output-dir> [--vectorized]"
+    parser = argparse.ArgumentParser(description = "Calculates the tf-idf weights of the tokenized files")
+    parser.add_argument("input_directory")
+    parser.add_argument("output_directory")
+    parser.add_argument("--vectorized", action = "store_true", help = "compute the weights with numpy and scipy")
+    metrics.addArgument(parser)
+    arguments = parser.parse_args()
+    if arguments.vectorized and not sparseweights.isAvailable():
+        parser.error("--vectorized needs numpy and scipy")
+    return arguments
+
 def main():
     "This function is the base caller of calcwts for search engine"
+    arguments = parseArguments()
+    metrics.configure(arguments.metrics)
     term_frequency = defaultdict(lambda : defaultdict(dict))
     inverse_document_frequency = defaultdict(int)
     term_count_in_corpus = defaultdict(int)
-    calculateTermFreqAndInverseDocFreq(input_directory = sys.argv[1], term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    calculateTermFreqAndInverseDocFreq(input_directory = arguments.input_directory, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
     term_weights = defaultdict(lambda : defaultdict(dict))
-    calculateWeights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, output_directory = sys.argv[2], term_count_in_corpus = term_count_in_corpus)
+    calculateWeights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, output_directory = arguments.output_directory, term_count_in_corpus = term_count_in_corpus, vectorized = arguments.vectorized)
 
     print "Running time = %s seconds" %(time.time() - start_time)
 
@@ -0,0 +1,140 @@
+"""Module champions:
+    This module writes and evaluates the champion lists of an index, built by index.py --champions R.
+    The champion list of a term holds its R highest weight postings, in document id order, in
+    champion_postings.bin in the layout of postings.bin, with the weights quantized as in its full
+    posting list. champion_dictionary.bin is a binary dictionary of the terms with more than R
+    postings, whose record gives the champion list instead of the full list: the number of champions,
+    0, the byte offset and length in champion_postings.bin and the largest weight of the term. A term
+    with at most R postings has no champion list, its full list is short enough.
+
+    SearchIndex answers a disjunctive query from the champion lists first: the documents of the
+    champion lists are scored exactly, and a document in no champion list scores at most the sum of
+    the weights of the lightest champions. When the k-th best score beats that bound, the top k is
+    settled and the full lists are only probed for the candidates. Else the query falls back to
+    scoring the full lists. Either way the results are the ones of exhaustive scoring.
+
+    usage: python champions.py <index-dir> <queries-file> [-k N] [--stopwords FILE]
+        answers the query lines (in the syntax of server.py) exhaustively, with the champion tier,
+        and from the champion lists alone, and prints the recall and latency of the last two
+	"""
+
+import os
+import sys
+import time
+import argparse
+import postings
+import termdict
+
+CHAMPION_DICTIONARY = 'champion_dictionary.bin'
+CHAMPION_POSTINGS = 'champion_postings.bin'
+
+def hasChampionLists(index_directory):
+    return os.path.exists(os.path.join(index_directory, CHAMPION_DICTIONARY)) and os.path.exists(os.path.join(index_directory, CHAMPION_POSTINGS))
+
+def removeChampionLists(index_directory):
+    """ Removes the champion lists of an earlier build, which would not match the new postings"""
+    for filename in [CHAMPION_DICTIONARY, CHAMPION_POSTINGS]:
+        if os.path.exists(os.path.join(index_directory, filename)):
+            os.remove(os.path.join(index_directory, filename))
+
+def selectChampions(posting_list, champion_size):
+    """ Returns the champion_size highest weight (document id, weight) of a posting list, highest first, ties by document id"""
+    return sorted(posting_list, key = lambda posting: (-posting[1], posting[0]))[:champion_size]
+
+class ChampionWriter(object):
+    """ Writes the champion lists of the terms, in term order, as the postings are written"""
+
+    def __init__(self, index_directory, champion_size, suffix = ''):
+        """ The files are written with suffix appended to their names, for index.py to rename them into place"""
+        self.index_directory = index_directory
+        self.champion_size = champion_size
+        self.suffix = suffix
+        self.postings_file = open(os.path.join(index_directory, CHAMPION_POSTINGS + suffix), 'wb')
+        self.position = 0
+        self.dictionary_entries = []
+
+    def addTerm(self, term, posting_list, max_weight):
+        """ Adds the champion list of a term given its (document id, weight) postings and the max weight they are quantized against"""
+        if len(posting_list) <= self.champion_size:
+            return
+        # encodePostingList takes the postings in document id order, as in the full list
+        encoded_champion_list = postings.encodePostingList(sorted(selectChampions(posting_list, self.champion_size)), max_weight)
+        self.postings_file.write(encoded_champion_list)
+        self.dictionary_entries.append((term, self.champion_size, 0, self.position, len(encoded_champion_list), max_weight))
+        self.position += len(encoded_champion_list)
+
+    def close(self):
+        self.postings_file.close()
+        termdict.writeBinaryDictionary(os.path.join(self.index_directory, CHAMPION_DICTIONARY + self.suffix), self.dictionary_entries)
+
+def evaluateChampions(index_directory, query_lines, k, stopwords_path):
+    """ Answers the queries exhaustively, with the champion tier and from the champion lists alone.
+        Returns the recall of the top k of the last two against the exhaustive top k, and the latencies in milliseconds"""
+    import retrieve
+    import server
+    import searchindex
+    stopwords = retrieve.getStopWordsList(stopwords_path)
+    index = searchindex.SearchIndex(index_directory)
+    if index.champion_postings_map is None:
+        raise ValueError("ERROR:[SearchEngine] The index has no champion lists, build it with index.py --champions R.")
+    latencies = {'exhaustive': [], 'tiered': [], 'champions only': []}
+    found = {'tiered': 0, 'champions only': 0}
+    expected_count = 0
+    settled = 0
+    queries = 0
+    try:
+        for line in query_lines:
+            if not line.strip():
+                continue
+            query_dict, query_k, conjunctive = server.parseQueryLine(line, stopwords)
+            if conjunctive:
+                continue
+            queries += 1
+            results_from_dictionary = index.searchTerms(query_dict)
+
+            start_time = time.time()
+            exhaustive = index.rankPostingLists(query_dict, index.readPostings(results_from_dictionary), k)
+            latencies['exhaustive'].append((time.time() - start_time) * 1000)
+
+            start_time = time.time()
+            tiered = index.rankChampions(query_dict, results_from_dictionary, k)
+            if tiered is None:
+                tiered = index.rankPostingLists(query_dict, index.readPostings(results_from_dictionary), k)
+            else:
+                settled += 1
+            latencies['tiered'].append((time.time() - start_time) * 1000)
+
+            start_time = time.time()
+            approximate = index.rankChampions(query_dict, results_from_dictionary, k, exact = False)
+            latencies['champions only'].append((time.time() - start_time) * 1000)
+
+            expected_documents = set(document_name for document_name, score in exhaustive)
+            expected_count += len(expected_documents)
+            found['tiered'] += len(expected_documents.intersection(document_name for document_name, score in tiered))
+            found['champions only'] += len(expected_documents.intersection(document_name for document_name, score in approximate))
+    finally:
+        index.close()
+    recall = dict((name, float(count) / expected_count if expected_count else 1.0) for name, count in found.iteritems())
+    return queries, settled, recall, latencies
+
+def main():
+    "This function is the base caller of the champion lists evaluation"
+    parser = argparse.ArgumentParser(description = "Compares the champion tier of an index with exhaustive search")
+    parser.add_argument("index_directory")
+    parser.add_argument("queries_file")
+    parser.add_argument("-k", type = int, default = 10, help = "number of results")
+    parser.add_argument("--stopwords", default = "stopwords.txt", help = "stop words file")
+    arguments = parser.parse_args()
+    with open(arguments.queries_file, 'r') as queries_file:
+        queries, settled, recall, latencies = evaluateChampions(arguments.index_directory, queries_file.readlines(), arguments.k, arguments.stopwords)
+    if not queries:
+        print "No disjunctive query"
+        return 1
+    print "%d queries, %d settled by the champion lists (%.1f%%)" % (queries, settled, 100.0 * settled / queries)
+    print "%-16s %8s %10s %10s %10s" % ("", "recall", "mean ms", "p50 ms", "p99 ms")
+    for name in ['exhaustive', 'tiered', 'champions only']:
+        name_latencies = sorted(latencies[name])
+        print "%-16s %8.4f %10.3f %10.3f %10.3f" % (name, recall.get(name, 1.0), sum(name_latencies) / len(name_latencies), name_latencies[len(name_latencies) // 2], name_latencies[min(len(name_latencies) - 1, int(len(name_latencies) * 0.99))])
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""Module clusterstate:
+    This module saves the state of a sim.py run in a checkpoint directory, so an interrupted run
+    can be resumed with --resume and new documents can be assigned to the clusters of a finished
+    run with --assign, without clustering again.
+
+    A checkpoint directory holds:
+        state.json      the options of the run (agglomerative or k-means among them), the document
+                        names in cluster number order, whether the run finished, the k-means
+                        iteration state and, once finished, the cluster of every document
+        vocabulary.txt  the indexed terms of the documents with their inverse document frequency
+                        factor, one "term factor" line per term. Line n is term id n
+        merges.txt      the merge history of the agglomerative clustering, one "cluster1 cluster2
+                        similarity" line per merge, appended as the merges are made
+        centroids.bin   the centroid of every cluster as sparse term id and weight arrays, see
+                        writeCentroids. k-means writes it at every checkpoint, the agglomerative
+                        clustering once finished
+
+    state.json and centroids.bin are replaced by renaming a complete new file, and a merge line cut
+    short by a crash is ignored, so a crash at any point leaves a checkpoint that can be resumed.
+    The similarities of the agglomerative clustering are not saved, they would take the square of
+    the number of documents. --resume computes them again and replays the merges.
+
+    The centroid of an agglomerative cluster is the average of the weights of the two clusters
+    merged into it, the vector whose dot product with a document is the similarity the clustering
+    used. A k-means centroid is of unit length and documents are scaled to unit length before
+    their dot product.
+	"""
+
+import os
+import json
+import math
+import array
+import struct
+from itertools import izip
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+VERSION = 1
+STATE = 'state.json'
+VOCABULARY = 'vocabulary.txt'
+MERGES = 'merges.txt'
+CENTROIDS = 'centroids.bin'
+
+CENTROIDS_MAGIC = 'CENT'
+CENTROIDS_HEADER_FORMAT = '<4sIIQ'
+CENTROIDS_HEADER_SIZE = struct.calcsize(CENTROIDS_HEADER_FORMAT)
+
+# Maximum tf normalization constant, as in sim.py
+a = 0.4
+
+def writeFileAtomically(path, data):
+    """ Writes data to a new file that replaces path once complete"""
+    with open(path + '.tmp', 'wb') as output_file:
+        output_file.write(data)
+    os.rename(path + '.tmp', path)
+
+def writeCentroids(path, rows):
+    """ Writes the centroids, a list of (term ids, weights) arrays, in the layout (integers little endian):
+        header magic 'CENT', version, number of centroids, number of weights,
+        then (number of centroids + 1) uint64 row starts, uint32 term ids and float64 weights"""
+    row_starts = [0]
+    term_ids = array.array('I')
+    weights = array.array('d')
+    for row_term_ids, row_weights in rows:
+        term_ids.extend(row_term_ids)
+        weights.extend(row_weights)
+        row_starts.append(len(weights))
+    data = struct.pack(CENTROIDS_HEADER_FORMAT, CENTROIDS_MAGIC, VERSION, len(rows), len(weights))
+    data += struct.pack('<%dQ' % len(row_starts), *row_starts)
+    data += struct.pack('<%dI' % len(term_ids), *term_ids) + struct.pack('<%dd' % len(weights), *weights)
+    writeFileAtomically(path, data)
+
+def readCentroids(path):
+    """ Returns the centroids of a centroids file as a list of (term ids, weights) arrays"""
+    with open(path, 'rb') as centroids_file:
+        data = centroids_file.read()
+    magic, version, number_of_centroids, number_of_weights = struct.unpack_from(CENTROIDS_HEADER_FORMAT, data, 0)
+    if magic != CENTROIDS_MAGIC or version != VERSION:
+        raise ValueError("ERROR:[SearchEngine] Unsupported centroids file format.")
+    position = CENTROIDS_HEADER_SIZE
+    row_starts = struct.unpack_from('<%dQ' % (number_of_centroids + 1), data, position)
+    position += 8 * (number_of_centroids + 1)
+    term_ids = array.array('I', struct.unpack_from('<%dI' % number_of_weights, data, position))
+    position += 4 * number_of_weights
+    weights = array.array('d', struct.unpack_from('<%dd' % number_of_weights, data, position))
+    return [(term_ids[start:end], weights[start:end]) for start, end in izip(row_starts, row_starts[1:])]
+
+def inverseDocumentFrequencyFactors(terms, number_of_documents, inverse_document_frequency):
+    """ Returns the factor calculateWeights multiplies the weight of every term by"""
+    # number_of_documents / df is an integer division, as in calculateWeights
+    return [math.log(number_of_documents / inverse_document_frequency[term]) for term in terms]
+
+def agglomerativeLabels(number_of_documents, merges):
+    """ Returns the cluster of every document after the merges, the clusters numbered in the order of the cluster they kept the place of"""
+    # a merged cluster keeps the place of its first cluster. Walking the merges backwards, the first cluster
+    # of a merge already has the place it ends up in, and the second cluster ends up there too
+    places = range(0, number_of_documents)
+    for cluster1, cluster2, similarity in reversed(merges):
+        places[cluster2] = places[cluster1]
+    numbers = dict((place, number) for number, place in enumerate(sorted(set(places))))
+    return [numbers[place] for place in places]
+
+def agglomerativeCentroids(term_weights, names, terms, merges, labels):
+    """ Returns the centroid of every agglomerative cluster as (term ids, weights) arrays.
+        Every merge averages two clusters, so a document weighs 1/2 to the power of the merges above it in its cluster"""
+    number_of_documents = len(names)
+    # nodes 0 to n - 1 are the documents, node n + m is merge m
+    parents = [-1] * (number_of_documents + len(merges))
+    nodes = range(0, number_of_documents)
+    for merge, (cluster1, cluster2, similarity) in enumerate(merges):
+        node = number_of_documents + merge
+        parents[nodes[cluster1]] = node
+        parents[nodes[cluster2]] = node
+        nodes[cluster1] = node
+    # a parent is numbered after its children, so walking down from the last node sets every parent's depth first
+    depths = [0] * len(parents)
+    for node in range(len(parents) - 1, -1, -1):
+        if parents[node] >= 0:
+            depths[node] = depths[parents[node]] + 1
+
+    term_ids = dict(izip(terms, xrange(len(terms))))
+    centroids = [{} for number in range(0, max(labels) + 1 if labels else 0)]
+    for document, name in enumerate(names):
+        centroid = centroids[labels[document]]
+        share = 0.5 ** depths[document]
+        for term, weight in term_weights[name].iteritems():
+            term_id = term_ids[term]
+            centroid[term_id] = centroid.get(term_id, 0.0) + share * weight
+    return [(array.array('I', sorted(centroid)), array.array('d', [centroid[term_id] for term_id in sorted(centroid)])) for centroid in centroids]
+
+class ClusterCheckpoint(object):
+    """ The checkpoint directory of a sim.py run"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.state = None
+        self.merge_log = None
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def exists(self):
+        return os.path.exists(self.path(STATE))
+
+    def start(self, names, options, terms, idf_factors):
+        """ Starts a new checkpoint of a run, replacing the one of an earlier run"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for filename in [MERGES, CENTROIDS]:
+            if os.path.exists(self.path(filename)):
+                os.remove(self.path(filename))
+        writeFileAtomically(self.path(VOCABULARY), ''.join("%s %r\n" % (term, factor) for term, factor in izip(terms, idf_factors)))
+        self.state = {'version': VERSION, 'names': list(names), 'options': options, 'finished': False}
+        self.saveState()
+
+    def load(self):
+        """ Reads the state of the checkpoint. Returns it"""
+        if not self.exists():
+            raise ValueError("ERROR:[SearchEngine] No clustering checkpoint in " + self.directory + ".")
+        with open(self.path(STATE), 'r') as state_file:
+            self.state = json.load(state_file)
+        if self.state.get('version') != VERSION:
+            raise ValueError("ERROR:[SearchEngine] Unsupported clustering checkpoint version.")
+        # json holds unicode strings
+        self.state['names'] = [name.encode('utf-8') for name in self.state['names']]
+        return self.state
+
+    def saveState(self):
+        writeFileAtomically(self.path(STATE), json.dumps(self.state))
+
+    def readVocabulary(self):
+        """ Returns the terms of the checkpoint and their inverse document frequency factors"""
+        terms = []
+        idf_factors = []
+        with open(self.path(VOCABULARY), 'r') as vocabulary_file:
+            for line in vocabulary_file:
+                term, factor = line.split()
+                terms.append(term)
+                idf_factors.append(float(factor))
+        return terms, idf_factors
+
+    def readMerges(self):
+        """ Returns the (cluster1, cluster2, similarity) merges logged so far"""
+        merges = []
+        if not os.path.exists(self.path(MERGES)):
+            return merges
+        with open(self.path(MERGES), 'r') as merges_file:
+            for line in merges_file:
+                # the last line is cut short if the run stopped while writing it
+                if not line.endswith('\n'):
+                    break
+                cluster1, cluster2, similarity = line.split()
+                merges.append((int(cluster1), int(cluster2), float(similarity)))
+        return merges
+
+    def logMerge(self, cluster1, cluster2, similarity):
+        """ Appends a merge to the merge history"""
+        if self.merge_log is None:
+            self.truncateMerges()
+            self.merge_log = open(self.path(MERGES), 'a')
+        self.merge_log.write("%d %d %r\n" % (cluster1, cluster2, similarity))
+        self.merge_log.flush()
+
+    def truncateMerges(self):
+        """ Drops a merge line cut short by a crash, so new merges start on a line of their own"""
+        if not os.path.exists(self.path(MERGES)):
+            return
+        with open(self.path(MERGES), 'rb+') as merges_file:
+            data = merges_file.read()
+            merges_file.truncate(data.rfind('\n') + 1)
+
+    def readCentroids(self):
+        return readCentroids(self.path(CENTROIDS))
+
+    def saveKMeans(self, clustering):
+        """ Saves the centroids and the iteration state of a kmeans.SphericalKMeans"""
+        writeCentroids(self.path(CENTROIDS), clustering.centroidRows())
+        self.state['kmeans'] = clustering.iterationState()
+        self.saveState()
+
+    def finish(self, labels, centroids):
+        """ Saves the cluster of every document and the centroids of a finished run"""
+        if self.merge_log is not None:
+            self.merge_log.close()
+            self.merge_log = None
+        writeCentroids(self.path(CENTROIDS), centroids)
+        self.state['labels'] = list(labels)
+        self.state['finished'] = True
+        self.saveState()
+
+    def assignDocuments(self, term_frequency):
+        """ Returns (document name, cluster, similarity) of every document of term_frequency, in name order, for its most
+            similar centroid. On equal similarities the lower cluster is taken. A document similar to no centroid gets cluster -1"""
+        state = self.load()
+        if not state['finished']:
+            raise ValueError("ERROR:[SearchEngine] The clustering run of the checkpoint did not finish, resume it with --resume.")
+        terms, idf_factors = self.readVocabulary()
+        names = sorted(name for name in term_frequency if term_frequency[name])
+        document_rows = documentWeights([term_frequency[name] for name in names], terms, idf_factors, state['options']['mode'] == 'kmeans')
+        if numpy is not None:
+            nearest = nearestCentroidsVectorized(document_rows, self.readCentroids(), len(terms))
+        else:
+            nearest = nearestCentroids(document_rows, self.readCentroids(), len(terms))
+        return [(name, cluster, similarity) for name, (cluster, similarity) in izip(names, nearest)]
+
+def documentWeights(term_dicts, terms, idf_factors, unit_length):
+    """ Returns the (term id, weight) of the terms of the vocabulary of every term count dict, weighted as calculateWeights
+        weighs them with the inverse document frequencies of the clustered corpus, and scaled to unit length if unit_length"""
+    term_ids = dict(izip(terms, xrange(len(terms))))
+    document_rows = []
+    for term_dict in term_dicts:
+        max_frequency = max(term_dict.itervalues())
+        weights = []
+        for term, count in term_dict.iteritems():
+            term_id = term_ids.get(term)
+            if term_id is not None:
+                weights.append((term_id, (a + (1 - a) * count / max_frequency) * idf_factors[term_id]))
+        if unit_length:
+            norm = math.sqrt(sum(weight * weight for term_id, weight in weights))
+            if norm > 0:
+                weights = [(term_id, weight / norm) for term_id, weight in weights]
+        document_rows.append(weights)
+    return document_rows
+
+def nearestCentroids(document_rows, centroids, number_of_terms):
+    """ Returns the (cluster, similarity) of the most similar centroid of every document, (-1, 0.0) if no similarity is positive"""
+    # term id -> [(cluster, weight), ...], so a document is only compared on its own terms
+    term_clusters = [[] for term_id in xrange(number_of_terms)]
+    for cluster, (centroid_term_ids, centroid_weights) in enumerate(centroids):
+        for term_id, weight in izip(centroid_term_ids, centroid_weights):
+            term_clusters[term_id].append((cluster, weight))
+    nearest = []
+    for weights in document_rows:
+        similarities = {}
+        for term_id, weight in weights:
+            for cluster, centroid_weight in term_clusters[term_id]:
+                similarities[cluster] = similarities.get(cluster, 0.0) + weight * centroid_weight
+        similarity, cluster = max([(similarity, -cluster) for cluster, similarity in similarities.iteritems()] or [(0.0, 1)])
+        nearest.append((-cluster, similarity) if similarity > 0 else (-1, 0.0))
+    return nearest
+
+def nearestCentroidsVectorized(document_rows, centroids, number_of_terms, block_rows = 256):
+    """ Same as nearestCentroids, with sparse matrix products over blocks of documents"""
+    def csrMatrix(rows):
+        row_pointers = numpy.cumsum([0] + [len(row[0]) for row in rows])
+        term_ids = numpy.fromiter((term_id for row in rows for term_id in row[0]), dtype = numpy.int64, count = row_pointers[-1])
+        weights = numpy.fromiter((weight for row in rows for weight in row[1]), dtype = numpy.float64, count = row_pointers[-1])
+        return scipy.sparse.csr_matrix((weights, term_ids, row_pointers), shape = (len(rows), number_of_terms))
+    transposed_centroids = csrMatrix([(centroid_term_ids, centroid_weights) for centroid_term_ids, centroid_weights in centroids]).T.tocsr()
+    documents = csrMatrix([(tuple(term_id for term_id, weight in row), tuple(weight for term_id, weight in row)) for row in document_rows])
+    nearest = []
+    for start in range(0, len(document_rows), block_rows):
+        similarities = documents[start:start + block_rows].dot(transposed_centroids).toarray()
+        # argmax takes the lower cluster on equal similarities
+        clusters = numpy.argmax(similarities, axis = 1)
+        best = similarities[numpy.arange(0, len(clusters)), clusters]
+        nearest.extend((int(cluster), float(similarity)) if similarity > 0 else (-1, 0.0) for cluster, similarity in izip(clusters, best))
+    return nearest
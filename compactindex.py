@@ -0,0 +1,150 @@
+"""Module compactindex:
+    This module holds the term counts and weights of an index build in compact structures
+    instead of the nested dicts of index.py, which keep a copy of every term string per document
+    it occurs in and a dict entry per posting.
+    Every term is interned to an integer id the first time it is seen, so its string is stored
+    once, and documents are numbered as they are added. A document is a DocumentVector of two
+    arrays, its term ids and their counts, replaced by its indexed term ids and their weights
+    once the weights are computed. The document frequencies and corpus counts are arrays indexed
+    by term id, and the posting lists are filled into two flat arrays of document numbers and
+    weights, one run per term.
+
+    The weights and the order of the postings are the ones of calculateWeights and
+    calculateTermIndices in index.py, so the index files do not change.
+	"""
+
+import math
+import array
+from itertools import izip
+import metrics
+
+# Maximum tf normalization constant, as in index.py
+a = 0.4
+
+class DocumentVector(object):
+    """ The term ids of a document and their counts, or their weights once computed"""
+    __slots__ = ('term_ids', 'values')
+
+    def __init__(self, term_ids, values):
+        self.term_ids = term_ids
+        self.values = values
+
+def listingOrder(document_names, is_indexed):
+    """ Returns the names of the documents with an indexed term in the order postings.txt lists their postings.
+        index.py adds the documents to its term_frequency dict in the order it reads them, copies the ones with an
+        indexed term to its term_weights dict in the iteration order of term_frequency and lists the postings of a
+        term in the iteration order of term_weights. The same two dicts, keyed by document name, are filled here"""
+    term_frequency_documents = {}
+    for document_name in document_names:
+        term_frequency_documents[document_name] = None
+    term_weights_documents = {}
+    for document_name in term_frequency_documents:
+        if is_indexed(document_name):
+            term_weights_documents[document_name] = None
+    return list(term_weights_documents)
+
+class CompactCorpus(object):
+    """ The term counts of the documents of an index build, interned to integer ids"""
+
+    def __init__(self, stopwords):
+        self.stopwords = stopwords
+        self.term_ids = {}
+        self.terms = []
+        self.document_frequencies = array.array('I')
+        self.corpus_counts = array.array('I')
+        self.document_names = []
+        self.documents = []
+        self.weighted = False
+
+    # with metrics on the stop words are filtered up front, as index.addDocumentTokens filters them
+    @metrics.timed('read_documents')
+    def addDocument(self, document_name, token_counts):
+        """ Adds the (token, count) pairs of a document, filtered as index.addDocumentTokens filters them"""
+        term_ids = self.term_ids
+        stopwords = self.stopwords
+        if metrics.enabled:
+            import index
+            token_counts = index.filterTokens(list(token_counts), stopwords)
+        counts = {}
+        for token, count in token_counts:
+            token = token.strip()
+            # Ignore stopwords and tokens of length 1
+            if not token or len(token) == 1 or token in stopwords:
+                continue
+            term_id = term_ids.get(token)
+            if term_id is None:
+                term_id = len(self.terms)
+                term_ids[token] = term_id
+                self.terms.append(token)
+                self.document_frequencies.append(0)
+                self.corpus_counts.append(0)
+            counts[term_id] = counts.get(term_id, 0) + count
+        # a document without a term is left out, as index.py leaves it out of term_frequency
+        if not counts:
+            return
+        for term_id, count in counts.iteritems():
+            self.document_frequencies[term_id] += 1
+            self.corpus_counts[term_id] += count
+        self.document_names.append(document_name)
+        self.documents.append(DocumentVector(array.array('I', counts.iterkeys()), array.array('I', counts.itervalues())))
+
+    @metrics.timed('weight_computation')
+    def calculateWeights(self):
+        """ Replaces the counts of every document by the weights of its indexed terms, as index.calculateWeights computes them"""
+        number_of_documents = len(self.documents)
+        # the factor of index.calculateWeights, number_of_documents / df is an integer division
+        inverse_document_frequency_factors = [math.log(number_of_documents / document_frequency) for document_frequency in self.document_frequencies]
+        corpus_counts = self.corpus_counts
+        for document in self.documents:
+            max_count = max(document.values)
+            term_ids = array.array('I')
+            weights = array.array('d')
+            for term_id, count in izip(document.term_ids, document.values):
+                # Ignore the terms that occur only once in the entire corpus
+                if corpus_counts[term_id] == 1:
+                    continue
+                weight = a + (1 - a) * count / max_count
+                weight *= inverse_document_frequency_factors[term_id]
+                term_ids.append(term_id)
+                weights.append(weight)
+            document.term_ids = term_ids
+            document.values = weights
+        self.weighted = True
+
+    def indexedDocumentNames(self):
+        """ Returns the sorted names of the documents with an indexed term, the documents of the postings"""
+        return sorted(document_name for document_name, document in izip(self.document_names, self.documents) if document.term_ids)
+
+    def termPostings(self):
+        """ Yields (term, document frequency, [(document name, weight), ...]) for every indexed term, in alphabetical
+            order, with the postings of a term in the order calculateTermIndices writes them to postings.txt"""
+        if not self.weighted:
+            raise ValueError("ERROR:[SearchEngine] The weights of the corpus are not computed.")
+        # index.py reads the documents in sorted name order
+        document_numbers = dict(izip(self.document_names, xrange(len(self.document_names))))
+        names_in_weights_order = listingOrder(sorted(self.document_names), lambda document_name: self.documents[document_numbers[document_name]].term_ids)
+
+        # the posting list of an indexed term holds every document of the term, so its run is document frequency long
+        run_starts = array.array('L', [0]) * (len(self.terms) + 1)
+        for term_id in xrange(len(self.terms)):
+            run_length = self.document_frequencies[term_id] if self.corpus_counts[term_id] != 1 else 0
+            run_starts[term_id + 1] = run_starts[term_id] + run_length
+        fill_positions = array.array('L', run_starts)
+        posting_documents = array.array('I', [0]) * run_starts[-1]
+        posting_weights = array.array('d', [0.0]) * run_starts[-1]
+        for document_name in names_in_weights_order:
+            document_number = document_numbers[document_name]
+            document = self.documents[document_number]
+            for term_id, weight in izip(document.term_ids, document.values):
+                position = fill_positions[term_id]
+                posting_documents[position] = document_number
+                posting_weights[position] = weight
+                fill_positions[term_id] = position + 1
+
+        document_names = self.document_names
+        for term_id in sorted(xrange(len(self.terms)), key = self.terms.__getitem__):
+            start = run_starts[term_id]
+            end = run_starts[term_id + 1]
+            if start == end:
+                continue
+            yield self.terms[term_id], self.document_frequencies[term_id], [(document_names[posting_documents[position]], posting_weights[position]) for position in xrange(start, end)]
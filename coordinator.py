@@ -0,0 +1,116 @@
+"""Module coordinator:
+    This module answers queries over a sharded index built by index.py --shards. A worker process
+    per shard keeps the shard's index open. A query is sent to every worker at once, and the top k
+    lists they send back are merged into the top k of the corpus. The shards are weighted with the
+    statistics of the whole corpus, so the results are the ones of an index of the whole corpus.
+
+    ShardCoordinator has the topDocuments method of searchindex.SearchIndex, so it can be passed
+    to retrieveDocuments as the index.
+
+    usage: python coordinator.py <index-dir> [-k N] [--and] term...
+	"""
+
+import sys
+import os
+import heapq
+import threading
+import multiprocessing
+import searchindex
+import shards
+
+def serveShard(shard_directory, connection):
+    "This function answers the queries of the coordinator against one shard, in a worker process"
+    shard_index = searchindex.SearchIndex(shard_directory)
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            query_items, k, conjunctive = request
+            try:
+                connection.send((True, shard_index.topDocuments(dict(query_items), k, conjunctive)))
+            except searchindex.INDEX_ERRORS as error:
+                connection.send((False, str(error)))
+    finally:
+        shard_index.close()
+        connection.close()
+
+def mergeTopK(shard_results, k):
+    """ Returns the k best (document name, score) of the top k lists of the shards, ties broken by document name as selectTopK does"""
+    return heapq.nsmallest(k, (result for results in shard_results for result in results), key = lambda item: (-item[1], item[0]))
+
+class ShardCoordinator(object):
+    """ Sends every query to a worker process per shard and merges their results"""
+
+    def __init__(self, index_directory):
+        self.directory = index_directory
+        self.signature = searchindex.indexSignature(index_directory)
+        self.connections = []
+        self.workers = []
+        for shard_name in shards.readManifest(index_directory):
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target = serveShard, args = (os.path.join(index_directory, shard_name), worker_connection))
+            worker.daemon = True
+            worker.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.workers.append(worker)
+        # a query at a time goes through the pipes
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def topDocuments(self, query_dict, k, conjunctive = False):
+        """ Returns the k best (document name, score) over all shards"""
+        # the terms are sent in the order of the query dict, so every shard sums the scores in the same order
+        request = (list(query_dict.iteritems()), k, conjunctive)
+        with self.lock:
+            if self.closed:
+                raise ValueError("ERROR:[SearchEngine] The sharded index was closed.")
+            # scatter to every shard before gathering, so the shards search in parallel
+            for connection in self.connections:
+                connection.send(request)
+            replies = [connection.recv() for connection in self.connections]
+        for succeeded, reply in replies:
+            if not succeeded:
+                raise ValueError(reply)
+        return mergeTopK([reply for succeeded, reply in replies], k)
+
+    def close(self):
+        """ Stops the shard workers"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for connection in self.connections:
+                connection.send(None)
+                connection.close()
+            for worker in self.workers:
+                worker.join()
+
+def main():
+    "This function is the base caller of the sharded query"
+    import retrieve
+    arguments = sys.argv[1:]
+    if not arguments or not shards.isShardedIndex(arguments[0]):
+        print "usage: python coordinator.py <sharded-index-dir> [-k N] [--and] term..."
+        return 1
+    query = arguments[1:]
+    k = 10
+    conjunctive = False
+    while query and query[0] in ('-k', '--and'):
+        if query[0] == '--and':
+            conjunctive = True
+            query = query[1:]
+        elif len(query) >= 2:
+            k = int(query[1])
+            query = query[2:]
+        else:
+            break
+    coordinator = ShardCoordinator(arguments[0])
+    try:
+        retrieve.retrieveDocuments(retrieve.preprocessQuery(query), k, index = coordinator, conjunctive = conjunctive)
+    finally:
+        coordinator.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""Module corpusgen:
+    This module generates a synthetic corpus of html pages for benchmarking.
+    Words are drawn from a vocabulary of made up words with Zipfian frequencies: the word of rank
+    r is drawn with probability proportional to 1 / r^s. Pages have a title, headings, paragraphs,
+    links and the script and style elements the tokenizer has to skip, and their lengths vary
+    around the mean. The same options and seed always give the same corpus.
+
+    usage: python corpusgen.py <output-dir> [--documents N] [--vocabulary V] [--words W] [--zipf S] [--seed SEED]
+	"""
+
+import sys
+import os
+import time
+import random
+import bisect
+import argparse
+
+start_time = time.time()
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'qu', 'dor', 'fen', 'gil', 'har', 'jun', 'bex', 'cra', 'wyn', 'tho']
+
+DEFAULT_DOCUMENTS = 1000
+DEFAULT_VOCABULARY = 50000
+DEFAULT_WORDS = 300
+DEFAULT_ZIPF_EXPONENT = 1.1
+DEFAULT_SEED = 1
+
+def makeVocabulary(size, generator):
+    """ Returns size distinct made up words, most frequent first"""
+    if size > sum(len(SYLLABLES) ** syllables for syllables in range(2, 5)):
+        raise ValueError("ERROR:[SearchEngine] Vocabulary of " + str(size) + " words is larger than the words that can be made up.")
+    vocabulary = []
+    seen = set()
+    while len(vocabulary) < size:
+        word = ''.join(generator.choice(SYLLABLES) for syllable in range(0, generator.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+def zipfCumulativeWeights(size, exponent):
+    """ Returns the cumulative Zipfian weights of ranks 1 to size"""
+    cumulative_weights = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += 1.0 / rank ** exponent
+        cumulative_weights.append(total)
+    return cumulative_weights
+
+class CorpusGenerator(object):
+    """ Draws pages of Zipfian words"""
+
+    def __init__(self, vocabulary_size = DEFAULT_VOCABULARY, words_per_document = DEFAULT_WORDS, zipf_exponent = DEFAULT_ZIPF_EXPONENT, seed = DEFAULT_SEED):
+        self.generator = random.Random(seed)
+        self.vocabulary = makeVocabulary(vocabulary_size, self.generator)
+        self.cumulative_weights = zipfCumulativeWeights(vocabulary_size, zipf_exponent)
+        self.words_per_document = words_per_document
+
+    def word(self):
+        return self.vocabulary[bisect.bisect_left(self.cumulative_weights, self.generator.random() * self.cumulative_weights[-1])]
+
+    def sentence(self, length):
+        words = [self.word() for position in range(0, length)]
+        words[0] = words[0].capitalize()
+        # a few numbers and punctuation, which the tokenizer strips
+        if self.generator.random() < 0.2:
+            words.insert(self.generator.randint(0, len(words)), str(self.generator.randint(1, 99999)))
+        return ' '.join(words) + self.generator.choice(['.', '.', '.', '!', '?', ';'])
+
+    def page(self, number):
+        """ Returns the html of a page"""
+        length = max(10, int(self.generator.lognormvariate(0, 0.5) * self.words_per_document))
+        parts = ['<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>' + self.sentence(5) + '</title>\n',
+                 '<style>body { font-family: serif; } .n' + str(number) + ' { margin: 0; }</style>\n',
+                 '<script>var page = ' + str(number) + '; if (page < 0) { alert("never"); }</script>\n',
+                 '</head>\n<body>\n<h1>' + self.sentence(4) + '</h1>\n']
+        written = 0
+        while written < length:
+            paragraph_length = min(length - written, self.generator.randint(20, 80))
+            sentences = []
+            remaining = paragraph_length
+            while remaining > 0:
+                sentence_length = min(remaining, self.generator.randint(5, 20))
+                sentences.append(self.sentence(sentence_length))
+                remaining -= sentence_length
+            paragraph = ' '.join(sentences)
+            if self.generator.random() < 0.3:
+                paragraph += ' <a href="page' + str(self.generator.randint(0, 999999)) + '.html">' + self.word() + ' &amp; ' + self.word() + '</a>'
+            parts.append('<p>' + paragraph + '</p>\n')
+            if self.generator.random() < 0.2:
+                parts.append('<h2>' + self.sentence(3) + '</h2>\n')
+            written += paragraph_length
+        parts.append('</body>\n</html>\n')
+        return ''.join(parts)
+
+def generateCorpus(output_directory, documents = DEFAULT_DOCUMENTS, vocabulary_size = DEFAULT_VOCABULARY, words_per_document = DEFAULT_WORDS, zipf_exponent = DEFAULT_ZIPF_EXPONENT, seed = DEFAULT_SEED):
+    """ Writes documents pages named page0000000.html onwards. Returns the vocabulary, most frequent word first"""
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    corpus_generator = CorpusGenerator(vocabulary_size, words_per_document, zipf_exponent, seed)
+    for number in range(0, documents):
+        with open(os.path.join(output_directory, 'page%07d.html' % number), 'w') as page_file:
+            page_file.write(corpus_generator.page(number))
+    return corpus_generator.vocabulary
+
+def main():
+    "This function is the base caller of the corpus generator"
+    parser = argparse.ArgumentParser(description = "Generates a synthetic html corpus with Zipfian word frequencies")
+    parser.add_argument("output_directory")
+    parser.add_argument("--documents", type = int, default = DEFAULT_DOCUMENTS, help = "number of pages")
+    parser.add_argument("--vocabulary", type = int, default = DEFAULT_VOCABULARY, help = "number of distinct words")
+    parser.add_argument("--words", type = int, default = DEFAULT_WORDS, help = "mean number of words per page")
+    parser.add_argument("--zipf", type = float, default = DEFAULT_ZIPF_EXPONENT, help = "exponent s of the 1 / rank^s word frequencies")
+    parser.add_argument("--seed", type = int, default = DEFAULT_SEED, help = "random seed")
+    arguments = parser.parse_args()
+    generateCorpus(arguments.output_directory, arguments.documents, arguments.vocabulary, arguments.words, arguments.zipf, arguments.seed)
+    print "Running time = %s seconds" %(time.time() - start_time)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""Module dedup:
+    This module finds groups of near duplicate documents among the tokenized files, so that
+    index.py and sim.py can keep one representative of every group.
+    Every document is reduced to the set of its SHINGLE_SIZE token shingles and summarized by a
+    MinHash signature of NUM_PERMUTATIONS values; the fraction of equal values of two signatures
+    estimates the Jaccard similarity of the shingle sets. Signatures are cut into BANDS bands and
+    only documents sharing a whole band (locality sensitive hashing) are compared, so a document
+    is compared with a few candidates instead of the whole corpus.
+
+    The duplicates file has one group per line, tab separated, the representative first.
+
+    usage: python dedup.py <tokenized-dir> <duplicates-file> [--threshold T]
+	"""
+
+import sys
+import os
+import time
+import zlib
+import random
+import argparse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+start_time = time.time()
+
+# Tokens per shingle
+SHINGLE_SIZE = 3
+# MinHash values per signature, cut into BANDS bands of NUM_PERMUTATIONS / BANDS values
+NUM_PERMUTATIONS = 128
+BANDS = 16
+# Documents whose estimated Jaccard similarity is at least this are duplicates
+DEFAULT_THRESHOLD = 0.8
+
+# The hash functions are (a * x + b) mod PRIME on 31 bit shingle hashes, so the products fit in 64 bits
+PRIME = 2147483647
+SEED = 1
+hash_random = random.Random(SEED)
+HASH_A = [hash_random.randint(1, PRIME - 1) for permutation in range(0, NUM_PERMUTATIONS)]
+HASH_B = [hash_random.randint(0, PRIME - 1) for permutation in range(0, NUM_PERMUTATIONS)]
+
+def readShingles(path, shingle_size = SHINGLE_SIZE):
+    """ Returns the hashes of the shingles of a tokenized file, a document shorter than a shingle being one shingle"""
+    with open(path, "r") as filestream:
+        tokens = [line.strip() for line in filestream if line.strip()]
+    if not tokens:
+        return set()
+    if len(tokens) < shingle_size:
+        return set([zlib.crc32(" ".join(tokens)) % PRIME])
+    return set(zlib.crc32(" ".join(tokens[position:position + shingle_size])) % PRIME for position in range(0, len(tokens) - shingle_size + 1))
+
+def minHashSignature(shingle_hashes):
+    """ Returns the MinHash signature of a non empty set of shingle hashes, as a tuple"""
+    if numpy is not None:
+        shingle_array = numpy.fromiter(shingle_hashes, dtype = numpy.int64, count = len(shingle_hashes))
+        hashes = (numpy.array(HASH_A, dtype = numpy.int64)[:, numpy.newaxis] * shingle_array + numpy.array(HASH_B, dtype = numpy.int64)[:, numpy.newaxis]) % PRIME
+        return tuple(hashes.min(axis = 1).tolist())
+    return tuple(min((hash_a * shingle + hash_b) % PRIME for shingle in shingle_hashes) for hash_a, hash_b in zip(HASH_A, HASH_B))
+
+def estimatedSimilarity(signature1, signature2):
+    """ Returns the fraction of equal values of two signatures, an estimate of the Jaccard similarity of the documents"""
+    equal = 0
+    for value1, value2 in zip(signature1, signature2):
+        if value1 == value2:
+            equal += 1
+    return float(equal) / len(signature1)
+
+def findDuplicateGroups(signatures, threshold = DEFAULT_THRESHOLD, bands = BANDS):
+    """ Returns the groups of near duplicates, as sorted lists of document names, given a dict of document name -> signature"""
+    rows = NUM_PERMUTATIONS // bands
+    # union find over the documents
+    parent = {}
+    def find(document):
+        while parent[document] != document:
+            parent[document] = parent[parent[document]]
+            document = parent[document]
+        return document
+
+    names = sorted(signatures)
+    for name in names:
+        parent[name] = name
+    for band in range(0, bands):
+        buckets = {}
+        for name in names:
+            buckets.setdefault(signatures[name][band * rows:(band + 1) * rows], []).append(name)
+        for bucket in buckets.itervalues():
+            # every document is compared with the leaders of the bucket only, so a bucket of copies costs one comparison each
+            leaders = []
+            for name in bucket:
+                for leader in leaders:
+                    if estimatedSimilarity(signatures[leader], signatures[name]) >= threshold:
+                        parent[find(name)] = find(leader)
+                        break
+                else:
+                    leaders.append(name)
+
+    groups = {}
+    for name in names:
+        groups.setdefault(find(name), []).append(name)
+    return sorted(group for group in groups.itervalues() if len(group) > 1)
+
+def computeSignatures(input_directory):
+    """ Returns the MinHash signature of every non empty tokenized file"""
+    signatures = {}
+    for input_file in os.listdir(input_directory):
+        shingle_hashes = readShingles(os.path.join(input_directory, input_file))
+        if shingle_hashes:
+            signatures[input_file] = minHashSignature(shingle_hashes)
+    return signatures
+
+def writeDuplicateGroups(path, groups):
+    """ Writes the groups, one per line, the representative first"""
+    with open(path, "w") as duplicates_file:
+        for group in groups:
+            duplicates_file.write("\t".join(group) + "\n")
+
+def readDuplicateGroups(path):
+    """ Returns the groups of a duplicates file"""
+    try:
+        with open(path, "r") as duplicates_file:
+            return [line.rstrip("\n").split("\t") for line in duplicates_file if line.strip()]
+    except IOError:
+        raise IOError("ERROR:[SearchEngine] Unable to open duplicates file " + path)
+
+def duplicateDocuments(path):
+    """ Returns the names of the documents to leave out: every document of a group but its representative"""
+    duplicates = set()
+    for group in readDuplicateGroups(path):
+        duplicates.update(group[1:])
+    return duplicates
+
+def main():
+    "This function is the base caller of the near duplicate detection"
+    parser = argparse.ArgumentParser(description = "Finds groups of near duplicate tokenized files")
+    parser.add_argument("input_directory")
+    parser.add_argument("duplicates_file")
+    parser.add_argument("--threshold", type = float, default = DEFAULT_THRESHOLD, help = "estimated Jaccard similarity of duplicates")
+    arguments = parser.parse_args()
+
+    signatures = computeSignatures(arguments.input_directory)
+    groups = findDuplicateGroups(signatures, arguments.threshold)
+    writeDuplicateGroups(arguments.duplicates_file, groups)
+    print "%d documents, %d duplicate groups, %d duplicates" % (len(signatures), len(groups), sum(len(group) - 1 for group in groups))
+    print "Running time = %s seconds" %(time.time() - start_time)
+
+if __name__ == "__main__":
+    sys.exit(main())
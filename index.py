@@ -9,12 +9,28 @@ import os
 from collections import defaultdict
 import glob
 import math
+import termdict
+import postings
+import segments
+import sparseweights
+import dedup
+import metrics
+import shards
+import compactindex
+import champions
+import searchindex
+import spimi
+import argparse
 
 start_time = time.time()
 
 # Maximum tf normalization constant
 a = 0.4
 
+# The index files are written with this suffix and renamed over the files of the previous build once complete.
+# A server keeps reading the files it has mapped, which truncating them in place would crash
+TEMPORARY_SUFFIX = '.tmp'
+
 def getStopWordsList():
     """ Reads stop words list into memory"""
     stopwords = defaultdict(int)
@@ -23,44 +39,67 @@ def getStopWordsList():
             stopwords[line.rstrip("\n")] = 1;
     return stopwords
 
-def calculateTermFreqAndInverseDocFreq(input_directory, term_frequency, inverse_document_frequency, term_count_in_corpus):
-    """ Calculates term frequency and document frequency for all terms in all documents"""
+@metrics.timed('stopword_filtering')
+def filterTokens(token_counts, stopwords):
+    """ Returns the (token, count) pairs of the stripped tokens that are neither stop words nor of length 1"""
+    kept_token_counts = []
+    for token, count in token_counts:
+        token = token.strip()
+        if len(token) > 1 and token not in stopwords:
+            kept_token_counts.append((token, count))
+    return kept_token_counts
+
+# stop words are filtered out as the terms are counted. With metrics on they are filtered up front, so that the
+# stopword_filtering span times the filter on its own, within the read_documents span
+@metrics.timed('read_documents')
+def addDocumentTokens(document_name, token_counts, stopwords, term_frequency, inverse_document_frequency, term_count_in_corpus):
+    """ Adds the (token, count) pairs of a document to the term frequency, document frequency and corpus counts"""
+    if metrics.enabled:
+        token_counts = filterTokens(list(token_counts), stopwords)
+    # Re-initialize dict tokens_in_file for each file. Used to build inverse_document_frequency
+    tokens_in_file = defaultdict(int)
+    for token, count in token_counts:
+        # Ignore stopwords
+        token = token.strip()
+        if not token:
+            continue
+        if stopwords.has_key(token):
+            continue
+        # Ignore if token length is 1
+        if len(token) == 1:
+            continue
+        else:
+            # For a particular token, update inverse_document_frequency only on the first occurence of that token in a file
+            if not tokens_in_file.has_key(token):
+                if inverse_document_frequency.has_key(token):
+                    inverse_document_frequency[token] += 1
+                else:
+                    inverse_document_frequency[token] = 1;
+                tokens_in_file[token] = 1
+            # Update the term_frequency for each token in every file
+            if term_frequency[document_name].has_key(token):
+                term_frequency[document_name][token] += count
+            else:
+                term_frequency[document_name][token] = count
+            # Count the term occurence in entire corpus
+            if term_count_in_corpus.has_key(token):
+                term_count_in_corpus[token] += count
+            else:
+                term_count_in_corpus[token] = count
+
+def calculateTermFreqAndInverseDocFreq(input_directory, term_frequency, inverse_document_frequency, term_count_in_corpus, skip_documents = ()):
+    """ Calculates term frequency and document frequency for all terms in all documents but skip_documents"""
     stopwords = getStopWordsList()
     # For each input file, build token_freqency. Also build inverse_document_frequency simultaneously.
-    for input_file in os.listdir(input_directory):
+    # Files are read in sorted order: the order documents are added in decides the order of the postings
+    for input_file in sorted(os.listdir(input_directory)):
+        # Near duplicates of another document are left out
+        if input_file in skip_documents:
+            continue
         with open(os.path.join(input_directory, input_file), "r") as filestream:
-            # Re-initialize dict tokens_in_file for each file. Used to build inverse_document_frequency
-            tokens_in_file = defaultdict(int)
-            for line in filestream:
-                tokens = line.split(",")
-                for token in tokens:
-                    # Ignore stopwords
-                    token = token.strip()
-                    if not token:
-                        continue
-                    if stopwords.has_key(token):
-                        continue
-                    # Ignore if token length is 1
-                    if len(token) == 1:
-                        continue
-                    else:
-                        # For a particular token, update inverse_document_frequency only on the first occurence of that token in a file
-                        if not tokens_in_file.has_key(token):
-                            if inverse_document_frequency.has_key(token):
-                                inverse_document_frequency[token] += 1
-                            else:
-                                inverse_document_frequency[token] = 1;
-                            tokens_in_file[token] = 1
-                        # Update the term_frequency for each token in every file
-                        if term_frequency[input_file].has_key(token):
-                            term_frequency[input_file][token] += 1
-                        else:
-                            term_frequency[input_file][token] = 1
-                        # Count the term occurence in entire corpus
-                        if term_count_in_corpus.has_key(token):
-                            term_count_in_corpus[token] += 1
-                        else:
-                            term_count_in_corpus[token] = 1
+            addDocumentTokens(input_file, ((token, 1) for line in filestream for token in line.split(",")), stopwords, term_frequency, inverse_document_frequency, term_count_in_corpus)
+            metrics.count('documents_read')
+            metrics.count('bytes_read', filestream.tell())
 
 def findMaxFrequencyTerm(term_dict):
     """ Returns most frequent term in the given document"""
@@ -73,9 +112,12 @@ def findMaxFrequencyTerm(term_dict):
 
     return max_term
 
-def calculateWeights(term_weights, term_frequency, inverse_document_frequency, term_count_in_corpus):
-    """ Calculates term weights for all terms in all documents"""
-    number_of_documents = len(term_frequency)
+@metrics.timed('weight_computation')
+def calculateWeights(term_weights, term_frequency, inverse_document_frequency, term_count_in_corpus, number_of_documents = None):
+    """ Calculates term weights for all terms in all documents. number_of_documents is the size of the
+        corpus, when term_frequency holds only part of it"""
+    if number_of_documents is None:
+        number_of_documents = len(term_frequency)
     # Calculate Normalized Term Frequency
     for filename, term_dict in term_frequency.iteritems():
         max_frequency_term = findMaxFrequencyTerm(term_dict = term_frequency[filename])
@@ -86,43 +128,184 @@ def calculateWeights(term_weights, term_frequency, inverse_document_frequency, t
             term_weights[filename][term] = a + (1 - a) * term_frequency[filename][term] / term_frequency[filename][max_frequency_term]
             term_weights[filename][term] *= math.log(number_of_documents / inverse_document_frequency[term])
 
-def calculateTermIndices(term_weights, term_count_in_corpus, inverse_document_frequency, output_directory):
-    """ Finds the term indices of all terms in the corpus and builds the dictionary and postings files"""
+def calculateTermIndices(term_weights, term_count_in_corpus, inverse_document_frequency, output_directory, max_weights = None, champion_size = 0):
+    """ Finds the term indices of all terms in the corpus and builds the dictionary and postings files.
+        max_weights holds the largest weight of every term in the corpus, when term_weights holds only part of it.
+        With champion_size the champion lists of that many postings are written too"""
+    # invert term_weights once into per-term posting lists, keeping the document order of term_weights
+    term_postings = defaultdict(list)
+    for filename, term_dict in term_weights.iteritems():
+        for term, weight in term_dict.iteritems():
+            term_postings[term].append((filename, weight))
+    # sort the terms alphabetically. We need the dictionary file to be sorted alphabetically
+    sorted_terms = (term for term in sorted(inverse_document_frequency) if term_count_in_corpus[term] != 1)
+    writeTermIndices(((term, inverse_document_frequency[term], term_postings[term]) for term in sorted_terms), sorted(term_weights), output_directory, max_weights, champion_size)
+
+@metrics.timed('postings_write')
+def writeTermIndices(term_postings, document_names, output_directory, max_weights = None, champion_size = 0):
+    """ Writes the dictionary and postings files. term_postings yields (term, document frequency, [(document name, weight), ...])
+        in alphabetical order, and document_names are the sorted names of the documents of the postings.
+        With champion_size the champion lists of that many postings are written too"""
     # create output_directory if doesn't exist
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
+    def temporaryPath(filename):
+        return os.path.join(output_directory, filename + TEMPORARY_SUFFIX)
+    # the lock file is created before the build, so that a reader opening the index until the files are replaced takes the lock
+    open(os.path.join(output_directory, searchindex.PUBLISH_LOCK), 'a').close()
+    index_files = ['dictionary.txt', 'postings.txt', 'postings.bin', 'documents.txt', 'dictionary.bin']
+    champion_writer = None
+    if champion_size > 0:
+        champion_writer = champions.ChampionWriter(output_directory, champion_size, TEMPORARY_SUFFIX)
+        index_files[-1:-1] = [champions.CHAMPION_POSTINGS, champions.CHAMPION_DICTIONARY]
 
     postingsfile_start_position = 1
-    # sort the terms alphabetically. We need the dictionary file to be sorted alphabetically
-    sorted_terms = sorted(inverse_document_frequency)
-    with open(os.path.join(output_directory, 'dictionary.txt'), 'w') as dictionary_file:
-        with open(os.path.join(output_directory, 'postings.txt'), 'w') as postings_file:
-            for term in sorted_terms:
-                if term_count_in_corpus[term] == 1:
-                    continue
-                # write to dictionary file by reading term and its occurence in the corpus
-                dictionary_file.write(term + '\n' + str(inverse_document_frequency[term]) + '\n' + str(postingsfile_start_position) + '\n')
-                postingsfile_start_position += inverse_document_frequency[term]
-
-                # find the term in all the documents and write its weight in postings file
-                for filename, term_dict in term_weights.iteritems():
-                    if term_dict.has_key(term):
-                        postings_file.write(filename + ',' + str(format(term_dict[term],'.5f')) + '\n')
+    # entries of the binary dictionary, written once all the terms are known
+    binary_dictionary_entries = []
+    # number the documents in sorted order for the binary postings file
+    document_ids = dict((document_name, document_id) for document_id, document_name in enumerate(document_names))
+    binary_postings_position = 0
+    with open(temporaryPath('dictionary.txt'), 'w') as dictionary_file:
+        with open(temporaryPath('postings.txt'), 'w') as postings_file:
+            with open(temporaryPath('postings.bin'), 'wb') as binary_postings_file:
+                for term, document_frequency, posting_list in term_postings:
+                    # write to dictionary file by reading term and its occurence in the corpus
+                    dictionary_file.write(term + '\n' + str(document_frequency) + '\n' + str(postingsfile_start_position) + '\n')
+
+                    # write the weight of the term in all the documents containing it to the postings file
+                    binary_posting_list = []
+                    for filename, weight in posting_list:
+                        postings_file.write(filename + ',' + str(format(weight,'.5f')) + '\n')
+                        binary_posting_list.append((document_ids[filename], weight))
+
+                    # write the posting list sorted by document id to the binary postings file
+                    binary_posting_list.sort()
+                    if max_weights is None:
+                        max_weight = termdict.roundMaxWeight(max(weight for document_id, weight in binary_posting_list))
+                    else:
+                        # the weights are quantized against the largest weight in the corpus, as in an unsharded index
+                        max_weight = termdict.roundMaxWeight(max_weights[term])
+                    encoded_posting_list = postings.encodePostingList(binary_posting_list, max_weight)
+                    binary_postings_file.write(encoded_posting_list)
+                    if champion_writer is not None:
+                        champion_writer.addTerm(term, binary_posting_list, max_weight)
+                    binary_dictionary_entries.append((term, len(binary_posting_list), postingsfile_start_position, binary_postings_position, len(encoded_posting_list), max_weight))
 
+                    postingsfile_start_position += document_frequency
+                    binary_postings_position += len(encoded_posting_list)
+
+    if champion_writer is not None:
+        champion_writer.close()
+    # write the binary dictionary used for binary searching terms at retrieval time, and the document ids of the binary postings
+    termdict.writeBinaryDictionary(temporaryPath('dictionary.bin'), binary_dictionary_entries)
+    postings.writeDocumentsFile(temporaryPath('documents.txt'), document_names)
+
+    # replace the files of the previous build only once every file is complete, and all of them while readers wait,
+    # so that a server reopening the index meanwhile does not pair new postings with the old dictionary
+    with searchindex.publishLock(output_directory, exclusive = True):
+        for filename in index_files:
+            os.rename(temporaryPath(filename), os.path.join(output_directory, filename))
+        if champion_writer is None:
+            champions.removeChampionLists(output_directory)
+
+def buildCompactIndex(input_directory, output_directory, skip_documents = (), champion_size = 0):
+    """ Builds the index of the tokenized files of input_directory but skip_documents with the compact structures of compactindex.
+        The index is the one calculateTermFreqAndInverseDocFreq, calculateWeights and calculateTermIndices build"""
+    corpus = compactindex.CompactCorpus(getStopWordsList())
+    for input_file in sorted(os.listdir(input_directory)):
+        # Near duplicates of another document are left out
+        if input_file in skip_documents:
+            continue
+        with open(os.path.join(input_directory, input_file), "r") as filestream:
+            corpus.addDocument(input_file, ((token, 1) for line in filestream for token in line.split(",")))
+            metrics.count('documents_read')
+            metrics.count('bytes_read', filestream.tell())
+    corpus.calculateWeights()
+    writeTermIndices(corpus.termPostings(), corpus.indexedDocumentNames(), output_directory, champion_size = champion_size)
+
+def parseArguments():
+    "This function parses the command line"
+    parser = argparse.ArgumentParser(description = "Builds the index of the tokenized files",
+        usage = "%(prog)s [--shards N | --memory-mb M] [--champions R] <input-dir> <output-dir>\n"
+                "       %(prog)s --append <input-dir> <index-dir>\n"
+                "       %(prog)s --delete <index-dir> <document>...\n"
+                "       %(prog)s --merge <index-dir>")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--append", action = "store_true", help = "add the tokenized files as a new segment of a segmented index")
+    mode.add_argument("--delete", action = "store_true", help = "delete documents from a segmented index")
+    mode.add_argument("--merge", action = "store_true", help = "merge the segments selected by the merge policy")
+    parser.add_argument("--foreground-merge", action = "store_true", help = "after --append, merge before returning instead of in the background")
+    parser.add_argument("--vectorized", action = "store_true", help = "compute the weights with numpy and scipy")
+    parser.add_argument("--nested-dicts", action = "store_true", help = "build with the nested term frequency dicts instead of compactindex, which writes the same index in less memory")
+    parser.add_argument("--champions", type = int, default = 0, metavar = "R", help = "also write the champion lists of the R highest weight postings of every term, searched first at query time")
+    parser.add_argument("--shards", type = int, metavar = "N", help = "partition the documents into N shards built by separate processes, searched with coordinator.py")
+    parser.add_argument("--memory-mb", type = float, metavar = "M", help = "build in sorted runs of at most M megabytes of postings merged at the end, see spimi.py")
+    parser.add_argument("--dedup", metavar = "DUPLICATES_FILE", help = "keep only the representative of every group of near duplicates written by dedup.py")
+    metrics.addArgument(parser)
+    parser.add_argument("paths", nargs = "+")
+    arguments = parser.parse_args()
+    if arguments.vectorized and not sparseweights.isAvailable():
+        parser.error("--vectorized needs numpy and scipy")
+    if arguments.champions < 0 or (arguments.champions and (arguments.append or arguments.delete or arguments.merge)):
+        parser.error("--champions needs a positive size and a full build")
+    if arguments.shards is not None and (arguments.append or arguments.delete or arguments.merge or arguments.shards < 1):
+        parser.error("--shards needs at least 1 shard and a full build")
+    if arguments.memory_mb is not None and (arguments.append or arguments.delete or arguments.merge or arguments.shards is not None or arguments.vectorized or arguments.nested_dicts or arguments.memory_mb <= 0):
+        parser.error("--memory-mb needs a positive budget and a full build without --shards, --vectorized or --nested-dicts")
+    if (arguments.merge and len(arguments.paths) != 1) or (arguments.delete and len(arguments.paths) < 2) or (not arguments.merge and not arguments.delete and len(arguments.paths) != 2):
+        parser.error("wrong number of paths")
+    return arguments
 
 def main():
     "This function is the base caller of calcwts for search engine"
+    arguments = parseArguments()
+    metrics.configure(arguments.metrics)
+    if arguments.delete:
+        print "Deleted %d documents" % segments.deleteDocuments(arguments.paths[0], arguments.paths[1:])
+        return
+    if arguments.merge:
+        segments.maybeMerge(arguments.paths[0])
+        return
+
     term_frequency = defaultdict(lambda : defaultdict(dict))
     inverse_document_frequency = defaultdict(int)
     term_count_in_corpus = defaultdict(int)
-    calculateTermFreqAndInverseDocFreq(input_directory = sys.argv[1], term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    skip_documents = set()
+    if arguments.dedup:
+        skip_documents = dedup.duplicateDocuments(arguments.dedup)
+    if arguments.shards is not None:
+        print "Built shards", " ".join(shards.buildShards(arguments.paths[0], arguments.paths[1], arguments.shards, skip_documents, arguments.vectorized, arguments.champions))
+        print "Running time = %s seconds" %(time.time() - start_time)
+        return
+    if arguments.memory_mb is not None:
+        spimi.buildIndex(arguments.paths[0], arguments.paths[1], int(arguments.memory_mb * 1024 * 1024), skip_documents, arguments.champions)
+        print "Running time = %s seconds" %(time.time() - start_time)
+        return
+    if not arguments.append and not arguments.vectorized and not arguments.nested_dicts:
+        buildCompactIndex(arguments.paths[0], arguments.paths[1], skip_documents, arguments.champions)
+        print "Running time = %s seconds" %(time.time() - start_time)
+        return
+    calculateTermFreqAndInverseDocFreq(input_directory = arguments.paths[0], term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus, skip_documents = skip_documents)
+
+    if arguments.append:
+        # weights depend on the whole corpus, so a segment stores the term frequencies only
+        print "Added segment", segments.addSegment(arguments.paths[1], term_frequency)
+        if arguments.foreground_merge:
+            segments.maybeMerge(arguments.paths[1])
+        else:
+            segments.startBackgroundMerge(arguments.paths[1])
+        print "Running time = %s seconds" %(time.time() - start_time)
+        return
+
     term_weights = defaultdict(lambda : defaultdict(dict))
-    calculateWeights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    if arguments.vectorized:
+        sparseweights.calculateWeightsVectorized(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    else:
+        calculateWeights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
 
 
-    calculateTermIndices(term_weights = term_weights, term_count_in_corpus = term_count_in_corpus, inverse_document_frequency = inverse_document_frequency, output_directory = sys.argv[2])
+    calculateTermIndices(term_weights = term_weights, term_count_in_corpus = term_count_in_corpus, inverse_document_frequency = inverse_document_frequency, output_directory = arguments.paths[1], champion_size = arguments.champions)
     print "Running time = %s seconds" %(time.time() - start_time)
 
 if __name__ == "__main__":
     sys.exit(main())
-
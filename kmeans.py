@@ -0,0 +1,283 @@
+"""Module kmeans:
+    This module clusters documents by mini-batch spherical k-means for sim.py --kmeans K, a
+    clustering whose cost grows linearly with the number of documents where the agglomerative
+    clustering of sim.py needs the similarities of all pairs.
+    The documents are the rows of the document-term weight matrix of simmatrix, scaled to unit
+    length, so the dot product of a document and a centroid is their cosine similarity. The K
+    centroids are seeded by k-means++ on the cosine distance, then every iteration takes a random
+    batch of documents, assigns each to its most similar centroid and moves every centroid towards
+    the mean of its documents with a learning rate of 1 / (documents it was given so far), and
+    scales it back to unit length. Iterations stop when no centroid moved more than the tolerance
+    (squared euclidean distance) or after --max-iterations. A last pass assigns every document.
+
+    The assignments of a batch, and of the last pass, are split into blocks of rows computed by a
+    pool of worker processes, which read the centroids from memory shared with this process.
+    The random batches do not depend on the number of workers, so neither do the clusters.
+
+    usage: python kmeans.py <tokenized-dir> [-k K] [--documents N,N,...] [--hac-documents N]
+        times k-means and the agglomerative clustering of sim.py on the first N tokenized files
+	"""
+
+import sys
+import os
+import time
+import argparse
+import multiprocessing
+from collections import defaultdict
+import sparseweights
+import simmatrix
+import metrics
+
+try:
+    import numpy
+    import scipy.sparse
+    from multiprocessing.sharedctypes import RawArray
+except ImportError:
+    numpy = None
+
+DEFAULT_BATCH_SIZE = 1024
+DEFAULT_MAX_ITERATIONS = 200
+DEFAULT_TOLERANCE = 1e-4
+DEFAULT_TOP_TERMS = 10
+DEFAULT_SEED = 0
+# Iterations between two saves of the state to a checkpoint
+DEFAULT_CHECKPOINT_ITERATIONS = 10
+
+# Set in every worker by initializeWorker
+unit_matrix = None
+centroids = None
+
+def unitRows(matrix):
+    """ Returns the CSR matrix with every row scaled to unit length. Rows of zeros stay zero"""
+    norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis = 1)).ravel())
+    norms[norms == 0] = 1.0
+    return scipy.sparse.csr_matrix(scipy.sparse.diags(1.0 / norms).dot(matrix))
+
+def initializeWorker(matrix, shared_centroids, number_of_clusters):
+    "This function keeps the unit weight matrix and a view of the shared centroids in a worker process"
+    global unit_matrix, centroids
+    unit_matrix = matrix
+    centroids = numpy.frombuffer(shared_centroids, dtype = numpy.float64).reshape(number_of_clusters, matrix.shape[1])
+
+def assignRows(rows):
+    """ Returns the most similar centroid of the given rows of the unit matrix and the similarity to it.
+        On equal similarities the lower centroid is taken"""
+    similarities = numpy.asarray(unit_matrix[rows].dot(centroids.T))
+    labels = numpy.argmax(similarities, axis = 1)
+    return labels, similarities[numpy.arange(0, len(labels)), labels]
+
+def assignBlock(job):
+    "This function assigns a block of rows, given as (start, end) or as an array of row numbers"
+    if isinstance(job, tuple):
+        return assignRows(slice(job[0], job[1]))
+    return assignRows(job)
+
+class SphericalKMeans(object):
+    """ Mini-batch spherical k-means of the rows of a document-term weight matrix"""
+
+    def __init__(self, matrix, number_of_clusters, batch_size = DEFAULT_BATCH_SIZE, max_iterations = DEFAULT_MAX_ITERATIONS, tolerance = DEFAULT_TOLERANCE, seed = DEFAULT_SEED, workers = 1):
+        if number_of_clusters < 1 or number_of_clusters > matrix.shape[0]:
+            raise ValueError("ERROR:[SearchEngine] The number of clusters must be between 1 and the number of documents.")
+        self.matrix = unitRows(matrix)
+        self.number_of_clusters = number_of_clusters
+        self.batch_size = min(batch_size, matrix.shape[0])
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.random = numpy.random.RandomState(seed)
+        self.workers = workers
+        self.shared_centroids = RawArray('d', number_of_clusters * matrix.shape[1])
+        self.centroids = numpy.frombuffer(self.shared_centroids, dtype = numpy.float64).reshape(number_of_clusters, matrix.shape[1])
+        # documents given to every centroid so far, its learning rate is the inverse
+        self.counts = numpy.zeros(number_of_clusters)
+        self.iterations = 0
+        self.seeded = False
+        self.converged = False
+        self.pool = None
+
+    def assign(self, jobs):
+        """ Returns the labels and similarities of the jobs, in job order, computed in this process or on the pool"""
+        if self.pool is not None:
+            results = self.pool.map(assignBlock, jobs, chunksize = 1)
+        else:
+            initializeWorker(self.matrix, self.shared_centroids, self.number_of_clusters)
+            results = map(assignBlock, jobs)
+        return numpy.concatenate([labels for labels, similarities in results]), numpy.concatenate([similarities for labels, similarities in results])
+
+    def splitRows(self, rows):
+        """ Returns the rows in one job per worker"""
+        return [part for part in numpy.array_split(rows, self.workers) if len(part)]
+
+    @metrics.timed('kmeans_seeding')
+    def seed(self):
+        """ Picks the first centroids by k-means++: every next centroid is a document drawn with a probability
+            proportional to its cosine distance to the nearest centroid picked so far"""
+        number_of_documents = self.matrix.shape[0]
+        first = self.random.randint(0, number_of_documents)
+        self.centroids[0] = self.matrix[first].toarray().ravel()
+        distances = numpy.clip(1.0 - numpy.asarray(self.matrix.dot(self.centroids[0])).ravel(), 0.0, None)
+        for cluster in range(1, self.number_of_clusters):
+            total = distances.sum()
+            if total > 0:
+                document = int(numpy.searchsorted(numpy.cumsum(distances), self.random.uniform(0, total), side = 'right'))
+                document = min(document, number_of_documents - 1)
+            else:
+                # every document is a copy of a centroid already
+                document = self.random.randint(0, number_of_documents)
+            self.centroids[cluster] = self.matrix[document].toarray().ravel()
+            distances = numpy.minimum(distances, numpy.clip(1.0 - numpy.asarray(self.matrix.dot(self.centroids[cluster])).ravel(), 0.0, None))
+
+    def step(self):
+        """ Runs one mini-batch iteration. Returns the largest squared distance a centroid moved"""
+        batch = numpy.sort(self.random.randint(0, self.matrix.shape[0], self.batch_size))
+        labels, similarities = self.assign(self.splitRows(batch))
+        batch_counts = numpy.bincount(labels, minlength = self.number_of_clusters).astype(numpy.float64)
+        # row c of the indicator matrix sums the documents of the batch given to centroid c
+        indicator = scipy.sparse.csr_matrix((numpy.ones(len(batch)), (labels, numpy.arange(0, len(batch)))), shape = (self.number_of_clusters, len(batch)))
+        batch_sums = indicator.dot(self.matrix[batch]).toarray()
+        moved = batch_counts > 0
+        old_centroids = self.centroids[moved].copy()
+        new_counts = self.counts[moved] + batch_counts[moved]
+        # the same as a step of 1 / count per document, the mean of the documents seen weighs them equally
+        updated = old_centroids * (self.counts[moved] / new_counts)[:, numpy.newaxis] + batch_sums[moved] / new_counts[:, numpy.newaxis]
+        norms = numpy.sqrt((updated * updated).sum(axis = 1))
+        norms[norms == 0] = 1.0
+        updated /= norms[:, numpy.newaxis]
+        self.centroids[moved] = updated
+        self.counts[moved] = new_counts
+        if not moved.any():
+            return 0.0
+        return float(((updated - old_centroids) ** 2).sum(axis = 1).max())
+
+    def fit(self, checkpoint = None, checkpoint_iterations = DEFAULT_CHECKPOINT_ITERATIONS):
+        """ Seeds and moves the centroids until they converge, saving the state to a clusterstate.ClusterCheckpoint
+            after seeding and every checkpoint_iterations iterations. A restored state is continued.
+            Returns the label of every document and its similarity to its centroid"""
+        if self.workers > 1:
+            self.pool = multiprocessing.Pool(self.workers, initializeWorker, (self.matrix, self.shared_centroids, self.number_of_clusters))
+        try:
+            if not self.seeded:
+                self.seed()
+                self.seeded = True
+                if checkpoint is not None:
+                    checkpoint.saveKMeans(self)
+            with metrics.span('kmeans_iterations'):
+                while not self.converged and self.iterations < self.max_iterations:
+                    self.iterations += 1
+                    metrics.count('kmeans_iterations')
+                    if self.step() <= self.tolerance:
+                        self.converged = True
+                    if checkpoint is not None and (self.converged or self.iterations % checkpoint_iterations == 0):
+                        checkpoint.saveKMeans(self)
+            with metrics.span('kmeans_assignment'):
+                return self.assign(simmatrix.blockJobs(self.matrix.shape[0], simmatrix.DEFAULT_BLOCK_ROWS))
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def centroidRows(self):
+        """ Returns the term ids and weights of the non zero weights of every centroid"""
+        rows = []
+        for centroid in self.centroids:
+            term_ids = numpy.nonzero(centroid)[0]
+            rows.append((term_ids.tolist(), centroid[term_ids].tolist()))
+        return rows
+
+    def iterationState(self):
+        """ Returns the state the iterations continue from, besides the centroids, in json types"""
+        generator, keys, position, has_gauss, cached_gaussian = self.random.get_state()
+        return {'iterations': self.iterations, 'seeded': self.seeded, 'converged': self.converged, 'counts': self.counts.tolist(),
+                'random_state': [generator, keys.tolist(), position, has_gauss, cached_gaussian]}
+
+    def restore(self, iteration_state, rows):
+        """ Continues from the state of iterationState and the centroidRows of an interrupted run"""
+        self.centroids[:] = 0.0
+        for centroid, (term_ids, weights) in zip(self.centroids, rows):
+            centroid[numpy.array(term_ids, dtype = numpy.int64)] = weights
+        self.counts[:] = iteration_state['counts']
+        self.iterations = iteration_state['iterations']
+        self.seeded = iteration_state['seeded']
+        self.converged = iteration_state['converged']
+        generator, keys, position, has_gauss, cached_gaussian = iteration_state['random_state']
+        self.random.set_state((str(generator), numpy.array(keys, dtype = numpy.uint32), position, has_gauss, cached_gaussian))
+
+    def topTerms(self, cluster, terms, number_of_terms = DEFAULT_TOP_TERMS):
+        """ Returns the terms of the highest weights of a centroid, highest first"""
+        centroid = self.centroids[cluster]
+        # on equal weights the term listed first
+        order = numpy.lexsort((numpy.arange(0, len(centroid)), -centroid))[:number_of_terms]
+        return [terms[term] for term in order if centroid[term] > 0]
+
+def clusterDocuments(term_weights, names, number_of_clusters, batch_size = DEFAULT_BATCH_SIZE, max_iterations = DEFAULT_MAX_ITERATIONS, tolerance = DEFAULT_TOLERANCE, seed = DEFAULT_SEED, workers = 1, top_terms = DEFAULT_TOP_TERMS, checkpoint = None, checkpoint_iterations = DEFAULT_CHECKPOINT_ITERATIONS):
+    """ Clusters the documents of term_weights by spherical k-means, saving its state to the checkpoint if any, and
+        continuing the state already saved there. Returns the fitted SphericalKMeans, the cluster of every name, its
+        similarity to its centroid and the top terms of every cluster"""
+    if not sparseweights.isAvailable():
+        raise ImportError("ERROR:[SearchEngine] k-means clustering needs numpy and scipy.")
+    terms = sorted(set(term for name in names for term in term_weights[name]))
+    clustering = SphericalKMeans(simmatrix.weightMatrix(term_weights, names, terms), number_of_clusters, batch_size, max_iterations, tolerance, seed, workers)
+    if checkpoint is not None and 'kmeans' in checkpoint.state:
+        clustering.restore(checkpoint.state['kmeans'], checkpoint.readCentroids())
+    labels, similarities = clustering.fit(checkpoint, checkpoint_iterations)
+    cluster_terms = [clustering.topTerms(cluster, terms, top_terms) for cluster in range(0, number_of_clusters)]
+    return clustering, labels.tolist(), similarities.tolist(), cluster_terms
+
+def printClusters(names, labels, similarities, cluster_terms):
+    """ Prints every cluster with its size and top terms, then the cluster of every document"""
+    sizes = [0] * len(cluster_terms)
+    for label in labels:
+        sizes[label] += 1
+    for cluster, terms in enumerate(cluster_terms):
+        print "cluster %d: %d documents, top terms: %s" % (cluster, sizes[cluster], ' '.join(terms))
+    for name, label, similarity in sorted(zip(names, labels, similarities)):
+        print "%s %d %.6f" % (name, label, similarity)
+
+def loadWeights(input_directory, number_of_documents):
+    """ Returns the term weights of sim.py for the first number_of_documents tokenized files, and their names"""
+    import sim
+    sample = set(sorted(os.listdir(input_directory))[:number_of_documents])
+    term_frequency = defaultdict(lambda : defaultdict(dict))
+    inverse_document_frequency = defaultdict(int)
+    term_count_in_corpus = defaultdict(int)
+    sim.calculateTermFreqAndInverseDocFreq(input_directory = input_directory, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus, skip_documents = set(os.listdir(input_directory)) - sample)
+    term_weights = defaultdict(lambda : defaultdict(dict))
+    sparseweights.calculateWeightsVectorized(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    return term_weights, list(term_weights)
+
+def compareClusterings(input_directory, document_counts, number_of_clusters, hac_documents, workers):
+    """ Times k-means and, up to hac_documents documents, the agglomerative clustering of sim.py on the first N tokenized files"""
+    import sim
+    print "%10s %14s %10s %12s %14s" % ("documents", "kmeans s", "iterations", "mean cosine", "agglomerative s")
+    for number_of_documents in document_counts:
+        term_weights, names = loadWeights(input_directory, number_of_documents)
+        kmeans_start_time = time.time()
+        clustering, labels, similarities, cluster_terms = clusterDocuments(term_weights, names, min(number_of_clusters, len(names)), workers = workers)
+        kmeans_time = time.time() - kmeans_start_time
+        hac_time = "-"
+        if len(names) <= hac_documents:
+            hac_start_time = time.time()
+            agglomerative = sim.DenseClustering(names, simmatrix.similarityMatrix(simmatrix.weightMatrix(term_weights, names), workers))
+            threshold = sim.DEFAULT_THRESHOLD_RATIO * agglomerative.maxSimilarity()
+            for merge in range(0, len(names) - 1):
+                merge = agglomerative.mergeNext()
+                if merge is None or merge[1] <= threshold:
+                    break
+            hac_time = "%.3f" % (time.time() - hac_start_time)
+        print "%10d %14.3f %10d %12.4f %14s" % (len(names), kmeans_time, clustering.iterations, sum(similarities) / len(similarities), hac_time)
+
+def main():
+    "This function is the base caller of the clustering comparison"
+    parser = argparse.ArgumentParser(description = "Times k-means against the agglomerative clustering of sim.py")
+    parser.add_argument("input_directory")
+    parser.add_argument("-k", type = int, default = 20, help = "number of clusters")
+    parser.add_argument("--documents", default = "1000,2000,4000", help = "comma separated numbers of documents clustered")
+    parser.add_argument("--hac-documents", type = int, default = 4000, help = "largest number of documents clustered agglomeratively, its memory grows with the square")
+    parser.add_argument("--workers", type = int, default = 1, help = "number of processes assigning the documents")
+    arguments = parser.parse_args()
+    if not sparseweights.isAvailable():
+        parser.error("k-means clustering needs numpy and scipy")
+    compareClusterings(arguments.input_directory, [int(count) for count in arguments.documents.split(',')], arguments.k, arguments.hac_documents, arguments.workers)
+
+if __name__ == "__main__":
+    sys.exit(main())
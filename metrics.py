@@ -0,0 +1,209 @@
+"""Module metrics:
+    This module times named spans of the pipeline and counts documents, tokens and bytes, so that
+    a slow build or query shows where the time went:
+        with metrics.span('html_parse'):
+            text = extractText(html_data)
+        metrics.count('tokens', len(tokens))
+
+        @metrics.timed('ranking')
+        def maxScoreTopK(posting_lists, k):
+
+    Metrics are off unless a script is run with --metrics FILE or with the SEARCH_METRICS
+    environment variable set to a file. When off, span returns a shared do nothing span and count
+    and timed test one flag, so the instrumented code runs at its usual speed. When on, the spans,
+    the counters and the peak memory are written to the file when the script exits: as Prometheus
+    text if the file name ends in .prom, else as json. The peak memory is the peak resident size of
+    the process, and the peak traced by tracemalloc where it is available (python 3).
+
+    Spans in the worker processes of --workers are not collected, only the spans of the main process.
+
+    usage: python metrics.py <metrics-file>...
+        prints the spans and counters of metrics files, slowest span first
+	"""
+
+import sys
+import os
+import time
+import json
+import atexit
+import threading
+import functools
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ENVIRONMENT_VARIABLE = 'SEARCH_METRICS'
+PROMETHEUS_PREFIX = 'search_'
+
+enabled = False
+# span name -> [calls, total seconds, max seconds]
+spans = {}
+counters = {}
+metrics_lock = threading.Lock()
+enabled_time = None
+
+class Span(object):
+    """ Adds the time between entering and leaving it to the span name"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        recordSpan(self.name, time.time() - self.start)
+        return False
+
+class NullSpan(object):
+    """ The span used while metrics are off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def span(name):
+    """ Returns a context manager timing the span name"""
+    if not enabled:
+        return NULL_SPAN
+    return Span(name)
+
+def timed(name):
+    """ Returns a decorator timing every call of a function as the span name"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*arguments, **keyword_arguments):
+            if not enabled:
+                return function(*arguments, **keyword_arguments)
+            function_start_time = time.time()
+            try:
+                return function(*arguments, **keyword_arguments)
+            finally:
+                recordSpan(name, time.time() - function_start_time)
+        return wrapper
+    return decorator
+
+def recordSpan(name, seconds):
+    with metrics_lock:
+        record = spans.get(name)
+        if record is None:
+            spans[name] = [1, seconds, seconds]
+        else:
+            record[0] += 1
+            record[1] += seconds
+            if seconds > record[2]:
+                record[2] = seconds
+
+def count(name, amount = 1):
+    """ Adds amount to the counter name"""
+    if not enabled:
+        return
+    with metrics_lock:
+        counters[name] = counters.get(name, 0) + amount
+
+def peakMemory():
+    """ Returns the peak memory in bytes, by source"""
+    memory = {}
+    if resource is not None:
+        # ru_maxrss is in KB on Linux and in bytes on OS X
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory['rss'] = peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        memory['tracemalloc'] = tracemalloc.get_traced_memory()[1]
+    return memory
+
+def snapshot():
+    """ Returns the spans, counters and peak memory recorded so far"""
+    with metrics_lock:
+        span_snapshot = dict((name, {'calls': record[0], 'seconds': record[1], 'max_seconds': record[2]}) for name, record in spans.iteritems())
+        counter_snapshot = dict(counters)
+    return {
+        'command': ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:]),
+        'wall_seconds': time.time() - enabled_time if enabled_time is not None else 0.0,
+        'spans': span_snapshot,
+        'counters': counter_snapshot,
+        'peak_memory_bytes': peakMemory(),
+    }
+
+def prometheusName(name):
+    """ Returns name with the characters Prometheus does not allow in metric names replaced by _"""
+    return ''.join(character if character.isalnum() or character == '_' else '_' for character in name)
+
+def formatPrometheus(metrics_snapshot):
+    """ Returns a snapshot in the Prometheus text format"""
+    lines = []
+    def family(name, metric_type, description, samples):
+        lines.append('# HELP ' + PROMETHEUS_PREFIX + name + ' ' + description)
+        lines.append('# TYPE ' + PROMETHEUS_PREFIX + name + ' ' + metric_type)
+        for labels, value in samples:
+            lines.append(PROMETHEUS_PREFIX + name + labels + ' ' + repr(float(value)))
+
+    span_names = sorted(metrics_snapshot['spans'])
+    family('span_seconds_total', 'counter', 'Time spent in a span.', [('{span="' + name + '"}', metrics_snapshot['spans'][name]['seconds']) for name in span_names])
+    family('span_calls_total', 'counter', 'Times a span was entered.', [('{span="' + name + '"}', metrics_snapshot['spans'][name]['calls']) for name in span_names])
+    family('span_max_seconds', 'gauge', 'Longest single call of a span.', [('{span="' + name + '"}', metrics_snapshot['spans'][name]['max_seconds']) for name in span_names])
+    for name in sorted(metrics_snapshot['counters']):
+        family(prometheusName(name) + '_total', 'counter', 'Count of ' + name.replace('_', ' ') + '.', [('', metrics_snapshot['counters'][name])])
+    family('peak_memory_bytes', 'gauge', 'Peak memory of the process.', [('{source="' + source + '"}', value) for source, value in sorted(metrics_snapshot['peak_memory_bytes'].iteritems())])
+    family('wall_seconds', 'gauge', 'Time since metrics were enabled.', [('', metrics_snapshot['wall_seconds'])])
+    return '\n'.join(lines) + '\n'
+
+def writeMetrics(path):
+    """ Writes the metrics recorded so far, as Prometheus text if path ends in .prom, else as json"""
+    metrics_snapshot = snapshot()
+    try:
+        with open(path, 'w') as metrics_file:
+            if path.endswith('.prom'):
+                metrics_file.write(formatPrometheus(metrics_snapshot))
+            else:
+                metrics_file.write(json.dumps(metrics_snapshot, indent = 1, sort_keys = True) + '\n')
+    except IOError:
+        print "ERROR:[SearchEngine] Unable to write metrics file", path
+
+def enable(trace_memory = True):
+    """ Starts recording spans and counters, and tracing allocations if tracemalloc is available"""
+    global enabled, enabled_time
+    enabled = True
+    enabled_time = time.time()
+    if trace_memory and tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def configure(path = None):
+    """ Enables metrics if path, or else the SEARCH_METRICS environment variable, names a metrics file, which is written at exit"""
+    path = path or os.environ.get(ENVIRONMENT_VARIABLE)
+    if not path:
+        return
+    enable()
+    atexit.register(writeMetrics, path)
+
+def addArgument(parser):
+    "This function adds the --metrics option to the parser of a script"
+    parser.add_argument("--metrics", metavar = "FILE", help = "write timings, counters and peak memory to FILE at exit, as Prometheus text if it ends in .prom, else json")
+
+def main():
+    "This function prints metrics json files"
+    for path in sys.argv[1:]:
+        with open(path, 'r') as metrics_file:
+            metrics_snapshot = json.load(metrics_file)
+        print "%s: %s, %.3f seconds" % (path, metrics_snapshot['command'], metrics_snapshot['wall_seconds'])
+        for name, record in sorted(metrics_snapshot['spans'].iteritems(), key = lambda item: -item[1]['seconds']):
+            print "  %-24s %10.3f s %10d calls %10.3f ms max" % (name, record['seconds'], record['calls'], record['max_seconds'] * 1000)
+        for name, value in sorted(metrics_snapshot['counters'].iteritems()):
+            print "  %-24s %12d" % (name, value)
+        for source, value in sorted(metrics_snapshot['peak_memory_bytes'].iteritems()):
+            print "  peak memory %-12s %8.1f MB" % (source, value / (1024.0 * 1024.0))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""Module pipeline:
+    This module builds the index straight from the html files in one pass: every document is
+    tokenized, its token counts are added to the term and document frequencies, and the weights,
+    dictionary and postings are written as index.py writes them. No tokenized file is written
+    unless --keep-tokenized asks for them, for debugging.
+
+    Only one document's html and token counts are held at a time (one per worker with --workers),
+    on top of the term frequency table the weights are computed from.
+
+    usage: python pipeline.py <html-dir> <index-dir> [--workers N] [--backend NAME] [--keep-tokenized DIR] [--vectorized] [--champions R]
+
+    The documents are named as tokenize.py names its output files, so the index is the one
+    index.py builds from the tokenized files of tokenize.py.
+	"""
+
+import sys
+import time
+import glob
+import os
+import argparse
+import itertools
+import multiprocessing
+from collections import defaultdict
+import tokenizer
+import index
+import sparseweights
+import compactindex
+import metrics
+
+start_time = time.time()
+
+def tokenizeDocument(job):
+    "This function tokenizes one html file, possibly in a worker process, and returns its name and token counts"
+    filename, document_name, backend, tokenized_directory = job
+    # a plain dict: the order of the terms of a document does not change the index
+    token_counts = {}
+    try:
+        with open(filename, 'r') as html_file:
+            html_data = html_file.read()
+    except IOError:
+        print "ERROR:[SearchEngine] Unable to open input file."
+        return document_name, token_counts
+
+    # the lines of the tokenized file of tokenize.py, only kept when it is written
+    tokenized_lines = None
+    if tokenized_directory is not None:
+        tokenized_lines = []
+    for token in tokenizer.tokenizeHtml(html_data, backend):
+        token_counts[token] = token_counts.get(token, 0) + 1
+        if tokenized_lines is not None:
+            tokenized_lines.append(token + '\n')
+    if tokenized_lines is not None:
+        with open(os.path.join(tokenized_directory, document_name), 'w') as tokenized_file:
+            tokenized_file.write(''.join(tokenized_lines))
+    metrics.count('bytes_read', len(html_data))
+    return document_name, token_counts
+
+def documentJobs(input_directory, backend, tokenized_directory):
+    """ Returns a job per html file, named N.txt in sorted file order as tokenize.py names them"""
+    files = sorted(glob.glob(os.path.join(input_directory, "*.html")))
+    return [(filename, str(filecount) + ".txt", backend, tokenized_directory) for filecount, filename in enumerate(files, 1)]
+
+def buildIndex(input_directory, output_directory, workers = 1, backend = None, tokenized_directory = None, vectorized = False, champion_size = 0):
+    "This function tokenizes, counts and indexes the html files of input_directory in one pass"
+    backend = backend or tokenizer.DEFAULT_BACKEND
+    if tokenized_directory is not None and not os.path.exists(tokenized_directory):
+        os.makedirs(tokenized_directory)
+
+    stopwords = index.getStopWordsList()
+    # the vectorized weights are computed from the nested term frequency dicts
+    corpus = None
+    if not vectorized:
+        corpus = compactindex.CompactCorpus(stopwords)
+    term_frequency = defaultdict(lambda : defaultdict(dict))
+    inverse_document_frequency = defaultdict(int)
+    term_count_in_corpus = defaultdict(int)
+
+    jobs = documentJobs(input_directory, backend, tokenized_directory)
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(tokenizeDocument, jobs, chunksize = 16)
+    else:
+        results = itertools.imap(tokenizeDocument, jobs)
+
+    for document_name, token_counts in results:
+        # index.py splits the lines of the tokenized files on commas, so split the tokens the same way
+        piece_counts = ((piece, count) for token, count in token_counts.iteritems() for piece in token.split(","))
+        if corpus is not None:
+            corpus.addDocument(document_name, piece_counts)
+        else:
+            index.addDocumentTokens(document_name, piece_counts, stopwords, term_frequency, inverse_document_frequency, term_count_in_corpus)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if corpus is not None:
+        # the compact corpus writes its postings in the order index.py does, whatever the order the documents were added in
+        corpus.calculateWeights()
+        index.writeTermIndices(corpus.termPostings(), corpus.indexedDocumentNames(), output_directory, champion_size = champion_size)
+        return
+
+    # add the documents in the order index.py reads the tokenized files, which decides the order of the postings
+    term_frequency = defaultdict(lambda : defaultdict(dict), ((document_name, term_frequency[document_name]) for document_name in sorted(term_frequency)))
+
+    term_weights = defaultdict(lambda : defaultdict(dict))
+    if vectorized:
+        sparseweights.calculateWeightsVectorized(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    else:
+        index.calculateWeights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    index.calculateTermIndices(term_weights = term_weights, term_count_in_corpus = term_count_in_corpus, inverse_document_frequency = inverse_document_frequency, output_directory = output_directory, champion_size = champion_size)
+
+def parseArguments():
+    "This function parses the command line"
+    parser = argparse.ArgumentParser(description = "Builds the index of the html files in one pass")
+    parser.add_argument("input_directory")
+    parser.add_argument("output_directory")
+    parser.add_argument("--workers", type = int, default = 1, help = "number of tokenizer processes")
+    parser.add_argument("--backend", choices = tokenizer.availableBackends(), default = tokenizer.DEFAULT_BACKEND, help = "html text extraction backend")
+    parser.add_argument("--keep-tokenized", metavar = "DIR", help = "also write the tokenized files, for debugging")
+    parser.add_argument("--vectorized", action = "store_true", help = "compute the weights with numpy and scipy")
+    parser.add_argument("--champions", type = int, default = 0, metavar = "R", help = "also write the champion lists of the R highest weight postings of every term")
+    metrics.addArgument(parser)
+    arguments = parser.parse_args()
+    if arguments.champions < 0:
+        parser.error("--champions needs a positive size")
+    if arguments.vectorized and not sparseweights.isAvailable():
+        parser.error("--vectorized needs numpy and scipy")
+    return arguments
+
+def main():
+    "This function is the base caller of the one pass index build"
+    arguments = parseArguments()
+    metrics.configure(arguments.metrics)
+    buildIndex(input_directory = arguments.input_directory, output_directory = arguments.output_directory, workers = arguments.workers, backend = arguments.backend, tokenized_directory = arguments.keep_tokenized, vectorized = arguments.vectorized, champion_size = arguments.champions)
+    print "Running time = %s seconds" %(time.time() - start_time)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""Module postings:
+    This module writes and reads the binary postings file.
+    Documents are numbered by their position in documents.txt. Each posting list is stored as the
+    term weights quantized to 16 bits relative to the largest weight of the term, then the gaps
+    between its ascending document ids (the first gap is the first document id) packed in as few
+    bits as the largest gap of the list needs (integers little endian):
+        weights     document frequency uint16
+        skip table  one uint32 per block of BLOCK_SIZE postings but the first: the document id
+                    the block follows
+        bit width   uint8, the number of bits of every gap
+        gaps        the gaps, most significant bit first, the last byte padded with zero bits
+
+    A block packs BLOCK_SIZE gaps, a whole number of bytes, so block b starts b * BLOCK_SIZE *
+    bit width / 8 bytes into the gaps. PostingCursor uses the skip table to jump to the block that
+    can hold a document id, and decodes that block only, and lookupWeights decodes only the blocks
+    that can hold the documents it looks up. postingListViews decodes a whole list with
+    a few numpy operations over the mapped pages, the weights being a view of them, and
+    postingListArrays decodes it into typed arrays when numpy is not installed. Query processes
+    mapping the same postings file share one page cached copy of it.
+	"""
+
+import array
+import bisect
+import binascii
+import mmap
+import struct
+import sys
+from itertools import izip, islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Largest quantized weight. Weights are stored as weight / max weight * QUANTIZATION_LEVELS
+QUANTIZATION_LEVELS = 65535
+
+# Postings per block of the skip table, a multiple of 8 so that every block starts on a byte
+BLOCK_SIZE = 128
+SKIP_ENTRY_FORMAT = '<I'
+SKIP_ENTRY_SIZE = struct.calcsize(SKIP_ENTRY_FORMAT)
+WEIGHT_FORMAT = '<H'
+WEIGHT_SIZE = struct.calcsize(WEIGHT_FORMAT)
+
+def quantizeWeight(weight, max_weight):
+    """ Quantizes the weight to an integer in [0, QUANTIZATION_LEVELS]"""
+    if max_weight <= 0:
+        return 0
+    return min(QUANTIZATION_LEVELS, int(round(weight / max_weight * QUANTIZATION_LEVELS)))
+
+def dequantizeWeight(quantized_weight, max_weight):
+    """ Returns the approximate weight of a quantized weight"""
+    return quantized_weight * max_weight / QUANTIZATION_LEVELS
+
+def viewsAvailable():
+    """ Returns True if numpy is installed, so that posting lists can be decoded from the mapped file at once"""
+    return numpy is not None
+
+def numberOfSkips(document_frequency):
+    """ Returns the number of skip table entries of a posting list"""
+    return max(0, (document_frequency - 1) // BLOCK_SIZE)
+
+def packedSize(number_of_gaps, bit_width):
+    """ Returns the number of bytes of number_of_gaps packed gaps"""
+    return (number_of_gaps * bit_width + 7) // 8
+
+def packGaps(gaps, bit_width):
+    """ Packs the gaps in bit_width bits each, most significant bit first"""
+    padding = packedSize(len(gaps), bit_width) * 8 - len(gaps) * bit_width
+    packed = 0
+    for gap in gaps:
+        packed = packed << bit_width | gap
+    return binascii.unhexlify('%0*x' % (packedSize(len(gaps), bit_width) * 2, packed << padding)) if gaps else ''
+
+def unpackGaps(data, position, number_of_gaps, bit_width):
+    """ Returns the number_of_gaps gaps of bit_width bits packed at position"""
+    number_of_bytes = packedSize(number_of_gaps, bit_width)
+    packed = int(binascii.hexlify(data[position:position + number_of_bytes]), 16) >> (number_of_bytes * 8 - number_of_gaps * bit_width)
+    mask = (1 << bit_width) - 1
+    gaps = [0] * number_of_gaps
+    for index in xrange(number_of_gaps - 1, -1, -1):
+        gaps[index] = packed & mask
+        packed >>= bit_width
+    return gaps
+
+def encodePostingList(posting_list, max_weight):
+    """ Encodes a list of (document id, weight) sorted by document id"""
+    document_ids = [document_id for document_id, weight in posting_list]
+    gaps = [document_id - previous_document_id for previous_document_id, document_id in izip([0] + document_ids, document_ids)]
+    bit_width = max(1, max(gaps).bit_length())
+    weights = array.array('H', [quantizeWeight(weight, max_weight) for document_id, weight in posting_list])
+    skip_table = array.array('I', document_ids[BLOCK_SIZE - 1:-1:BLOCK_SIZE])
+    if sys.byteorder == 'big':
+        weights.byteswap()
+        skip_table.byteswap()
+    # the gaps are packed a block at a time, so the big integer of the packing stays small
+    packed_blocks = [packGaps(gaps[start:start + BLOCK_SIZE], bit_width) for start in xrange(0, len(gaps), BLOCK_SIZE)]
+    return weights.tostring() + skip_table.tostring() + chr(bit_width) + ''.join(packed_blocks)
+
+def gapsStart(offset, document_frequency):
+    """ Returns the position of the bit width of the posting list stored at offset, followed by its gaps"""
+    return offset + document_frequency * WEIGHT_SIZE + numberOfSkips(document_frequency) * SKIP_ENTRY_SIZE
+
+def unpackGapViews(data, gaps_start, bit_width, posting_indices):
+    """ Returns a numpy array of the gaps at the posting_indices of the gaps of bit_width bits packed at gaps_start"""
+    number_of_bytes = packedSize(int(posting_indices[-1]) + 1, bit_width)
+    # a gap spans at most window_size bytes, read past the last byte from zero padding
+    window_size = (bit_width + 14) // 8
+    packed = numpy.zeros(number_of_bytes + window_size, dtype = numpy.uint64)
+    packed[:number_of_bytes] = numpy.frombuffer(data, dtype = numpy.uint8, count = number_of_bytes, offset = gaps_start)
+    bit_positions = posting_indices.astype(numpy.uint64) * numpy.uint64(bit_width)
+    byte_positions = bit_positions >> numpy.uint64(3)
+    windows = packed[byte_positions]
+    for byte in range(1, window_size):
+        windows = windows << numpy.uint64(8) | packed[byte_positions + numpy.uint64(byte)]
+    return windows >> (numpy.uint64(window_size * 8 - bit_width) - (bit_positions & numpy.uint64(7))) & numpy.uint64((1 << bit_width) - 1)
+
+def postingListViews(data, offset, length, document_frequency):
+    """ Returns numpy arrays of the document ids and of the quantized weights of the posting list stored at offset.
+        The weights are a view of data, so they are only valid while data is"""
+    quantized_weights = numpy.frombuffer(data, dtype = numpy.dtype('<u2'), count = document_frequency, offset = offset)
+    gaps_start = gapsStart(offset, document_frequency)
+    gaps = unpackGapViews(data, gaps_start + 1, ord(data[gaps_start]), numpy.arange(document_frequency))
+    return numpy.cumsum(gaps, dtype = numpy.uint32), quantized_weights
+
+def postingListArrays(data, offset, length, document_frequency):
+    """ Returns typed arrays of the document ids and of the quantized weights of the posting list stored at offset"""
+    quantized_weights = array.array('H')
+    quantized_weights.fromstring(data[offset:offset + document_frequency * WEIGHT_SIZE])
+    if sys.byteorder == 'big':
+        quantized_weights.byteswap()
+    gaps_start = gapsStart(offset, document_frequency)
+    bit_width = ord(data[gaps_start])
+    document_ids = array.array('I')
+    document_id = 0
+    for start in xrange(0, document_frequency, BLOCK_SIZE):
+        for gap in unpackGaps(data, gaps_start + 1 + packedSize(start, bit_width), min(BLOCK_SIZE, document_frequency - start), bit_width):
+            document_id += gap
+            document_ids.append(document_id)
+    return document_ids, quantized_weights
+
+def decodePostingListArrays(data, offset, length, document_frequency, max_weight):
+    """ Decodes the posting list stored at offset. Returns the array of document ids and the list of weights"""
+    document_ids, quantized_weights = postingListArrays(data, offset, length, document_frequency)
+    return document_ids, [dequantizeWeight(quantized_weight, max_weight) for quantized_weight in quantized_weights]
+
+def decodePostingList(data, offset, length, document_frequency, max_weight):
+    """ Decodes the posting list stored at offset. Returns a list of (document id, weight)"""
+    document_ids, weights = decodePostingListArrays(data, offset, length, document_frequency, max_weight)
+    return zip(document_ids, weights)
+
+class PostingCursor(object):
+    """ Walks a posting list in document id order, decoding one block at a time.
+        document_id is the document id of the current posting, None past the end"""
+
+    def __init__(self, data, offset, length, document_frequency, max_weight):
+        self.data = data
+        self.offset = offset
+        self.document_frequency = document_frequency
+        self.max_weight = max_weight
+        skips = numberOfSkips(document_frequency)
+        # block b holds the documents after block_bases[b]
+        self.block_bases = [0] + list(struct.unpack_from('<%dI' % skips, data, offset + document_frequency * WEIGHT_SIZE))
+        gaps_start = gapsStart(offset, document_frequency)
+        self.bit_width = ord(data[gaps_start])
+        self.gaps_start = gaps_start + 1
+        self.block = -1
+        self.block_document_ids = []
+        self.index = -1
+        self.document_id = None
+        self.moveTo(0)
+
+    def loadBlock(self, block):
+        """ Decodes the document ids of a block"""
+        start = block * BLOCK_SIZE
+        document_id = self.block_bases[block]
+        block_document_ids = []
+        for gap in unpackGaps(self.data, self.gaps_start + packedSize(start, self.bit_width), min(BLOCK_SIZE, self.document_frequency - start), self.bit_width):
+            document_id += gap
+            block_document_ids.append(document_id)
+        self.block = block
+        self.block_document_ids = block_document_ids
+
+    def moveTo(self, index):
+        """ Moves to the posting at index in the list. Returns its document id, or None past the end"""
+        if index >= self.document_frequency:
+            self.index = self.document_frequency
+            self.document_id = None
+            return None
+        block = index // BLOCK_SIZE
+        if block != self.block:
+            self.loadBlock(block)
+        self.index = index
+        self.document_id = self.block_document_ids[index - block * BLOCK_SIZE]
+        return self.document_id
+
+    def next(self):
+        """ Moves to the next posting. Returns its document id, or None past the end"""
+        return self.moveTo(self.index + 1)
+
+    def advance(self, target):
+        """ Moves to the first posting with a document id of at least target. Returns its document id, or None past the end"""
+        if self.document_id is None or self.document_id >= target:
+            return self.document_id
+        # the last block following a document id below target holds the first document id >= target, if any
+        block = max(self.block, bisect.bisect_left(self.block_bases, target) - 1)
+        start = 0
+        if block == self.block:
+            start = self.index - block * BLOCK_SIZE
+        else:
+            self.loadBlock(block)
+        position = bisect.bisect_left(self.block_document_ids, target, start)
+        return self.moveTo(block * BLOCK_SIZE + position)
+
+    def weight(self):
+        """ Returns the weight of the current posting"""
+        quantized_weight = struct.unpack_from(WEIGHT_FORMAT, self.data, self.offset + self.index * WEIGHT_SIZE)[0]
+        return dequantizeWeight(quantized_weight, self.max_weight)
+
+def lookupWeights(data, offset, length, document_frequency, max_weight, document_ids):
+    """ Returns the weight of each of the ascending document_ids in the posting list stored at offset, None for the
+        documents it does not hold. Only the blocks that can hold them are decoded, found through the skip table"""
+    if numpy is not None and document_ids:
+        wanted_document_ids = numpy.array(document_ids, dtype = numpy.int64)
+        # block b holds the documents after the b-th skip table entry, up to the next one
+        skip_table = numpy.frombuffer(data, dtype = numpy.dtype('<u4'), count = numberOfSkips(document_frequency), offset = offset + document_frequency * WEIGHT_SIZE)
+        blocks = numpy.unique(numpy.searchsorted(skip_table, wanted_document_ids))
+        block_starts = blocks * BLOCK_SIZE
+        block_lengths = numpy.minimum(block_starts + BLOCK_SIZE, document_frequency) - block_starts
+        # the positions in the list of the postings of the blocks, block after block
+        block_positions = numpy.cumsum(block_lengths) - block_lengths
+        posting_indices = numpy.arange(block_lengths.sum()) + numpy.repeat(block_starts - block_positions, block_lengths)
+        gaps_start = gapsStart(offset, document_frequency)
+        gaps = unpackGapViews(data, gaps_start + 1, ord(data[gaps_start]), posting_indices).astype(numpy.int64)
+        # the document ids of a block are its skip table entry plus the running sum of its gaps
+        block_bases = numpy.concatenate(([0], skip_table.astype(numpy.int64)))[blocks]
+        gap_sums = numpy.cumsum(gaps)
+        list_document_ids = gap_sums + numpy.repeat(block_bases - (gap_sums[block_positions] - gaps[block_positions]), block_lengths)
+        positions = numpy.minimum(numpy.searchsorted(list_document_ids, wanted_document_ids), len(list_document_ids) - 1)
+        found = list_document_ids[positions] == wanted_document_ids
+        quantized_weights = numpy.frombuffer(data, dtype = numpy.dtype('<u2'), count = document_frequency, offset = offset)
+        weights = dequantizeWeight(quantized_weights[posting_indices[positions]], max_weight)
+        return [weight if hit else None for weight, hit in izip(weights.tolist(), found.tolist())]
+    cursor = PostingCursor(data, offset, length, document_frequency, max_weight)
+    weights = []
+    for document_id in document_ids:
+        weights.append(cursor.weight() if cursor.advance(document_id) == document_id else None)
+    return weights
+
+def writeDocumentsFile(path, document_names):
+    """ Writes the document names, one per line. The line number (from 0) is the document id"""
+    with open(path, 'w') as documents_file:
+        for document_name in document_names:
+            documents_file.write(document_name + '\n')
+
+def readDocumentsFile(path):
+    """ Reads the document names written by writeDocumentsFile"""
+    with open(path, 'r') as documents_file:
+        return [line.rstrip('\n') for line in documents_file]
+
+def readPostingLists(results_from_dictionary, path, documents_path):
+    """ Reads the posting lists of the terms found in the binary dictionary.
+        Returns a list of (term, [(document name, weight), ...])"""
+    document_names = readDocumentsFile(documents_path)
+    posting_lists = []
+    with open(path, 'rb') as postings_file:
+        postings_map = mmap.mmap(postings_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for term, record in results_from_dictionary.iteritems():
+                document_frequency, start_line, offset, length, max_weight = record
+                posting_list = decodePostingList(postings_map, offset, length, document_frequency, max_weight)
+                posting_lists.append((term, [(document_names[document_id], weight) for document_id, weight in posting_list]))
+        finally:
+            postings_map.close()
+
+    return posting_lists
+
+def readTextPostingLists(results_from_dictionary, path):
+    """ Reads the posting lists of the terms found in dictionary.txt from the text postings file.
+        The lines of postings.txt differ in length, so the file is read sequentially, once, up to the last posting needed.
+        Returns a list of (term, [(document name, weight), ...]) in the order of results_from_dictionary"""
+    # visit the terms in the order of their postings in the file
+    term_lines = sorted((record[1], record[0], term) for term, record in results_from_dictionary.iteritems())
+    term_posting_lists = {}
+    with open(path, 'r') as postings_file:
+        line_number = 1
+        for start_line, document_frequency, term in term_lines:
+            # skip the lines up to the first posting of the term
+            for postings_line in islice(postings_file, start_line - line_number):
+                pass
+            posting_list = []
+            for postings_line in islice(postings_file, document_frequency):
+                document_name, weight = postings_line.split(",")
+                posting_list.append((document_name, float(weight)))
+            term_posting_lists[term] = posting_list
+            line_number = start_line + document_frequency
+
+    return [(term, term_posting_lists[term]) for term in results_from_dictionary]
@@ -0,0 +1,91 @@
+"""Module querycache:
+    This module caches query results in front of retrieveDocuments.
+    The key is the preprocessed query dict (terms and their query weights), the number of results
+    and whether the query is conjunctive.
+    Entries are evicted least recently used first once the cache holds too many entries or too
+    many bytes, and the whole cache is dropped when the index files change.
+	"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+def estimateSize(key, results):
+    """ Estimates the bytes held by a cache entry"""
+    size = sys.getsizeof(key) + sys.getsizeof(key[0])
+    for term, weight in key[0]:
+        size += sys.getsizeof(term) + sys.getsizeof(weight)
+    size += sys.getsizeof(results)
+    for document_name, score in results:
+        size += sys.getsizeof((document_name, score)) + sys.getsizeof(document_name) + sys.getsizeof(score)
+    return size
+
+class QueryCache(object):
+    """ Size and memory bounded LRU cache of query results, safe to share between threads"""
+
+    def __init__(self, max_entries = 1024, max_bytes = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (results, size), least recently used first
+        self.entries = OrderedDict()
+        self.bytes = 0
+        # signature of the index files the cached results were computed from
+        self.index_signature = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def makeKey(self, query_dict, k, conjunctive = False):
+        """ Returns the cache key of a preprocessed query"""
+        return (frozenset(query_dict.iteritems()), k, conjunctive)
+
+    def get(self, query_dict, k, index_signature, conjunctive = False):
+        """ Returns the cached results of the query, or None. Drops every entry if the index changed"""
+        key = self.makeKey(query_dict, k, conjunctive)
+        with self.lock:
+            if index_signature != self.index_signature:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.bytes = 0
+                self.index_signature = index_signature
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            # move the entry to the most recently used end
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query_dict, k, index_signature, results, conjunctive = False):
+        """ Caches the results of the query, evicting the least recently used entries to stay within bounds"""
+        key = self.makeKey(query_dict, k, conjunctive)
+        size = estimateSize(key, results)
+        with self.lock:
+            if self.max_entries <= 0 or size > self.max_bytes or index_signature != self.index_signature:
+                return
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (results, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                evicted_key, evicted_entry = self.entries.popitem(last = False)
+                self.bytes -= evicted_entry[1]
+                self.evictions += 1
+
+    def statistics(self):
+        """ Returns the hit and miss counters and the current size of the cache"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+            }
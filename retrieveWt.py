@@ -1,31 +1,43 @@
 """Module retrieve:
     This module calculates the document similarities to the query and returns top 10
     matched documents with the query term weights.
+
+    usage: python retrieveWt.py [-k N] [--and] [--metrics FILE] weight term [weight term]...
+        --and returns only the documents holding every query term
 	"""
 
 import sys
 import re
-import operator
 import os
 from collections import defaultdict
 import glob
 import math
+import termdict
+import postings
+import topk
+import searchindex
+import segments
+import shards
+import coordinator
+import metrics
 
 
-def getStopWordsList():
+def getStopWordsList(path = "stopwords.txt"):
     stopwords = defaultdict(int)
-    with open("stopwords.txt","r") as stopwords_file:
+    with open(path,"r") as stopwords_file:
         for line in stopwords_file:
             stopwords[line.rstrip("\n")] = 1;
     return stopwords
 
-def preprocessQuery(query):
+def preprocessQuery(query, stopwords_list = None):
     "Preprocesses the query by lowercase, removing stopwords"
     # preprocess the query
     preprocessed_query = []
     query_term_weights = []
     query_term_weight = 1
-    stopwords_list = getStopWordsList()
+    # a long running caller passes the stopwords it has already read
+    if stopwords_list is None:
+        stopwords_list = getStopWordsList()
     query_term_count = 0
     for term in query:
         term = term.lower()
@@ -46,8 +58,13 @@ def preprocessQuery(query):
 
     return terms_in_query_dict
 
+@metrics.timed('dictionary_lookup')
 def searchInDictionaryFile(query_dict):
     "Gets the term information from dictionary file"
+    # binary search the binary dictionary if it was built, else scan the text dictionary
+    if os.path.exists('dictionary.bin'):
+        return termdict.searchInBinaryDictionary(query_dict, 'dictionary.bin')
+
     results_from_dictionary = defaultdict(list)
     with open('dictionary.txt', 'r') as dictionary_file:
         count = 0
@@ -79,63 +96,95 @@ def searchInDictionaryFile(query_dict):
 
         return results_from_dictionary
 
+@metrics.timed('postings_read')
 def calculateDocumentWeights(results_from_dictionary_arg, query_dict):
-    "Read the postings file by fseeking to required lines and calculate document-query similarity scores"
+    "Read the posting lists of the query terms and calculate document-query similarity scores"
     document_query_similarity = defaultdict(float)
-    document_term_weights = defaultdict(lambda : defaultdict(dict))
-
-    with open('postings.txt', 'r') as postings_file:
-        # read the bytes in one line in postings file, so that we can fseek directly to the required line
-        postings_file.seek(0,0)
-        postings_line = postings_file.readline()
-        bytes_in_one_line = postings_file.tell()
-        postings_file.seek(0,0)
-
-        # read the postings file by fseeking to the line and update the dictionaries
-        for term,list in results_from_dictionary_arg.iteritems():
-            postings_file.seek(0,0)
-            # fseek to the required line in postings files
-            postings_file.seek(int(results_from_dictionary_arg[term][1] - 1) * bytes_in_one_line)
-
-            # number of lines to read = as specified in the dictionary file
-            for loop in range(0,int(results_from_dictionary_arg[term][0])):
-
-                postings_line = postings_file.readline()
-                postings_line_tokenized = postings_line.split(",")
-
-                query_term_weight = 0;
-                if query_dict.has_key(term):
-                    query_term_weight = query_dict[term]
-
-                # cumulative wt. of doc += weight of term * the weight by the query term weight as specified in the query
-                if document_query_similarity.has_key(postings_line_tokenized[0]):
-                    document_query_similarity[postings_line_tokenized[0]] += float(postings_line_tokenized[1]) * query_term_weight
-                else:
-                    document_query_similarity[postings_line_tokenized[0]] = float(postings_line_tokenized[1]) * query_term_weight
-
-                # update the dictionary containing the document and term weights of matching terms
-                document_term_weights[postings_line_tokenized[0]][term] = float(postings_line_tokenized[1])
-
-    return document_query_similarity, document_term_weights
-
-def retrieveDocuments(query_dict):
-    "Retrieves the documents, calculates corresponding weights and displays top 10 results"
-    query_dict_local = query_dict.copy()
-
-    results_from_dictionary = searchInDictionaryFile(query_dict_local)
-    document_query_similarity, document_term_weights = calculateDocumentWeights(results_from_dictionary,query_dict)
 
-    # sort and display the top 10 results
-    sorted_document_query_similarity = sorted(document_query_similarity.items(), key=operator.itemgetter(1), reverse=True)
-    for index in range(1,11):
-        if index <= len(sorted_document_query_similarity):
-            print sorted_document_query_similarity[index-1]
+    # decode the binary posting lists directly if the binary index was built, else read the text postings file
+    if os.path.exists('dictionary.bin') and os.path.exists('postings.bin'):
+        posting_lists = postings.readPostingLists(results_from_dictionary_arg, 'postings.bin', 'documents.txt')
+    else:
+        posting_lists = postings.readTextPostingLists(results_from_dictionary_arg, 'postings.txt')
+    for term, posting_list in posting_lists:
+        query_term_weight = query_dict.get(term, 0)
+        for document_name, weight in posting_list:
+            # cumulative wt. of doc += weight of term * the weight by the query term weight as specified in the query
+            document_query_similarity[document_name] += weight * query_term_weight
+
+    return document_query_similarity
+
+
+def retrieveDocuments(query_dict, k = 10, index = None, display = True, conjunctive = False):
+    """Retrieves the documents, calculates corresponding weights and displays the top k results.
+    index is an already opened searchindex.SearchIndex, else the index files of the current directory are used.
+    With conjunctive only the documents holding every query term are returned"""
+    metrics.count('queries')
+    # a segmented index is searched across all its live segments
+    if index is None and segments.isSegmentedIndex('.'):
+        top_documents = segments.searchSegments('.', query_dict, k, conjunctive)
+        if display:
+            for document in top_documents:
+                print document
+        return top_documents
+
+    opened_index = None
+    if index is None and shards.isShardedIndex('.'):
+        # a sharded index is searched by a worker process per shard
+        index = opened_index = coordinator.ShardCoordinator('.')
+    elif index is None and os.path.exists('dictionary.bin') and os.path.exists('postings.bin'):
+        index = opened_index = searchindex.SearchIndex('.')
+
+    if index is not None:
+        try:
+            top_documents = index.topDocuments(query_dict, k, conjunctive)
+        finally:
+            if opened_index is not None:
+                opened_index.close()
+    else:
+        results_from_dictionary = searchInDictionaryFile(query_dict.copy())
+        document_query_similarity = calculateDocumentWeights(results_from_dictionary,query_dict)
+        if conjunctive:
+            # the text postings have no skip pointers: keep the documents found in the postings of every term
+            if len(results_from_dictionary) < len(query_dict):
+                document_query_similarity = {}
+            else:
+                for term in results_from_dictionary.keys():
+                    term_documents = calculateDocumentWeights({term: results_from_dictionary[term]}, query_dict)
+                    document_query_similarity = dict((document_name, score) for document_name, score in document_query_similarity.iteritems() if document_name in term_documents)
+        with metrics.span('ranking'):
+            top_documents = topk.selectTopK(document_query_similarity, k)
+
+    # display the top k results
+    if display:
+        for document in top_documents:
+            print document
+    return top_documents
 
 
 def main():
     "This function is the base caller of retrieve for search engine"
-    query_dict = preprocessQuery(query = sys.argv[1:])
-    retrieveDocuments(query_dict)
+    # optional leading options: "-k N" sets the number of results, "--and" returns only the documents
+    # holding every query term and "--metrics FILE" writes the timings of the query
+    query = sys.argv[1:]
+    k = 10
+    conjunctive = False
+    metrics_path = None
+    while query and query[0] in ('-k', '--and', '--metrics'):
+        if query[0] == '--and':
+            conjunctive = True
+            query = query[1:]
+        elif len(query) < 2:
+            break
+        elif query[0] == '-k':
+            k = int(query[1])
+            query = query[2:]
+        else:
+            metrics_path = query[1]
+            query = query[2:]
+    metrics.configure(metrics_path)
+    query_dict = preprocessQuery(query = query)
+    retrieveDocuments(query_dict, k, conjunctive = conjunctive)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,196 @@
+"""Module searchindex:
+    This module keeps the binary dictionary, the binary postings and the document names of an
+    index directory open, so that several queries can be answered without reopening them.
+
+    A build writes the index files under temporary names and renames them into place while it holds
+    the publish lock of the index directory exclusively. SearchIndex opens the files while it holds
+    the lock shared, so it opens either every file of the old index or every file of the new one.
+	"""
+
+import os
+import mmap
+import fcntl
+import struct
+import functools
+from contextlib import contextmanager
+import termdict
+import postings
+import champions
+import topk
+import metrics
+
+# Lock file of an index directory, see publishLock
+PUBLISH_LOCK = 'index.lock'
+
+# Errors decoding index files that do not match each other or are damaged, which fail the query instead of the server
+INDEX_ERRORS = (ValueError, IndexError, TypeError, struct.error)
+
+# Files whose change means the index was rebuilt, then those of the champion lists and of a sharded index
+INDEX_FILES = ('dictionary.bin', 'postings.bin', 'documents.txt', champions.CHAMPION_DICTIONARY, champions.CHAMPION_POSTINGS, 'shards.txt', 'statistics.txt')
+
+def indexSignature(directory):
+    """ Returns the modification time, size and inode of the index files, which change when the index is rebuilt"""
+    signature = []
+    for filename in INDEX_FILES:
+        try:
+            status = os.stat(os.path.join(directory, filename))
+        except OSError:
+            signature.append(None)
+        else:
+            signature.append((status.st_mtime, status.st_size, status.st_ino))
+    return tuple(signature)
+
+@contextmanager
+def publishLock(directory, exclusive = False):
+    """ Holds the publish lock of an index directory: exclusive while a build renames its files into place, shared
+        while a reader opens them. A reader of an index built without the lock file opens it without the lock"""
+    lock_path = os.path.join(directory, PUBLISH_LOCK)
+    if not exclusive and not os.path.exists(lock_path):
+        yield
+        return
+    with open(lock_path, 'a' if exclusive else 'r') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class SearchIndex(object):
+    """ A binary index opened once. The files are memory mapped, so lookups are safe from several threads"""
+
+    def __init__(self, directory = '.'):
+        self.directory = directory
+        # the files are opened together, so that they all belong to the same build
+        with publishLock(directory):
+            self.signature = indexSignature(directory)
+            self.dictionary_file = open(os.path.join(directory, 'dictionary.bin'), 'rb')
+            self.dictionary_map = mmap.mmap(self.dictionary_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.postings_file = open(os.path.join(directory, 'postings.bin'), 'rb')
+            self.postings_map = mmap.mmap(self.postings_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.document_names = postings.readDocumentsFile(os.path.join(directory, 'documents.txt'))
+            self.champion_dictionary_file = self.champion_dictionary_map = None
+            self.champion_postings_file = self.champion_postings_map = None
+            # an empty champion postings file, when no term has more postings than the champions, cannot be mapped nor help
+            if champions.hasChampionLists(directory) and os.path.getsize(os.path.join(directory, champions.CHAMPION_POSTINGS)) > 0:
+                self.champion_dictionary_file = open(os.path.join(directory, champions.CHAMPION_DICTIONARY), 'rb')
+                self.champion_dictionary_map = mmap.mmap(self.champion_dictionary_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.champion_postings_file = open(os.path.join(directory, champions.CHAMPION_POSTINGS), 'rb')
+                self.champion_postings_map = mmap.mmap(self.champion_postings_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @metrics.timed('dictionary_lookup')
+    def searchTerms(self, query_dict):
+        """ Returns the binary dictionary record of every query term found in the dictionary"""
+        results_from_dictionary = {}
+        for term in query_dict:
+            record = termdict.findTerm(self.dictionary_map, term)
+            if record is not None:
+                results_from_dictionary[term] = record
+        return results_from_dictionary
+
+    @metrics.timed('postings_read')
+    def readPostingLists(self, results_from_dictionary):
+        """ Decodes the posting lists of the dictionary records. Returns a list of (term, max weight, document ids, weights)"""
+        posting_lists = []
+        for term, record in results_from_dictionary.iteritems():
+            document_frequency, start_line, offset, length, max_weight = record
+            document_ids, weights = postings.decodePostingListArrays(self.postings_map, offset, length, document_frequency, max_weight)
+            posting_lists.append((term, max_weight, document_ids, weights))
+            metrics.count('postings_read', document_frequency)
+        return posting_lists
+
+    @metrics.timed('postings_read')
+    def postingListViews(self, results_from_dictionary):
+        """ Returns a (term, max weight, document ids, weights) of numpy arrays for every dictionary record.
+            The document ids are read in place from the mapped postings, without copying them"""
+        posting_lists = []
+        for term, record in results_from_dictionary.iteritems():
+            document_frequency, start_line, offset, length, max_weight = record
+            document_ids, quantized_weights = postings.postingListViews(self.postings_map, offset, length, document_frequency)
+            posting_lists.append((term, max_weight, document_ids, postings.dequantizeWeight(quantized_weights, max_weight)))
+            metrics.count('postings_read', document_frequency)
+        return posting_lists
+
+    def postingCursors(self, results_from_dictionary):
+        """ Returns a (term, postings.PostingCursor) for every dictionary record"""
+        return [(term, postings.PostingCursor(self.postings_map, offset, length, document_frequency, max_weight))
+                for term, (document_frequency, start_line, offset, length, max_weight) in results_from_dictionary.iteritems()]
+
+    def readPostings(self, results_from_dictionary):
+        """ Returns a (term, max weight, document ids, weights) for every dictionary record, as numpy views of the mapped
+            postings if numpy is installed"""
+        if postings.viewsAvailable():
+            return self.postingListViews(results_from_dictionary)
+        return self.readPostingLists(results_from_dictionary)
+
+    def rankPostingLists(self, query_dict, posting_lists, k):
+        """ Returns the k best (document name, score) of the posting lists of readPostings of the query terms"""
+        posting_lists = [(query_dict[term], max_weight, document_ids, weights) for term, max_weight, document_ids, weights in posting_lists]
+        with metrics.span('ranking'):
+            if postings.viewsAvailable():
+                # add the decoded posting lists to the scores of their documents a list at a time
+                top_documents = topk.accumulateTopK(posting_lists, len(self.document_names), k)
+            else:
+                # walk the document id sorted posting lists, skipping the documents that cannot make the top k
+                top_documents = topk.maxScoreTopK(posting_lists, k)
+        return [(self.document_names[document_id], score) for document_id, score in top_documents]
+
+    def rankConjunctive(self, query_dict, results_from_dictionary, k):
+        """ Returns the k best (document name, score) of the documents holding every query term"""
+        # a term missing from the dictionary is in no document
+        if len(results_from_dictionary) < len(query_dict):
+            return []
+        posting_cursors = [(query_dict[term], cursor) for term, cursor in self.postingCursors(results_from_dictionary)]
+        with metrics.span('ranking'):
+            top_documents = topk.conjunctiveTopK(posting_cursors, k)
+        return [(self.document_names[document_id], score) for document_id, score in top_documents]
+
+    def rankChampions(self, query_dict, results_from_dictionary, k, exact = True):
+        """ Returns the k best (document name, score) from the champion lists of the query terms, or None if they do not
+            settle the top k. Without exact, returns the best documents of the champion lists, see topk.championTopK"""
+        champion_lists = []
+        for term, (document_frequency, start_line, offset, length, max_weight) in results_from_dictionary.iteritems():
+            champion_record = termdict.findTerm(self.champion_dictionary_map, term)
+            if champion_record is None:
+                # a short list is its own champion list
+                document_ids, quantized_weights = postings.postingListArrays(self.postings_map, offset, length, document_frequency)
+                threshold = 0.0
+                lookup = None
+            else:
+                champion_count, zero, champion_offset, champion_length, max_weight = champion_record
+                document_ids, quantized_weights = postings.postingListArrays(self.champion_postings_map, champion_offset, champion_length, champion_count)
+                # every posting but the champions weighs at most the lightest champion
+                threshold = postings.dequantizeWeight(min(quantized_weights), max_weight)
+                lookup = functools.partial(postings.lookupWeights, self.postings_map, offset, length, document_frequency, max_weight)
+            weights = [postings.dequantizeWeight(quantized_weight, max_weight) for quantized_weight in quantized_weights]
+            champion_lists.append((query_dict[term], document_ids, weights, threshold, lookup))
+        with metrics.span('ranking'):
+            top_documents = topk.championTopK(champion_lists, k, exact)
+        if top_documents is None:
+            return None
+        return [(self.document_names[document_id], score) for document_id, score in top_documents]
+
+    def topDocuments(self, query_dict, k, conjunctive = False):
+        """ Returns the k best (document name, score) for the query terms and their weights.
+            With conjunctive only the documents holding every query term are returned"""
+        results_from_dictionary = self.searchTerms(query_dict)
+        if conjunctive:
+            return self.rankConjunctive(query_dict, results_from_dictionary, k)
+        if self.champion_postings_map is not None:
+            top_documents = self.rankChampions(query_dict, results_from_dictionary, k)
+            if top_documents is not None:
+                metrics.count('champion_settled')
+                return top_documents
+            metrics.count('champion_fallback')
+        return self.rankPostingLists(query_dict, self.readPostings(results_from_dictionary), k)
+
+    def close(self):
+        """ Unmaps and closes the index files"""
+        self.dictionary_map.close()
+        self.dictionary_file.close()
+        self.postings_map.close()
+        self.postings_file.close()
+        if self.champion_postings_map is not None:
+            self.champion_dictionary_map.close()
+            self.champion_dictionary_file.close()
+            self.champion_postings_map.close()
+            self.champion_postings_file.close()
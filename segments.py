@@ -0,0 +1,398 @@
+"""Module segments:
+    This module keeps an index as a set of small immutable segments, so that documents can be
+    added and deleted without rebuilding the whole index.
+
+    An index directory holds segments.txt, the list of live segments, and one directory per
+    segment with the binary dictionary, the postings and the documents of that segment.
+    Postings hold raw term frequencies, not weights, so that a segment never has to be rewritten
+    when the rest of the corpus changes. Deleted documents are listed in the tombstones.txt of
+    their segment until a merge drops them.
+
+    Corpus wide statistics are computed at query time over the live documents of all segments:
+        number of documents      documents of all segments that are not deleted
+        document frequency       live postings of the term in all segments
+        corpus count             sum of the live term frequencies of the term
+    and term weights use the same formula as calculateWeights in index.py. So a segmented index
+    ranks documents exactly as a full rebuild of the live documents would.
+
+    Segments are merged with a tiered policy: a segment is in tier t if it holds fewer than
+    MIN_SEGMENT_DOCUMENTS * MERGE_FACTOR^t live documents, and the MERGE_FACTOR smallest segments
+    of a tier are merged as soon as the tier holds that many.
+
+    usage: python segments.py merge <index-dir>
+	"""
+
+import sys
+import os
+import math
+import fcntl
+import mmap
+import shutil
+import subprocess
+from contextlib import contextmanager
+import termdict
+import topk
+import metrics
+
+# Maximum tf normalization constant, as in index.py
+a = 0.4
+
+MANIFEST = 'segments.txt'
+LOCK = 'segments.lock'
+MERGE_LOCK = 'merge.lock'
+
+# Number of segments of a tier merged together
+MERGE_FACTOR = 10
+# Segments with fewer live documents than this are all in the lowest tier
+MIN_SEGMENT_DOCUMENTS = 10
+
+@contextmanager
+def lockIndex(index_directory, lock_name = LOCK):
+    """ Holds an exclusive lock on the index while the manifest or the tombstones are changed"""
+    with open(os.path.join(index_directory, lock_name), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def isSegmentedIndex(index_directory):
+    """ Returns True if the directory holds a segmented index"""
+    return os.path.exists(os.path.join(index_directory, MANIFEST))
+
+def readManifest(index_directory):
+    """ Returns the number of the next segment and the names of the live segments"""
+    if not isSegmentedIndex(index_directory):
+        return 0, []
+    with open(os.path.join(index_directory, MANIFEST), 'r') as manifest_file:
+        next_segment_number = int(manifest_file.readline().split()[1])
+        return next_segment_number, [line.strip() for line in manifest_file if line.strip()]
+
+def writeManifest(index_directory, next_segment_number, segment_names):
+    """ Replaces the manifest atomically, so readers see either the old or the new list of segments"""
+    temporary_path = os.path.join(index_directory, MANIFEST + '.tmp')
+    with open(temporary_path, 'w') as manifest_file:
+        manifest_file.write('next ' + str(next_segment_number) + '\n')
+        for segment_name in segment_names:
+            manifest_file.write(segment_name + '\n')
+    os.rename(temporary_path, os.path.join(index_directory, MANIFEST))
+
+def reserveSegmentName(index_directory):
+    """ Returns an unused segment name"""
+    with lockIndex(index_directory):
+        next_segment_number, segment_names = readManifest(index_directory)
+        writeManifest(index_directory, next_segment_number + 1, segment_names)
+    return 'segment_' + str(next_segment_number)
+
+def writeSegment(segment_directory, term_frequency):
+    """ Writes a segment for term_frequency, a dict of document name -> dict of term -> frequency"""
+    if not os.path.exists(segment_directory):
+        os.makedirs(segment_directory)
+
+    document_names = sorted(document_name for document_name in term_frequency if term_frequency[document_name])
+    with open(os.path.join(segment_directory, 'documents.txt'), 'w') as documents_file:
+        for document_name in document_names:
+            documents_file.write(document_name + '\t' + str(max(term_frequency[document_name].itervalues())) + '\n')
+
+    # invert the frequencies into per-term posting lists of (local document id, frequency)
+    term_postings = {}
+    for document_id in range(0, len(document_names)):
+        for term, frequency in term_frequency[document_names[document_id]].iteritems():
+            term_postings.setdefault(term, []).append((document_id, frequency))
+
+    dictionary_entries = []
+    postings_position = 0
+    with open(os.path.join(segment_directory, 'postings.bin'), 'wb') as postings_file:
+        for term in sorted(term_postings):
+            encoded_posting_list = encodeFrequencyPostingList(term_postings[term])
+            postings_file.write(encoded_posting_list)
+            dictionary_entries.append((term, len(term_postings[term]), 0, postings_position, len(encoded_posting_list), max(frequency for document_id, frequency in term_postings[term])))
+            postings_position += len(encoded_posting_list)
+    termdict.writeBinaryDictionary(os.path.join(segment_directory, 'dictionary.bin'), dictionary_entries)
+    open(os.path.join(segment_directory, 'tombstones.txt'), 'w').close()
+
+def encodeVarint(value):
+    """ Encodes a non negative integer in 7 bit groups, low group first"""
+    encoded = []
+    while value >= 0x80:
+        encoded.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    encoded.append(chr(value))
+    return ''.join(encoded)
+
+def decodeVarint(data, position):
+    """ Decodes the varint starting at position. Returns the value and the position after it"""
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[position])
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def encodeFrequencyPostingList(posting_list):
+    """ Encodes a list of (document id, frequency) sorted by document id as varint gaps followed by varint frequencies"""
+    encoded = []
+    previous_document_id = 0
+    for document_id, frequency in posting_list:
+        encoded.append(encodeVarint(document_id - previous_document_id))
+        previous_document_id = document_id
+    for document_id, frequency in posting_list:
+        encoded.append(encodeVarint(frequency))
+    return ''.join(encoded)
+
+def decodeFrequencyPostingList(data, offset, document_frequency):
+    """ Decodes a posting list written by encodeFrequencyPostingList. Returns the document ids and the frequencies"""
+    document_ids = []
+    frequencies = []
+    document_id = 0
+    position = offset
+    for loop in range(0, document_frequency):
+        gap, position = decodeVarint(data, position)
+        document_id += gap
+        document_ids.append(document_id)
+    for loop in range(0, document_frequency):
+        frequency, position = decodeVarint(data, position)
+        frequencies.append(frequency)
+    return document_ids, frequencies
+
+class Segment(object):
+    """ An opened segment"""
+
+    def __init__(self, index_directory, name):
+        self.name = name
+        self.directory = os.path.join(index_directory, name)
+        self.document_names = []
+        self.max_frequencies = []
+        with open(os.path.join(self.directory, 'documents.txt'), 'r') as documents_file:
+            for line in documents_file:
+                document_name, max_frequency = line.rstrip('\n').split('\t')
+                self.document_names.append(document_name)
+                self.max_frequencies.append(int(max_frequency))
+        self.tombstones = readTombstones(self.directory)
+        self.dictionary_file = open(os.path.join(self.directory, 'dictionary.bin'), 'rb')
+        self.dictionary_map = mmap.mmap(self.dictionary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.postings_file = open(os.path.join(self.directory, 'postings.bin'), 'rb')
+        self.postings_map = None
+        if os.fstat(self.postings_file.fileno()).st_size > 0:
+            self.postings_map = mmap.mmap(self.postings_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def liveDocumentCount(self):
+        return len(self.document_names) - len(self.tombstones)
+
+    def readPostings(self, term):
+        """ Returns the live (local document id, frequency) postings of the term"""
+        record = termdict.findTerm(self.dictionary_map, term)
+        if record is None:
+            return []
+        return self.livePostings(record)
+
+    def livePostings(self, record):
+        """ Returns the (local document id, frequency) postings of a dictionary record, without deleted documents"""
+        document_frequency, start_line, offset, length, max_frequency = record
+        document_ids, frequencies = decodeFrequencyPostingList(self.postings_map, offset, document_frequency)
+        return [(document_ids[index], frequencies[index]) for index in range(0, document_frequency) if document_ids[index] not in self.tombstones]
+
+    def readAllPostings(self):
+        """ Yields (term, live postings) for every term of the segment"""
+        magic, version, number_of_terms = termdict.readHeader(self.dictionary_map)
+        for term_number in range(0, number_of_terms):
+            term = termdict.readTerm(self.dictionary_map, term_number)
+            live_postings = self.livePostings(termdict.readRecord(self.dictionary_map, term_number))
+            if live_postings:
+                yield term, live_postings
+
+    def close(self):
+        self.dictionary_map.close()
+        self.dictionary_file.close()
+        if self.postings_map is not None:
+            self.postings_map.close()
+        self.postings_file.close()
+
+def readTombstones(segment_directory):
+    """ Returns the set of deleted local document ids of a segment"""
+    with open(os.path.join(segment_directory, 'tombstones.txt'), 'r') as tombstones_file:
+        return set(int(line) for line in tombstones_file if line.strip())
+
+def openSegments(index_directory):
+    """ Opens the live segments. Retries if a merge removes a segment while they are being opened"""
+    for attempt in range(0, 3):
+        next_segment_number, segment_names = readManifest(index_directory)
+        opened_segments = []
+        try:
+            for segment_name in segment_names:
+                opened_segments.append(Segment(index_directory, segment_name))
+            return opened_segments
+        except IOError:
+            for segment in opened_segments:
+                segment.close()
+    raise IOError("ERROR:[SearchEngine] Unable to open the segments of " + index_directory)
+
+def deleteDocumentsInSegments(index_directory, segment_names, document_names):
+    """ Tombstones the documents in the given segments. The index lock must be held. Returns the number deleted"""
+    document_names = set(document_names)
+    deleted = 0
+    for segment_name in segment_names:
+        segment_directory = os.path.join(index_directory, segment_name)
+        tombstones = readTombstones(segment_directory)
+        new_tombstones = []
+        with open(os.path.join(segment_directory, 'documents.txt'), 'r') as documents_file:
+            for document_id, line in enumerate(documents_file):
+                if line.split('\t')[0] in document_names and document_id not in tombstones:
+                    new_tombstones.append(document_id)
+        if new_tombstones:
+            with open(os.path.join(segment_directory, 'tombstones.txt'), 'a') as tombstones_file:
+                for document_id in new_tombstones:
+                    tombstones_file.write(str(document_id) + '\n')
+            deleted += len(new_tombstones)
+    return deleted
+
+def deleteDocuments(index_directory, document_names):
+    """ Deletes documents from the index by name. Returns the number of documents deleted"""
+    with lockIndex(index_directory):
+        next_segment_number, segment_names = readManifest(index_directory)
+        return deleteDocumentsInSegments(index_directory, segment_names, document_names)
+
+def addSegment(index_directory, term_frequency):
+    """ Adds the documents of term_frequency as a new segment. Documents already in the index are replaced"""
+    if not os.path.exists(index_directory):
+        os.makedirs(index_directory)
+    segment_name = reserveSegmentName(index_directory)
+    writeSegment(os.path.join(index_directory, segment_name), term_frequency)
+
+    with lockIndex(index_directory):
+        next_segment_number, segment_names = readManifest(index_directory)
+        # older copies of the added documents are deleted
+        deleteDocumentsInSegments(index_directory, segment_names, term_frequency.keys())
+        writeManifest(index_directory, next_segment_number, segment_names + [segment_name])
+    return segment_name
+
+def segmentTier(live_documents):
+    """ Returns the tier of a segment with the given number of live documents"""
+    tier = 0
+    limit = MIN_SEGMENT_DOCUMENTS
+    while live_documents >= limit:
+        tier += 1
+        limit *= MERGE_FACTOR
+    return tier
+
+def selectMerge(segment_sizes):
+    """ Returns the names of the segments to merge next, or None. segment_sizes is a list of (name, live documents)"""
+    tiers = {}
+    for segment_name, live_documents in segment_sizes:
+        tiers.setdefault(segmentTier(live_documents), []).append((live_documents, segment_name))
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= MERGE_FACTOR:
+            return [segment_name for live_documents, segment_name in sorted(tiers[tier])[:MERGE_FACTOR]]
+    return None
+
+def mergeSegments(index_directory, segment_names):
+    """ Merges the segments into one, dropping their deleted documents"""
+    merged_segments = [Segment(index_directory, segment_name) for segment_name in segment_names]
+    try:
+        # rebuild the term frequencies of the live documents
+        term_frequency = {}
+        for segment in merged_segments:
+            for term, live_postings in segment.readAllPostings():
+                for document_id, frequency in live_postings:
+                    term_frequency.setdefault(segment.document_names[document_id], {})[term] = frequency
+        merged_tombstones = dict((segment.name, set(segment.tombstones)) for segment in merged_segments)
+    finally:
+        for segment in merged_segments:
+            segment.close()
+
+    merged_name = reserveSegmentName(index_directory)
+    writeSegment(os.path.join(index_directory, merged_name), term_frequency)
+
+    with lockIndex(index_directory):
+        next_segment_number, live_segment_names = readManifest(index_directory)
+        # documents deleted while the merge ran are deleted in the merged segment too
+        deleted_during_merge = []
+        for segment in merged_segments:
+            for document_id in readTombstones(segment.directory) - merged_tombstones[segment.name]:
+                deleted_during_merge.append(segment.document_names[document_id])
+        deleteDocumentsInSegments(index_directory, [merged_name], deleted_during_merge)
+        # the merged segment takes the place of the first merged segment
+        position = live_segment_names.index(segment_names[0])
+        live_segment_names = [segment_name for segment_name in live_segment_names if segment_name not in segment_names]
+        live_segment_names.insert(min(position, len(live_segment_names)), merged_name)
+        writeManifest(index_directory, next_segment_number, live_segment_names)
+
+    for segment_name in segment_names:
+        shutil.rmtree(os.path.join(index_directory, segment_name), ignore_errors = True)
+    return merged_name
+
+def segmentSizes(index_directory):
+    """ Returns (name, live documents) of every live segment"""
+    segment_sizes = []
+    for segment in openSegments(index_directory):
+        segment_sizes.append((segment.name, segment.liveDocumentCount()))
+        segment.close()
+    return segment_sizes
+
+def maybeMerge(index_directory):
+    """ Merges segments until the merge policy selects no more merges. Only one merger runs at a time"""
+    with open(os.path.join(index_directory, MERGE_LOCK), 'a') as merge_lock_file:
+        try:
+            fcntl.flock(merge_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            # another merger is running and will pick up the new segments
+            return
+        try:
+            while True:
+                segment_names = selectMerge(segmentSizes(index_directory))
+                if segment_names is None:
+                    break
+                mergeSegments(index_directory, segment_names)
+        finally:
+            fcntl.flock(merge_lock_file, fcntl.LOCK_UN)
+
+def startBackgroundMerge(index_directory):
+    """ Starts a merger process that outlives the caller"""
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), 'merge', index_directory], close_fds = True)
+
+@metrics.timed('segment_search')
+def searchSegments(index_directory, query_dict, k, conjunctive = False):
+    """ Returns the k best (document name, score) over all live segments, weighting terms with corpus wide statistics.
+        With conjunctive only the documents holding every query term are returned"""
+    opened_segments = openSegments(index_directory)
+    try:
+        number_of_documents = sum(segment.liveDocumentCount() for segment in opened_segments)
+        document_scores = {}
+        # number of query terms of every scored document
+        document_terms = {}
+        for term, query_term_weight in query_dict.iteritems():
+            term_postings = [(segment, segment.readPostings(term)) for segment in opened_segments]
+            document_frequency = sum(len(live_postings) for segment, live_postings in term_postings)
+            # terms that occur only once in the corpus are not indexed
+            if document_frequency == 0 or sum(frequency for segment, live_postings in term_postings for document_id, frequency in live_postings) == 1:
+                if conjunctive:
+                    return []
+                continue
+            inverse_document_frequency = math.log(number_of_documents / document_frequency)
+            for segment, live_postings in term_postings:
+                for document_id, frequency in live_postings:
+                    weight = a + (1 - a) * frequency / segment.max_frequencies[document_id]
+                    weight *= inverse_document_frequency
+                    document_name = segment.document_names[document_id]
+                    document_scores[document_name] = document_scores.get(document_name, 0.0) + weight * query_term_weight
+                    document_terms[document_name] = document_terms.get(document_name, 0) + 1
+        if conjunctive:
+            # segment postings are not sorted across segments, so the union is scored and filtered
+            document_scores = dict((document_name, score) for document_name, score in document_scores.iteritems() if document_terms[document_name] == len(query_dict))
+        return topk.selectTopK(document_scores, k)
+    finally:
+        for segment in opened_segments:
+            segment.close()
+
+def main():
+    "This function is the base caller of the background merger"
+    if len(sys.argv) != 3 or sys.argv[1] != 'merge':
+        print "usage: python segments.py merge <index-dir>"
+        return 1
+    maybeMerge(sys.argv[2])
+
+if __name__ == "__main__":
+    sys.exit(main())
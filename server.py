@@ -0,0 +1,265 @@
+"""Module server:
+    This module keeps the stopwords and the binary index resident and answers plain and weighted
+    queries with retrieveDocuments, reporting the latency of every query. A sharded index is
+    searched through coordinator.py. Results are cached by
+    querycache, and the index is reopened and the cache dropped when the index files change.
+
+    usage: python server.py <index-dir> --batch            newline delimited queries on stdin
+           python server.py <index-dir> --http PORT        GET /search?q=woods+kids&k=5&mode=and, GET /stats
+           python server.py <index-dir> --socket PATH      newline delimited queries on a unix socket
+
+    With --metrics FILE, GET /metrics also returns the spans and counters in the Prometheus text format.
+
+    A query line holds the arguments of retrieve.py. If its first word is "wt" the rest holds the
+    arguments of retrieveWt.py:
+        woods kids
+        -k 5 woods kids
+        --and woods kids           only the documents holding every term
+        wt 0.5 woods 2 kids
+	"""
+
+import sys
+import os
+import time
+import json
+import signal
+import threading
+import argparse
+import urlparse
+import collections
+import SocketServer
+import BaseHTTPServer
+import retrieve
+import retrieveWt
+import searchindex
+import querycache
+import shards
+import coordinator
+import metrics
+
+# The latency statistics cover this many of the latest queries, so a long running server keeps a bounded window
+LATENCY_WINDOW = 10000
+
+def openIndex(index_directory):
+    """ Opens a sharded index with a coordinator, else the binary index"""
+    if shards.isShardedIndex(index_directory):
+        return coordinator.ShardCoordinator(index_directory)
+    return searchindex.SearchIndex(index_directory)
+
+def parseQueryLine(line, stopwords):
+    """ Returns the preprocessed query dict, the number of results and whether the query is conjunctive of a query line"""
+    query = line.split()
+    weighted = len(query) > 0 and query[0] == 'wt'
+    if weighted:
+        query = query[1:]
+    k = 10
+    conjunctive = False
+    while query and query[0] in ('-k', '--and'):
+        if query[0] == '--and':
+            conjunctive = True
+            query = query[1:]
+        elif len(query) >= 2:
+            k = int(query[1])
+            query = query[2:]
+        else:
+            break
+
+    if weighted:
+        return retrieveWt.preprocessQuery(query, stopwords), k, conjunctive
+    return retrieve.preprocessQuery(query, stopwords), k, conjunctive
+
+class QueryServer(object):
+    """ Answers queries against an index that is opened once"""
+
+    def __init__(self, index_directory, stopwords_path = "stopwords.txt", cache_entries = 1024, cache_bytes = 64 * 1024 * 1024):
+        self.stopwords = retrieve.getStopWordsList(stopwords_path)
+        self.index_directory = index_directory
+        self.index = openIndex(index_directory)
+        self.index_lock = threading.Lock()
+        # number of queries running on every open index, by id
+        self.index_users = {}
+        self.cache = querycache.QueryCache(cache_entries, cache_bytes)
+        self.latency_lock = threading.Lock()
+        self.queries = 0
+        self.latencies = collections.deque(maxlen = LATENCY_WINDOW)
+
+    def currentIndex(self):
+        """ Returns the opened index, reopening it if the index files changed. Returns it with its signature.
+            The caller must pass the index to releaseIndex once its query is answered"""
+        signature = searchindex.indexSignature(self.index_directory)
+        with self.index_lock:
+            if signature != self.index.signature:
+                old_index = self.index
+                self.index = openIndex(self.index_directory)
+                # queries still running on the old index keep it open until the last of them is done
+                if id(old_index) not in self.index_users:
+                    old_index.close()
+            self.index_users[id(self.index)] = self.index_users.get(id(self.index), 0) + 1
+            return self.index, self.index.signature
+
+    def releaseIndex(self, index):
+        """ Ends a query on an index of currentIndex. A replaced index is closed after its last query"""
+        with self.index_lock:
+            self.index_users[id(index)] -= 1
+            if self.index_users[id(index)] == 0:
+                del self.index_users[id(index)]
+                if index is not self.index:
+                    index.close()
+
+    def answer(self, line):
+        """ Answers one query line. Returns a dict of the query, its results and its latency in milliseconds"""
+        query_start_time = time.time()
+        query_dict, k, conjunctive = parseQueryLine(line, self.stopwords)
+        index, signature = self.currentIndex()
+        try:
+            top_documents = self.cache.get(query_dict, k, signature, conjunctive)
+            cached = top_documents is not None
+            if cached:
+                metrics.count('cache_hits')
+            if not cached:
+                top_documents = retrieve.retrieveDocuments(query_dict, k, index = index, display = False, conjunctive = conjunctive)
+                self.cache.put(query_dict, k, signature, top_documents, conjunctive)
+        finally:
+            self.releaseIndex(index)
+
+        latency = (time.time() - query_start_time) * 1000
+        with self.latency_lock:
+            self.queries += 1
+            self.latencies.append(latency)
+        return {'query': line.strip(), 'results': top_documents, 'cached': cached, 'latency_ms': latency}
+
+    def statistics(self):
+        """ Returns the number of queries answered, the mean, median, 99th percentile and max latency of the last
+            LATENCY_WINDOW of them and the cache counters"""
+        with self.latency_lock:
+            queries = self.queries
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {'queries': 0, 'cache': self.cache.statistics()}
+        return {
+            'queries': queries,
+            'cache': self.cache.statistics(),
+            'mean_ms': sum(latencies) / len(latencies),
+            'p50_ms': latencies[len(latencies) // 2],
+            'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'max_ms': latencies[-1],
+        }
+
+    def close(self):
+        self.index.close()
+
+def answerLine(query_server, line):
+    """ Answers a query line as a json line. Bad queries get an error instead of stopping the server"""
+    try:
+        return json.dumps(query_server.answer(line)) + '\n'
+    except searchindex.INDEX_ERRORS as error:
+        return json.dumps({'query': line.strip(), 'error': str(error)}) + '\n'
+
+def serveBatch(query_server, input_stream, output_stream):
+    """ Answers every non empty line of input_stream"""
+    # readline instead of iterating the file, which reads ahead and would hold back answers
+    for line in iter(input_stream.readline, ''):
+        if line.strip():
+            output_stream.write(answerLine(query_server, line))
+            output_stream.flush()
+
+class QueryStreamHandler(SocketServer.StreamRequestHandler):
+    """ Answers the newline delimited queries of a socket connection"""
+
+    def handle(self):
+        serveBatch(self.server.query_server, self.rfile, self.wfile)
+
+class UnixQueryServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+class QueryHTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers GET /search?q=...&k=...&mode=and|or, GET /weighted?q=...&k=...&mode=and|or, GET /stats and GET /metrics"""
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        parameters = urlparse.parse_qs(url.query)
+        query_server = self.server.query_server
+
+        if url.path == '/stats':
+            self.sendJson(200, query_server.statistics())
+            return
+        if url.path == '/metrics':
+            self.sendText(200, metrics.formatPrometheus(metrics.snapshot()))
+            return
+        if url.path not in ('/search', '/weighted') or 'q' not in parameters:
+            self.sendJson(404, {'error': 'use /search?q=..., /weighted?q=..., /stats or /metrics'})
+            return
+
+        line = parameters['q'][0]
+        if 'k' in parameters:
+            line = '-k ' + parameters['k'][0] + ' ' + line
+        if parameters.get('mode', ['or'])[0] == 'and':
+            line = '--and ' + line
+        if url.path == '/weighted':
+            line = 'wt ' + line
+        try:
+            self.sendJson(200, query_server.answer(line))
+        except searchindex.INDEX_ERRORS as error:
+            self.sendJson(400, {'error': str(error)})
+
+    def sendJson(self, status, body):
+        self.sendText(status, json.dumps(body), 'application/json')
+
+    def sendText(self, status, response, content_type = 'text/plain; version=0.0.4'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *arguments):
+        pass
+
+class HTTPQueryServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def stopServer(signal_number, frame):
+    "This function stops the server on SIGTERM as on Ctrl-C, so the statistics and metrics are still written"
+    raise KeyboardInterrupt
+
+def parseArguments():
+    "This function parses the command line"
+    parser = argparse.ArgumentParser(description = "Answers queries against a resident index")
+    parser.add_argument("index_directory")
+    parser.add_argument("--stopwords", default = "stopwords.txt", help = "stop words file")
+    parser.add_argument("--cache-entries", type = int, default = 1024, help = "most query results cached, 0 disables the cache")
+    parser.add_argument("--cache-megabytes", type = float, default = 64, help = "most memory used by cached query results")
+    metrics.addArgument(parser)
+    mode = parser.add_mutually_exclusive_group(required = True)
+    mode.add_argument("--batch", action = "store_true", help = "answer newline delimited queries from stdin")
+    mode.add_argument("--http", type = int, metavar = "PORT", help = "answer queries over http on localhost")
+    mode.add_argument("--socket", metavar = "PATH", help = "answer newline delimited queries on a unix socket")
+    return parser.parse_args()
+
+def main():
+    "This function is the base caller of the query server"
+    arguments = parseArguments()
+    metrics.configure(arguments.metrics)
+    signal.signal(signal.SIGTERM, stopServer)
+    query_server = QueryServer(arguments.index_directory, arguments.stopwords, arguments.cache_entries, int(arguments.cache_megabytes * 1024 * 1024))
+    try:
+        if arguments.batch:
+            serveBatch(query_server, sys.stdin, sys.stdout)
+        elif arguments.http is not None:
+            network_server = HTTPQueryServer(('127.0.0.1', arguments.http), QueryHTTPHandler)
+            network_server.query_server = query_server
+            network_server.serve_forever()
+        else:
+            if os.path.exists(arguments.socket):
+                os.remove(arguments.socket)
+            network_server = UnixQueryServer(arguments.socket, QueryStreamHandler)
+            network_server.query_server = query_server
+            network_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stderr.write(json.dumps(query_server.statistics()) + '\n')
+        query_server.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""Module shards:
+    This module partitions the corpus by document into shards, each with its own binary index,
+    so that the shards can be built and served by separate processes.
+
+    A document goes to shard crc32(name) mod the number of shards. The index is built in two passes:
+        1. every shard counts the term frequencies of its documents and reports its number of
+           documents, and the document frequency, corpus count and largest normalized term
+           frequency of every term. The reports are summed into statistics.txt.
+        2. every shard computes its weights with the corpus wide statistics of statistics.txt and
+           writes its dictionary and postings, quantizing the weights against the largest weight of
+           the term in the whole corpus.
+    So a document scores exactly as in an index of the whole corpus, and the top k of the corpus is
+    the best k of the top k of every shard. The shards only share statistics.txt, so pass 2 can
+    run anywhere the tokenized files of a shard and statistics.txt are.
+
+    An index directory holds shards.txt, the list of shard directories, statistics.txt and one
+    directory per shard. coordinator.py answers queries over the shards. Every build writes its
+    shards to new directories, shard-<build>-<shard>, and renames its shards.txt into place, so a
+    server reopening the index opens every shard of one build. The shards of the build before stay
+    for servers still opening them, older ones are removed.
+	"""
+
+import os
+import re
+import math
+import shutil
+import zlib
+import multiprocessing
+from collections import defaultdict
+
+MANIFEST = 'shards.txt'
+STATISTICS = 'statistics.txt'
+
+def isShardedIndex(index_directory):
+    return os.path.exists(os.path.join(index_directory, MANIFEST))
+
+def shardOf(document_name, number_of_shards):
+    """ Returns the shard number of a document"""
+    return (zlib.crc32(document_name) & 0xffffffff) % number_of_shards
+
+# Shard directories, of this version and of the builds that named them by shard number only
+SHARD_DIRECTORY = re.compile(r'^shard-(?:(\d+)-)?\d+$')
+
+def shardName(build_number, shard_number):
+    return 'shard-%d-%03d' % (build_number, shard_number)
+
+def nextBuildNumber(index_directory):
+    """ Returns the number of a new build of the index, above the number of every shard directory in it"""
+    build_numbers = [0]
+    for filename in os.listdir(index_directory):
+        match = SHARD_DIRECTORY.match(filename)
+        if match is not None and match.group(1) is not None:
+            build_numbers.append(int(match.group(1)))
+    return max(build_numbers) + 1
+
+def readManifest(index_directory):
+    """ Returns the shard directory names of a sharded index"""
+    with open(os.path.join(index_directory, MANIFEST), 'r') as manifest_file:
+        return [line.strip() for line in manifest_file if line.strip()]
+
+def countShard(job):
+    """ Pass 1 of a shard, possibly in a worker process. Returns its number of documents and, for every term,
+        its document frequency, corpus count and largest normalized term frequency in the shard"""
+    input_directory, document_names = job
+    # imported here, so that the query side, which only reads the manifest, does not load index and numpy
+    import index
+    stopwords = index.getStopWordsList()
+    term_frequency = defaultdict(lambda : defaultdict(dict))
+    inverse_document_frequency = defaultdict(int)
+    term_count_in_corpus = defaultdict(int)
+    for document_name in document_names:
+        with open(os.path.join(input_directory, document_name), "r") as filestream:
+            index.addDocumentTokens(document_name, ((token, 1) for line in filestream for token in line.split(",")), stopwords, term_frequency, inverse_document_frequency, term_count_in_corpus)
+
+    # the normalized term frequency of calculateWeights, before the inverse document frequency factor
+    max_normalized_frequencies = {}
+    for document_name, term_dict in term_frequency.iteritems():
+        max_frequency = term_dict[index.findMaxFrequencyTerm(term_dict)]
+        for term, count in term_dict.iteritems():
+            normalized_frequency = index.a + (1 - index.a) * count / max_frequency
+            if normalized_frequency > max_normalized_frequencies.get(term, -1.0):
+                max_normalized_frequencies[term] = normalized_frequency
+    return len(term_frequency), dict(inverse_document_frequency), dict(term_count_in_corpus), max_normalized_frequencies
+
+def writeStatistics(path, number_of_documents, inverse_document_frequency, term_count_in_corpus, max_normalized_frequencies):
+    """ Writes the corpus wide statistics: the number of documents, then a line per term"""
+    with open(path, 'w') as statistics_file:
+        statistics_file.write(str(number_of_documents) + '\n')
+        for term in sorted(inverse_document_frequency):
+            statistics_file.write(term + '\t' + str(inverse_document_frequency[term]) + '\t' + str(term_count_in_corpus[term]) + '\t' + repr(max_normalized_frequencies[term]) + '\n')
+
+def readStatistics(path):
+    """ Returns the number of documents and the document frequency, corpus count and largest normalized term frequency of every term"""
+    inverse_document_frequency = {}
+    term_count_in_corpus = {}
+    max_normalized_frequencies = {}
+    with open(path, 'r') as statistics_file:
+        number_of_documents = int(statistics_file.readline())
+        for line in statistics_file:
+            # a term can hold a tab, but not a newline, so the three numbers are split off the end of the line
+            term, document_frequency, count, max_normalized_frequency = line.rstrip('\n').rsplit('\t', 3)
+            inverse_document_frequency[term] = int(document_frequency)
+            term_count_in_corpus[term] = int(count)
+            max_normalized_frequencies[term] = float(max_normalized_frequency)
+    return number_of_documents, inverse_document_frequency, term_count_in_corpus, max_normalized_frequencies
+
+def buildShard(job):
+    """ Pass 2 of a shard, possibly in a worker process: writes the index of its documents weighted with the corpus wide statistics"""
+    input_directory, document_names, shard_directory, statistics_path, vectorized, champion_size = job
+    import index
+    import sparseweights
+    number_of_documents, corpus_document_frequency, corpus_term_count, max_normalized_frequencies = readStatistics(statistics_path)
+    stopwords = index.getStopWordsList()
+    term_frequency = defaultdict(lambda : defaultdict(dict))
+    inverse_document_frequency = defaultdict(int)
+    term_count_in_corpus = defaultdict(int)
+    for document_name in document_names:
+        with open(os.path.join(input_directory, document_name), "r") as filestream:
+            index.addDocumentTokens(document_name, ((token, 1) for line in filestream for token in line.split(",")), stopwords, term_frequency, inverse_document_frequency, term_count_in_corpus)
+
+    # the corpus wide statistics of the terms of the shard
+    shard_document_frequency = dict((term, corpus_document_frequency[term]) for term in inverse_document_frequency)
+    shard_term_count = dict((term, corpus_term_count[term]) for term in inverse_document_frequency)
+    term_weights = defaultdict(lambda : defaultdict(dict))
+    if vectorized:
+        sparseweights.calculateWeightsVectorized(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = shard_document_frequency, term_count_in_corpus = shard_term_count, number_of_documents = number_of_documents)
+    else:
+        index.calculateWeights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = shard_document_frequency, term_count_in_corpus = shard_term_count, number_of_documents = number_of_documents)
+    max_weights = dict((term, max_normalized_frequencies[term] * math.log(number_of_documents / corpus_document_frequency[term])) for term in inverse_document_frequency)
+    # the dictionary and postings of the shard list its own postings, so they take the shard's document frequencies
+    index.calculateTermIndices(term_weights = term_weights, term_count_in_corpus = shard_term_count, inverse_document_frequency = inverse_document_frequency, output_directory = shard_directory, max_weights = max_weights, champion_size = champion_size)
+    return len(term_frequency)
+
+def buildShards(input_directory, output_directory, number_of_shards, skip_documents = (), vectorized = False, champion_size = 0):
+    """ Builds a sharded index of the tokenized files of input_directory but skip_documents, one worker process per shard.
+        With champion_size every shard also writes its champion lists"""
+    if number_of_shards < 1:
+        raise ValueError("ERROR:[SearchEngine] The number of shards must be at least 1.")
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    shard_documents = [[] for shard_number in range(0, number_of_shards)]
+    # in sorted order, as calculateTermFreqAndInverseDocFreq reads them
+    for document_name in sorted(os.listdir(input_directory)):
+        if document_name not in skip_documents:
+            shard_documents[shardOf(document_name, number_of_shards)].append(document_name)
+
+    build_number = nextBuildNumber(output_directory)
+    previous_shard_names = readManifest(output_directory) if isShardedIndex(output_directory) else []
+
+    pool = multiprocessing.Pool(number_of_shards)
+    try:
+        # pass 1: sum the statistics of the shards
+        number_of_documents = 0
+        inverse_document_frequency = defaultdict(int)
+        term_count_in_corpus = defaultdict(int)
+        max_normalized_frequencies = {}
+        for shard_document_count, shard_document_frequency, shard_term_count, shard_max_frequencies in pool.imap(countShard, [(input_directory, document_names) for document_names in shard_documents]):
+            number_of_documents += shard_document_count
+            for term, document_frequency in shard_document_frequency.iteritems():
+                inverse_document_frequency[term] += document_frequency
+                term_count_in_corpus[term] += shard_term_count[term]
+                if shard_max_frequencies[term] > max_normalized_frequencies.get(term, -1.0):
+                    max_normalized_frequencies[term] = shard_max_frequencies[term]
+        statistics_path = os.path.join(output_directory, STATISTICS)
+        writeStatistics(statistics_path, number_of_documents, inverse_document_frequency, term_count_in_corpus, max_normalized_frequencies)
+
+        # pass 2: index every shard with the corpus wide statistics
+        shard_names = [shardName(build_number, shard_number) for shard_number in range(0, number_of_shards)]
+        pool.map(buildShard, [(input_directory, document_names, os.path.join(output_directory, shard_name), statistics_path, vectorized, champion_size) for document_names, shard_name in zip(shard_documents, shard_names)])
+    finally:
+        pool.close()
+        pool.join()
+
+    # a shard without postings answers no query, and its empty postings file cannot be memory mapped
+    shard_names = [shard_name for shard_name in shard_names if os.path.getsize(os.path.join(output_directory, shard_name, 'postings.bin')) > 0]
+    # the manifest is written last, so an index is only seen as sharded once every shard is built, and replaced
+    # atomically, so a server reopening the index reads either the old or the new list of shards
+    temporary_path = os.path.join(output_directory, MANIFEST + '.tmp')
+    with open(temporary_path, 'w') as manifest_file:
+        for shard_name in shard_names:
+            manifest_file.write(shard_name + '\n')
+    os.rename(temporary_path, os.path.join(output_directory, MANIFEST))
+
+    # the shards of the previous build are kept, a server may have read the previous manifest and be opening them
+    for filename in os.listdir(output_directory):
+        if SHARD_DIRECTORY.match(filename) and filename not in shard_names and filename not in previous_shard_names:
+            shutil.rmtree(os.path.join(output_directory, filename))
+    return shard_names
@@ -9,13 +9,28 @@ import os
 from collections import defaultdict
 import glob
 import math
-import operator
+import heapq
+import argparse
+import sparseweights
+import dedup
+import simmatrix
+import kmeans
+import clusterstate
+import metrics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 start_time = time.time()
 
 # Maximum tf normalization constant
 a = 0.4
 
+# Clustering stops after merging clusters less similar than this fraction of the most similar pair
+DEFAULT_THRESHOLD_RATIO = 0.4
+
 def getStopWordsList():
     """ Reads stop words list into memory"""
     stopwords = defaultdict(int)
@@ -24,16 +39,29 @@ def getStopWordsList():
             stopwords[line.rstrip("\n")] = 1;
     return stopwords
 
-def calculateTermFreqAndInverseDocFreq(input_directory, term_frequency, inverse_document_frequency, term_count_in_corpus):
-    """ Calculates term frequency and document frequency for all terms in all documents"""
+@metrics.timed('stopword_filtering')
+def filterTokens(tokens, stopwords):
+    """ Returns the stripped tokens that are neither stop words nor of length 1"""
+    return [token for token in (token.strip() for token in tokens) if len(token) > 1 and token not in stopwords]
+
+# stop words are filtered out as the terms are counted. With metrics on they are filtered up front, so that the
+# stopword_filtering span times the filter on its own, within the read_documents span
+@metrics.timed('read_documents')
+def calculateTermFreqAndInverseDocFreq(input_directory, term_frequency, inverse_document_frequency, term_count_in_corpus, skip_documents = ()):
+    """ Calculates term frequency and document frequency for all terms in all documents but skip_documents"""
     stopwords = getStopWordsList()
     # For each input file, build token_freqency. Also build inverse_document_frequency simultaneously.
-    for input_file in os.listdir(input_directory):
+    for input_file in sorted(os.listdir(input_directory)):
+        # Near duplicates of another document are left out
+        if input_file in skip_documents:
+            continue
         with open(os.path.join(input_directory, input_file), "r") as filestream:
             # Re-initialize dict tokens_in_file for each file. Used to build inverse_document_frequency
             tokens_in_file = defaultdict(int)
-            for line in filestream:
-                tokens = line.split(",")
+            line_tokens = (line.split(",") for line in filestream)
+            if metrics.enabled:
+                line_tokens = [filterTokens([token for tokens in line_tokens for token in tokens], stopwords)]
+            for tokens in line_tokens:
                 for token in tokens:
                     # Ignore stopwords
                     token = token.strip()
@@ -74,6 +102,7 @@ def findMaxFrequencyTerm(term_dict):
 
     return max_term
 
+@metrics.timed('weight_computation')
 def calculateWeights(term_weights, term_frequency, inverse_document_frequency, term_count_in_corpus):
     """ Calculates term weights for all terms in all documents"""
     number_of_documents = len(term_frequency)
@@ -87,93 +116,320 @@ def calculateWeights(term_weights, term_frequency, inverse_document_frequency, t
             term_weights[filename][term] = a + (1 - a) * term_frequency[filename][term] / term_frequency[filename][max_frequency_term]
             term_weights[filename][term] *= math.log(number_of_documents / inverse_document_frequency[term])
 
-def mergeSimilarDocuments(term_weights,merge_string):
-    """ Adds a new cluster with weights equal to the average of the two documents in the merge string. Removes the two individual documents"""
-    # Get document names from the merge string
-    document1 = merge_string.split('_')[0]
-    document2 = merge_string.split('_')[1]
-    merge_string = merge_string.replace("_","+")
+def similarityRows(term_weights, names):
+    """ Returns a dict of the non zero similarities of every document to the other documents, numbered in the order of names"""
+    rows = [{} for name in names]
+    # every pair of documents sharing a term adds the product of its weights to their similarity
+    term_postings = defaultdict(list)
+    for document in range(0, len(names)):
+        for term, weight in term_weights[names[document]].iteritems():
+            term_postings[term].append((document, weight))
+    for posting_list in term_postings.itervalues():
+        for position in range(0, len(posting_list)):
+            document1, weight1 = posting_list[position]
+            row = rows[document1]
+            for document2, weight2 in posting_list[position + 1:]:
+                row[document2] = row.get(document2, 0.0) + weight1 * weight2
+    for document1 in range(0, len(names)):
+        for document2, similarity in rows[document1].items():
+            if document2 > document1:
+                rows[document2][document1] = similarity
+    return rows
 
-    print merge_string
+class Clustering(object):
+    """ Agglomerative clustering of documents on the dot product of their weights.
+        Merging two clusters replaces them with the average of their weights, so the similarity of the
+        merged cluster to any other cluster is the average of the two similarities (Lance-Williams update
+        with alpha = 1/2). Similarities are computed once and only the row of the merged cluster changes.
+        Every cluster keeps its most similar neighbour, and a heap of (-similarity, cluster, neighbour)
+        gives the most similar pair. Subclasses store the similarities"""
 
-    term_dict1 = term_weights[document1]
-    term_dict2 = term_weights[document2]
+    def __init__(self, names):
+        self.names = list(names)
+        self.heap = []
+        # (cluster1, cluster2, similarity) of every merge, cluster2 merged into the place of cluster1
+        self.merges = []
 
-    # Add a new cluster with the average of weights of the two documents
-    for term,weight in term_dict1.iteritems():
-        if term_dict2.has_key(term):
-            term_weights[merge_string][term] = (weight + term_dict2[term])/2
+    def start(self):
+        """ Finds the nearest neighbour of every cluster"""
+        for cluster in range(0, len(self.names)):
+            self.updateNearest(cluster)
+
+    def updateNearest(self, cluster):
+        """ Recomputes the nearest neighbour of the cluster and pushes it on the heap"""
+        nearest = self.findNearest(cluster)
+        if nearest is None:
+            self.setNearest(cluster, -1, 0.0)
         else:
-            term_weights[merge_string][term] = weight/2
-
-    for term,weight in term_dict2.iteritems():
-        if not term_dict1.has_key(term):
-            term_weights[merge_string][term] = weight/2
-
-    # Delete the initial individual documents/clusters
-    del term_weights[document1]
-    del term_weights[document2]
-
-def findSimilarity(term_weights):
-    """ Calculates the similarity scores of all the clusters. Sorts them in the descending order and merges the pair of most similar clusters"""
-    document_similarity_scores = defaultdict(float)
-    similarity_score = 0
-    sum = 0.0
-    # Find the similarity scores of all the clusters with all other clusters
-    for document1,term_dict1 in term_weights.iteritems():
-        for document2,term_dict2 in term_weights.iteritems():
-            if document1 == document2:
-                continue
-            for term,weight in term_dict1.iteritems():
-                if term_dict2.has_key(term):
-                    similarity_score += weight * term_dict2[term]
+            self.setNearest(cluster, nearest[1], nearest[0])
+
+    def setNearest(self, cluster, neighbour, similarity):
+        self.nearest[cluster] = neighbour
+        self.nearest_similarities[cluster] = similarity
+        if neighbour >= 0:
+            heapq.heappush(self.heap, (-similarity, cluster, neighbour))
+
+    def maxSimilarity(self):
+        """ Returns the similarity of the most similar pair of clusters"""
+        return max(self.nearest_similarities) if len(self.names) else 0.0
+
+    def mergeNext(self):
+        """ Merges the most similar pair of clusters. Returns the name of the merged cluster and the similarity of the pair, or None"""
+        while self.heap:
+            negative_similarity, cluster1, cluster2 = heapq.heappop(self.heap)
+            # entries of merged clusters and of replaced neighbours are skipped
+            if self.alive[cluster1] and self.nearest[cluster1] == cluster2 and self.nearest_similarities[cluster1] == -negative_similarity:
+                break
+        else:
+            return None
+
+        self.joinClusters(cluster1, cluster2, -negative_similarity)
+        to_recompute, closer = self.clustersToUpdate(cluster1, cluster2)
+        for cluster in to_recompute:
+            self.updateNearest(cluster)
+        for cluster in closer:
+            self.setNearest(cluster, cluster1, self.similarity(cluster, cluster1))
+        self.updateNearest(cluster1)
+        return self.names[cluster1], -negative_similarity
+
+    def joinClusters(self, cluster1, cluster2, similarity):
+        """ Merges cluster2 into the place of cluster1 and records the merge, without updating the nearest neighbours"""
+        self.mergeRows(cluster1, cluster2)
+        self.alive[cluster2] = False
+        self.names[cluster1] = self.names[cluster1] + "+" + self.names[cluster2]
+        self.names[cluster2] = None
+        self.merges.append((cluster1, cluster2, similarity))
 
-            document_similarity_scores[document1 + "_" + document2] = similarity_score
-            sum += similarity_score
+    def replayMerges(self, merges):
+        """ Makes the merges of an interrupted run again, then finds the nearest neighbours of the clusters left.
+            Returns the name of every merged cluster and the similarity of its pair, as mergeNext returned them"""
+        replayed = []
+        for cluster1, cluster2, similarity in merges:
+            self.joinClusters(cluster1, cluster2, similarity)
+            replayed.append((self.names[cluster1], similarity))
+        self.heap = []
+        self.start()
+        return replayed
 
-    median_weight = sum/len(document_similarity_scores)
+class DenseClustering(Clustering):
+    """ Clustering on a numpy matrix of the similarities of all pairs, for corpora of many documents"""
 
-    min_distance = sys.float_info.max
-    document_closest_to_median = ""
-    for key in document_similarity_scores:
-        temp = math.fabs(document_similarity_scores[key] - median_weight)
-        if min_distance > temp:
-            document_closest_to_median = key
-            min_distance = temp
+    def __init__(self, names, matrix):
+        """ matrix holds the similarity of every pair of documents, with -inf on the diagonal"""
+        Clustering.__init__(self, names)
+        # merged away clusters get -inf too, so they are nobody's neighbour
+        self.matrix = matrix
+        self.alive = numpy.ones(len(self.names), dtype = bool)
+        self.nearest = numpy.empty(len(self.names), dtype = numpy.int64)
+        self.nearest_similarities = numpy.zeros(len(self.names))
+        self.start()
 
-    print document_closest_to_median
+    def similarity(self, cluster1, cluster2):
+        return float(self.matrix[cluster1, cluster2])
 
+    def findNearest(self, cluster):
+        neighbour = int(numpy.argmax(self.matrix[cluster]))
+        if self.matrix[cluster, neighbour] <= 0:
+            return None
+        return float(self.matrix[cluster, neighbour]), neighbour
 
-    # Sort the similarity scores in descending order
-    sorted_document_similarity_scores = sorted(document_similarity_scores.items(), key=operator.itemgetter(1), reverse=True)
+    def mergeRows(self, cluster1, cluster2):
+        row = (self.matrix[cluster1] + self.matrix[cluster2]) / 2
+        self.matrix[cluster1] = row
+        self.matrix[:, cluster1] = row
+        self.matrix[cluster1, cluster1] = -numpy.inf
+        self.matrix[cluster2] = -numpy.inf
+        self.matrix[:, cluster2] = -numpy.inf
 
-    print "Most similar = ",sorted_document_similarity_scores[0]
-    print "Least similar = ",sorted_document_similarity_scores[len(sorted_document_similarity_scores) - 1]
+    def clustersToUpdate(self, cluster1, cluster2):
+        """ Returns the clusters whose nearest neighbour was merged and the clusters now nearest to the merged cluster"""
+        merged_neighbour = self.alive & ((self.nearest == cluster1) | (self.nearest == cluster2))
+        merged_neighbour[cluster1] = False
+        column = self.matrix[:, cluster1]
+        # on equal similarities the lower cluster number is the nearest, as argmax picks
+        closer = self.alive & ~merged_neighbour & (column > 0) & ((column > self.nearest_similarities) | ((column == self.nearest_similarities) & (cluster1 < self.nearest)))
+        closer[cluster1] = False
+        return numpy.nonzero(merged_neighbour)[0].tolist(), numpy.nonzero(closer)[0].tolist()
 
+class SparseClustering(Clustering):
+    """ Clustering on dicts of the non zero similarities, used without numpy and for the nearest neighbours of simmatrix"""
 
-    # Merge the most similar clusters
-    mergeSimilarDocuments(term_weights,sorted_document_similarity_scores[0][0])
-    return sorted_document_similarity_scores[0][1]
+    def __init__(self, names, rows):
+        """ rows holds a dict of the positive similarities of every document to the other documents"""
+        Clustering.__init__(self, names)
+        self.rows = rows
+        self.alive = [True] * len(self.names)
+        self.nearest = [-1] * len(self.names)
+        self.nearest_similarities = [0.0] * len(self.names)
+        self.start()
 
+    def similarity(self, cluster1, cluster2):
+        return self.rows[cluster1].get(cluster2, 0.0)
+
+    def findNearest(self, cluster):
+        nearest = None
+        for neighbour, similarity in self.rows[cluster].iteritems():
+            if similarity > 0 and (nearest is None or similarity > nearest[0] or (similarity == nearest[0] and neighbour < nearest[1])):
+                nearest = (similarity, neighbour)
+        return nearest
+
+    def mergeRows(self, cluster1, cluster2):
+        row1 = self.rows[cluster1]
+        row2 = self.rows[cluster2]
+        row = {}
+        for neighbour in set(row1) | set(row2):
+            if neighbour != cluster1 and neighbour != cluster2:
+                row[neighbour] = (row1.get(neighbour, 0.0) + row2.get(neighbour, 0.0)) / 2
+        for neighbour in row2:
+            del self.rows[neighbour][cluster2]
+        for neighbour, similarity in row.iteritems():
+            self.rows[neighbour][cluster1] = similarity
+        self.rows[cluster1] = row
+        self.rows[cluster2] = {}
+
+    def clustersToUpdate(self, cluster1, cluster2):
+        """ Returns the clusters whose nearest neighbour was merged and the clusters now nearest to the merged cluster"""
+        to_recompute = []
+        closer = []
+        # only the clusters similar to one of the merged clusters, now all in the merged row, can be affected
+        for cluster in sorted(self.rows[cluster1]):
+            if self.nearest[cluster] == cluster1 or self.nearest[cluster] == cluster2:
+                to_recompute.append(cluster)
+            else:
+                similarity = self.rows[cluster].get(cluster1, 0.0)
+                if similarity > 0 and (similarity > self.nearest_similarities[cluster] or (similarity == self.nearest_similarities[cluster] and cluster1 < self.nearest[cluster])):
+                    closer.append(cluster)
+        return to_recompute, closer
+
+def parseArguments():
+    "This function parses the command line: sim.py <input-dir> [--vectorized] [--kmeans K]"
+    parser = argparse.ArgumentParser(description = "Clusters the tokenized files by the similarity of their tf-idf weights")
+    parser.add_argument("input_directory")
+    parser.add_argument("--vectorized", action = "store_true", help = "compute the weights with numpy and scipy")
+    parser.add_argument("--dedup", metavar = "DUPLICATES_FILE", help = "keep only the representative of every group of near duplicates written by dedup.py")
+    parser.add_argument("--threshold", type = float, help = "stop after merging clusters this similar, by default 40%% of the most similar pair")
+    parser.add_argument("--workers", type = int, default = 1, help = "number of processes computing the similarities")
+    parser.add_argument("--neighbours", type = int, default = 0, help = "keep only this many most similar documents per document, to bound memory")
+    parser.add_argument("--kmeans", type = int, metavar = "K", help = "cluster into K clusters by mini-batch spherical k-means instead of merging clusters")
+    parser.add_argument("--batch-size", type = int, default = kmeans.DEFAULT_BATCH_SIZE, help = "documents per k-means iteration")
+    parser.add_argument("--max-iterations", type = int, default = kmeans.DEFAULT_MAX_ITERATIONS, help = "most k-means iterations")
+    parser.add_argument("--tolerance", type = float, default = kmeans.DEFAULT_TOLERANCE, help = "k-means stops when no centroid moved more than this squared distance in an iteration")
+    parser.add_argument("--seed", type = int, default = kmeans.DEFAULT_SEED, help = "random seed of the k-means seeding and batches")
+    parser.add_argument("--top-terms", type = int, default = kmeans.DEFAULT_TOP_TERMS, help = "terms printed per k-means cluster")
+    parser.add_argument("--checkpoint", metavar = "DIR", help = "save the clustering state to DIR as it runs, see clusterstate.py")
+    parser.add_argument("--checkpoint-iterations", type = int, default = kmeans.DEFAULT_CHECKPOINT_ITERATIONS, help = "k-means iterations between two saves of the state")
+    parser.add_argument("--resume", action = "store_true", help = "continue the interrupted run saved in --checkpoint, with its options")
+    parser.add_argument("--assign", metavar = "DIR", help = "assign the tokenized files to the nearest cluster of the finished run saved in DIR, without clustering")
+    metrics.addArgument(parser)
+    arguments = parser.parse_args()
+    if arguments.resume and not arguments.checkpoint:
+        parser.error("--resume needs --checkpoint")
+    if (arguments.vectorized or arguments.workers > 1 or arguments.neighbours or arguments.kmeans) and not sparseweights.isAvailable():
+        parser.error("--vectorized, --workers, --neighbours and --kmeans need numpy and scipy")
+    if arguments.kmeans is not None and (arguments.kmeans < 1 or arguments.batch_size < 1):
+        parser.error("--kmeans and --batch-size must be at least 1")
+    return arguments
 
 def main():
     "This function is the base caller of calcwts for search engine"
+    arguments = parseArguments()
+    metrics.configure(arguments.metrics)
     term_frequency = defaultdict(lambda : defaultdict(dict))
     inverse_document_frequency = defaultdict(int)
     term_count_in_corpus = defaultdict(int)
-    calculateTermFreqAndInverseDocFreq(input_directory = sys.argv[1], term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    skip_documents = set()
+    if arguments.dedup:
+        skip_documents = dedup.duplicateDocuments(arguments.dedup)
+    calculateTermFreqAndInverseDocFreq(input_directory = arguments.input_directory, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus, skip_documents = skip_documents)
+    if arguments.assign:
+        # new documents are weighted with the inverse document frequencies of the clustered corpus
+        for name, cluster, similarity in clusterstate.ClusterCheckpoint(arguments.assign).assignDocuments(term_frequency):
+            print "%s %d %.6f" % (name, cluster, similarity)
+        print "Running time = %s seconds" %(time.time() - start_time)
+        return
     term_weights = defaultdict(lambda : defaultdict(dict))
-    calculateWeights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    if arguments.vectorized:
+        sparseweights.calculateWeightsVectorized(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    else:
+        calculateWeights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
 
     number_of_documents = len(term_weights)
+    names = list(term_weights)
+    checkpoint = None
+    if arguments.checkpoint:
+        checkpoint = clusterstate.ClusterCheckpoint(arguments.checkpoint)
+    if arguments.resume:
+        state = checkpoint.load()
+        if state['finished']:
+            raise ValueError("ERROR:[SearchEngine] The clustering run of the checkpoint already finished.")
+        if sorted(state['names']) != sorted(names):
+            raise ValueError("ERROR:[SearchEngine] The checkpoint holds the clustering of other documents.")
+        # the documents keep their cluster numbers of the interrupted run
+        names = state['names']
+        options = state['options']
+    elif arguments.kmeans:
+        options = {'mode': 'kmeans', 'clusters': min(arguments.kmeans, number_of_documents), 'batch_size': arguments.batch_size, 'max_iterations': arguments.max_iterations, 'tolerance': arguments.tolerance, 'seed': arguments.seed}
+    else:
+        options = {'mode': 'agglomerative', 'neighbours': arguments.neighbours, 'threshold': arguments.threshold}
+    if checkpoint is not None and not arguments.resume:
+        terms = sorted(set(term for name in names for term in term_weights[name]))
+        checkpoint.start(names, options, terms, clusterstate.inverseDocumentFrequencyFactors(terms, len(term_frequency), inverse_document_frequency))
+
+    if options['mode'] == 'kmeans':
+        with metrics.span('kmeans'):
+            clustering, labels, similarities, cluster_terms = kmeans.clusterDocuments(term_weights, names, options['clusters'], options['batch_size'], options['max_iterations'], options['tolerance'], options['seed'], arguments.workers, arguments.top_terms, checkpoint, arguments.checkpoint_iterations)
+        if checkpoint is not None:
+            checkpoint.finish(labels, clustering.centroidRows())
+        kmeans.printClusters(names, labels, similarities, cluster_terms)
+        print "%d iterations, %s" % (clustering.iterations, "converged" if clustering.converged else "stopped at --max-iterations")
+        print "Running time = %s seconds" %(time.time() - start_time)
+        return
 
-    # Perform iterations of merging the most similar clusters till similarity score <= 40% of max score i.e. 527490
-    score = 0.0
-    for i in range(0,number_of_documents):
-        score = findSimilarity(term_weights)
+    with metrics.span('similarity'):
+        if not sparseweights.isAvailable():
+            clustering = SparseClustering(names, similarityRows(term_weights, names))
+        elif options['neighbours']:
+            neighbour_ids, neighbour_similarities = simmatrix.topNeighbours(simmatrix.weightMatrix(term_weights, names), options['neighbours'], arguments.workers)
+            clustering = SparseClustering(names, simmatrix.neighbourRows(neighbour_ids, neighbour_similarities))
+        else:
+            clustering = DenseClustering(names, simmatrix.similarityMatrix(simmatrix.weightMatrix(term_weights, names), arguments.workers))
+
+    threshold = options['threshold']
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLD_RATIO * clustering.maxSimilarity()
+        if checkpoint is not None:
+            # a resumed run stops at the same score
+            options['threshold'] = threshold
+            checkpoint.saveState()
+
+    # the merges of an interrupted run are printed again, so its output is the one of an uninterrupted run
+    score = None
+    replayed = []
+    if arguments.resume:
+        replayed = clustering.replayMerges(checkpoint.readMerges())
+    for i, (merge_string, score) in enumerate(replayed):
+        print merge_string
         print i, " -> score= ",score
-        if score <= 527490: # 40% of max similarity score
-             break
+
+    # Perform iterations of merging the most similar clusters till similarity score <= 40% of max score
+    for i in range(len(replayed), number_of_documents - 1):
+        if score is not None and score <= threshold:
+            break
+        with metrics.span('cluster_merge'):
+            merge = clustering.mergeNext()
+        if merge is None:
+            break
+        metrics.count('merges')
+        if checkpoint is not None:
+            checkpoint.logMerge(*clustering.merges[-1])
+        merge_string, score = merge
+        print merge_string
+        print i, " -> score= ",score
+
+    if checkpoint is not None:
+        labels = clusterstate.agglomerativeLabels(number_of_documents, clustering.merges)
+        terms, idf_factors = checkpoint.readVocabulary()
+        checkpoint.finish(labels, clusterstate.agglomerativeCentroids(term_weights, names, terms, clustering.merges, labels))
 
     print "Running time = %s seconds" %(time.time() - start_time)
 
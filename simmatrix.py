@@ -0,0 +1,163 @@
+"""Module simmatrix:
+    This module computes the dot product similarities of all pairs of documents for sim.py.
+    The document-term weight matrix is split into blocks of rows, and every block is multiplied
+    by the transposed matrix as a sparse matrix product, on a pool of worker processes.
+    similarityMatrix keeps every similarity in a matrix shared with the workers. topNeighbours
+    keeps only the N most similar documents of every document, so its memory grows with the
+    number of documents instead of its square.
+
+    usage: python simmatrix.py <tokenized-dir> [--neighbours N] [--block-rows R]
+        times topNeighbours with 1 to all cores and checks that the neighbours match
+	"""
+
+import sys
+import time
+import argparse
+import multiprocessing
+from collections import defaultdict, OrderedDict
+import sparseweights
+
+try:
+    import numpy
+    from multiprocessing.sharedctypes import RawArray
+except ImportError:
+    numpy = None
+
+# Rows of the weight matrix multiplied per job
+DEFAULT_BLOCK_ROWS = 256
+
+# Set in every worker by initializeWorker
+weight_matrix = None
+transposed_weight_matrix = None
+shared_matrix = None
+
+def weightMatrix(term_weights, names, terms = None):
+    """ Returns the CSR document-term weight matrix with one row per name, and by default one column per term of the documents"""
+    if terms is None:
+        terms = list(set(term for name in names for term in term_weights[name]))
+    return sparseweights.buildCountMatrix(OrderedDict((name, term_weights[name]) for name in names), terms, numpy.float64)
+
+def initializeWorker(matrix, shared_similarities = None):
+    "This function keeps the weight matrix, and the shared similarity matrix if any, in a worker process"
+    global weight_matrix, transposed_weight_matrix, shared_matrix
+    weight_matrix = matrix
+    transposed_weight_matrix = matrix.T.tocsr()
+    shared_matrix = None
+    if shared_similarities is not None:
+        shared_matrix = numpy.frombuffer(shared_similarities, dtype = numpy.float64).reshape(matrix.shape[0], matrix.shape[0])
+
+def similarityBlock(start, end):
+    """ Returns the similarities of the documents start to end - 1 with all documents, a document's own similarity being -inf"""
+    block = (weight_matrix[start:end] * transposed_weight_matrix).toarray()
+    block[numpy.arange(0, end - start), numpy.arange(start, end)] = -numpy.inf
+    return block
+
+def fillBlock(job):
+    "This function writes the similarities of a block of documents into the shared matrix"
+    start, end = job
+    shared_matrix[start:end] = similarityBlock(start, end)
+    return start
+
+def topNeighboursBlock(job):
+    "This function returns the N nearest neighbours of a block of documents, as document numbers and similarities sorted most similar first"
+    start, end, neighbours = job
+    block = similarityBlock(start, end)
+    if neighbours < block.shape[1]:
+        candidates = numpy.argpartition(-block, neighbours - 1, axis = 1)[:, :neighbours]
+    else:
+        candidates = numpy.tile(numpy.arange(0, block.shape[1]), (end - start, 1))
+    similarities = block[numpy.arange(0, end - start)[:, numpy.newaxis], candidates]
+    # most similar first, the lower document number first on equal similarities
+    order = numpy.lexsort((candidates, -similarities))
+    rows = numpy.arange(0, end - start)[:, numpy.newaxis]
+    return start, candidates[rows, order], similarities[rows, order]
+
+def blockJobs(number_of_documents, block_rows):
+    """ Returns the (start, end) of every block of rows"""
+    return [(start, min(start + block_rows, number_of_documents)) for start in range(0, number_of_documents, block_rows)]
+
+def runJobs(function, jobs, matrix, workers, shared_similarities = None):
+    """ Runs the jobs in this process or on a pool of workers, and returns their results in job order"""
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializeWorker, (matrix, shared_similarities))
+        try:
+            return pool.map(function, jobs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    initializeWorker(matrix, shared_similarities)
+    return map(function, jobs)
+
+def similarityMatrix(matrix, workers = 1, block_rows = DEFAULT_BLOCK_ROWS):
+    """ Returns the matrix of the similarities of all pairs of rows of the weight matrix, -inf on the diagonal"""
+    number_of_documents = matrix.shape[0]
+    # the workers write their blocks straight into memory shared with this process
+    shared_similarities = RawArray('d', number_of_documents * number_of_documents)
+    runJobs(fillBlock, blockJobs(number_of_documents, block_rows), matrix, workers, shared_similarities)
+    return numpy.frombuffer(shared_similarities, dtype = numpy.float64).reshape(number_of_documents, number_of_documents)
+
+def topNeighbours(matrix, neighbours, workers = 1, block_rows = DEFAULT_BLOCK_ROWS):
+    """ Returns two arrays with a row per document: the numbers of its N most similar documents and their similarities"""
+    number_of_documents = matrix.shape[0]
+    neighbours = max(1, min(neighbours, number_of_documents - 1))
+    jobs = [(start, end, neighbours) for start, end in blockJobs(number_of_documents, block_rows)]
+    results = runJobs(topNeighboursBlock, jobs, matrix, workers)
+    neighbour_ids = numpy.empty((number_of_documents, neighbours), dtype = numpy.int64)
+    neighbour_similarities = numpy.empty((number_of_documents, neighbours))
+    for start, block_ids, block_similarities in results:
+        neighbour_ids[start:start + len(block_ids)] = block_ids
+        neighbour_similarities[start:start + len(block_ids)] = block_similarities
+    return neighbour_ids, neighbour_similarities
+
+def neighbourRows(neighbour_ids, neighbour_similarities):
+    """ Returns a dict of the positive similarities of every document to its neighbours. A pair kept by either document is kept in both rows"""
+    rows = [{} for row in range(0, len(neighbour_ids))]
+    for document, (ids, similarities) in enumerate(zip(neighbour_ids.tolist(), neighbour_similarities.tolist())):
+        for neighbour, similarity in zip(ids, similarities):
+            # the similarity of the pair comes from the lower numbered document, so both rows hold the same value
+            if similarity > 0 and neighbour not in rows[document]:
+                rows[document][neighbour] = similarity
+                rows[neighbour][document] = similarity
+    return rows
+
+def measureScaling(input_directory, neighbours, block_rows):
+    """ Times topNeighbours on a tokenized directory with 1 to all cores and checks that every run finds the same neighbours"""
+    import sim
+    term_frequency = defaultdict(lambda : defaultdict(dict))
+    inverse_document_frequency = defaultdict(int)
+    term_count_in_corpus = defaultdict(int)
+    sim.calculateTermFreqAndInverseDocFreq(input_directory = input_directory, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    term_weights = defaultdict(lambda : defaultdict(dict))
+    sparseweights.calculateWeightsVectorized(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    matrix = weightMatrix(term_weights, list(term_weights))
+
+    identical = True
+    reference = None
+    single_core_time = None
+    print "%d documents, %d neighbours, %d rows per block" % (matrix.shape[0], neighbours, block_rows)
+    for workers in range(1, multiprocessing.cpu_count() + 1):
+        workers_start_time = time.time()
+        neighbour_ids, neighbour_similarities = topNeighbours(matrix, neighbours, workers, block_rows)
+        elapsed = time.time() - workers_start_time
+        if reference is None:
+            reference = neighbour_ids
+            single_core_time = elapsed
+        identical = identical and numpy.array_equal(reference, neighbour_ids)
+        print "%3d workers %8.3f seconds  %.2fx" % (workers, elapsed, single_core_time / elapsed)
+    print "neighbours identical:", identical
+    return identical
+
+def main():
+    "This function is the base caller of the similarity benchmark"
+    parser = argparse.ArgumentParser(description = "Times the blocked similarity kernel from 1 to all cores")
+    parser.add_argument("input_directory")
+    parser.add_argument("--neighbours", type = int, default = 20, help = "most similar documents kept per document")
+    parser.add_argument("--block-rows", type = int, default = DEFAULT_BLOCK_ROWS, help = "rows of the weight matrix multiplied per job")
+    arguments = parser.parse_args()
+    if not sparseweights.isAvailable():
+        parser.error("the similarity kernel needs numpy and scipy")
+    if not measureScaling(arguments.input_directory, arguments.neighbours, arguments.block_rows):
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
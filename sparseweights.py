@@ -0,0 +1,122 @@
+"""Module sparseweights:
+    This module computes the term weights of calculateWeights with numpy and scipy instead of
+    walking the nested term frequency dicts term by term.
+    The term frequencies are loaded into a CSR document-term count matrix with integer term ids,
+    and the max tf normalization and the inverse document frequency are applied as array
+    operations. The weights are exactly the ones calculateWeights computes, so the _weights files
+    and the postings written from them do not change.
+
+    usage: python sparseweights.py <tokenized-dir>
+        times calculateWeights against calculateWeightsVectorized and checks that the weights match
+	"""
+
+import sys
+import time
+import math
+from collections import defaultdict
+from itertools import izip
+import metrics
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+# Maximum tf normalization constant, as in index.py
+a = 0.4
+
+def isAvailable():
+    """ Returns True if numpy and scipy are installed"""
+    return numpy is not None
+
+def buildCountMatrix(term_frequency, terms, dtype = None):
+    """ Returns the CSR document-term count matrix of term_frequency, one row per document in iteration order
+        and one column per term of terms. The columns of a row are in the iteration order of the document's dict.
+        Pass dtype = numpy.float64 to load weights instead of counts"""
+    term_ids = dict(izip(terms, xrange(len(terms))))
+    row_pointers = [0]
+    document_terms = []
+    counts = []
+    for document_name, term_dict in term_frequency.iteritems():
+        # keys and values of a dict are listed in the same order
+        document_terms.extend(term_dict.keys())
+        counts.extend(term_dict.values())
+        row_pointers.append(len(counts))
+    term_columns = map(term_ids.__getitem__, document_terms)
+    return scipy.sparse.csr_matrix((numpy.array(counts, dtype = dtype or numpy.int64), numpy.array(term_columns, dtype = numpy.int64), numpy.array(row_pointers, dtype = numpy.int64)), shape = (len(term_frequency), len(terms)))
+
+@metrics.timed('weight_computation')
+def calculateWeightsVectorized(term_weights, term_frequency, inverse_document_frequency, term_count_in_corpus, number_of_documents = None):
+    """ Same as calculateWeights in index.py, computed on a sparse count matrix"""
+    if not isAvailable():
+        raise ImportError("ERROR:[SearchEngine] The vectorized weights need numpy and scipy.")
+    if number_of_documents is None:
+        number_of_documents = len(term_frequency)
+    if len(term_frequency) == 0:
+        return
+    terms = list(inverse_document_frequency)
+    count_matrix = buildCountMatrix(term_frequency, terms)
+    # the matrix is built in order, so its entries are in the iteration order of every document's dict
+    counts = count_matrix.data
+    term_columns = count_matrix.indices
+    row_lengths = numpy.diff(count_matrix.indptr)
+
+    # Ignore the terms that occur only once in the entire corpus
+    term_is_indexed = numpy.array([term_count_in_corpus[term] != 1 for term in terms], dtype = bool)
+    # math.log once per term keeps the weights identical to calculateWeights, number_of_documents / df is an integer division
+    inverse_document_frequency_factor = numpy.array([math.log(number_of_documents / inverse_document_frequency[term]) for term in terms], dtype = numpy.float64)
+
+    # reduceat instead of count_matrix.max, which sorts the columns of every row in place
+    max_frequencies = numpy.repeat(numpy.maximum.reduceat(counts, count_matrix.indptr[:-1]), row_lengths)
+    weights = a + (1 - a) * counts / max_frequencies.astype(numpy.float64)
+    weights *= inverse_document_frequency_factor[term_columns]
+
+    kept = term_is_indexed[term_columns]
+    kept_terms = numpy.array(terms, dtype = object)[term_columns[kept]].tolist()
+    kept_weights = weights[kept].tolist()
+    # number of kept entries before every row
+    kept_row_pointers = numpy.concatenate(([0], numpy.cumsum(kept)))[count_matrix.indptr].tolist()
+
+    for row, document_name in enumerate(term_frequency):
+        start = kept_row_pointers[row]
+        end = kept_row_pointers[row + 1]
+        # documents without an indexed term get no entry, as in calculateWeights
+        if start < end:
+            term_weights[document_name].update(izip(kept_terms[start:end], kept_weights[start:end]))
+
+def benchmarkWeights(input_directory):
+    """ Times both weight calculations on a tokenized directory and checks that they agree"""
+    import index
+    term_frequency = defaultdict(lambda : defaultdict(dict))
+    inverse_document_frequency = defaultdict(int)
+    term_count_in_corpus = defaultdict(int)
+    index.calculateTermFreqAndInverseDocFreq(input_directory = input_directory, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+
+    python_start_time = time.time()
+    python_weights = defaultdict(lambda : defaultdict(dict))
+    index.calculateWeights(term_weights = python_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    python_time = time.time() - python_start_time
+
+    vectorized_start_time = time.time()
+    vectorized_weights = defaultdict(lambda : defaultdict(dict))
+    calculateWeightsVectorized(term_weights = vectorized_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+    vectorized_time = time.time() - vectorized_start_time
+
+    # compare the iteration order too, it decides the order of the postings
+    identical = [(document_name, term_dict.items()) for document_name, term_dict in python_weights.iteritems()] == [(document_name, term_dict.items()) for document_name, term_dict in vectorized_weights.iteritems()]
+    print "%-12s %8.3f seconds" % ("python", python_time)
+    print "%-12s %8.3f seconds  %.1fx" % ("vectorized", vectorized_time, python_time / vectorized_time)
+    print "weights identical:", identical
+    return identical
+
+def main():
+    "This function is the base caller of the weights benchmark"
+    if len(sys.argv) != 2:
+        print "usage: python sparseweights.py <tokenized-dir>"
+        return 1
+    if not benchmarkWeights(sys.argv[1]):
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Module spimi:
+    This module builds the index of index.py --memory-mb M in memory bounded by the budget instead
+    of by the corpus, by single pass in-memory indexing (SPIMI) of sorted runs merged at the end.
+    The tokenized files are read twice:
+        1. a first pass counts the document frequency and the corpus count of every term and the
+           number of documents, the corpus wide statistics the weights need.
+        2. a second pass weighs the terms of every document with those statistics and appends the
+           postings to the posting lists of a block. When the postings of the block reach the
+           budget, the block is written to a run file, its terms sorted, and a new block starts.
+    The runs are then merged term by term, MERGE_FAN_IN runs at a time, into the dictionary and
+    postings files, with writeTermIndices of index.py.
+
+    The runs hold the documents in the order they were read, so the posting list of a term is the
+    concatenation of its lists in every run. Only the term statistics, the document names and one
+    block are held in memory, and the index files are the ones of the default build.
+
+    A run holds the terms of its block in alphabetical order, every term as: uint32 length of the
+    term, uint32 number of postings, the term, the uint32 document numbers and the float64
+    weights, in the byte order of the machine, as a run only lives during the build.
+	"""
+
+import os
+import math
+import array
+import heapq
+import shutil
+import struct
+from itertools import izip, groupby
+import compactindex
+import metrics
+
+# Maximum tf normalization constant, as in index.py
+a = 0.4
+
+RUN_HEADER_FORMAT = '=II'
+RUN_HEADER_SIZE = struct.calcsize(RUN_HEADER_FORMAT)
+RUNS_DIRECTORY = 'spimi_runs'
+# Most runs read at once by a merge. More runs are first merged into fewer, larger runs
+MERGE_FAN_IN = 64
+# Memory of a posting in a block, a uint32 document number and a float64 weight, and of a term's posting list
+POSTING_BYTES = 12
+TERM_BYTES = 300
+
+def documentTermCounts(token_counts, stopwords):
+    """ Returns the count of every term of the (token, count) pairs of a document, filtered as index.addDocumentTokens filters them"""
+    counts = {}
+    for token, count in token_counts:
+        token = token.strip()
+        # Ignore stopwords and tokens of length 1
+        if not token or len(token) == 1 or token in stopwords:
+            continue
+        counts[token] = counts.get(token, 0) + count
+    return counts
+
+def readDocuments(input_directory, skip_documents, stopwords):
+    """ Yields the name and the term counts of every tokenized file but skip_documents, in sorted name order"""
+    for input_file in sorted(os.listdir(input_directory)):
+        # Near duplicates of another document are left out
+        if input_file in skip_documents:
+            continue
+        with open(os.path.join(input_directory, input_file), "r") as filestream:
+            counts = documentTermCounts(((token, 1) for line in filestream for token in line.split(",")), stopwords)
+            metrics.count('documents_read')
+            metrics.count('bytes_read', filestream.tell())
+        yield input_file, counts
+
+class CorpusStatistics(object):
+    """ The document frequency and corpus count of every term, and the number of documents"""
+
+    def __init__(self):
+        self.term_ids = {}
+        self.document_frequencies = array.array('I')
+        self.corpus_counts = array.array('I')
+        self.number_of_documents = 0
+
+    def addDocument(self, counts):
+        # a document without a term is left out, as index.py leaves it out of term_frequency
+        if not counts:
+            return
+        self.number_of_documents += 1
+        for term, count in counts.iteritems():
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = len(self.document_frequencies)
+                self.term_ids[term] = term_id
+                self.document_frequencies.append(0)
+                self.corpus_counts.append(0)
+            self.document_frequencies[term_id] += 1
+            self.corpus_counts[term_id] += count
+
+    def inverseDocumentFrequencyFactors(self):
+        """ Returns the factor of index.calculateWeights of every term id, None for the terms it ignores"""
+        # number_of_documents / df is an integer division, as in calculateWeights
+        return [math.log(self.number_of_documents / document_frequency) if corpus_count != 1 else None
+                for document_frequency, corpus_count in izip(self.document_frequencies, self.corpus_counts)]
+
+def writeRun(path, term_postings):
+    """ Writes a run of (term, document numbers, weights) sorted by term"""
+    with open(path, 'wb') as run_file:
+        for term, document_numbers, weights in term_postings:
+            run_file.write(struct.pack(RUN_HEADER_FORMAT, len(term), len(document_numbers)))
+            run_file.write(term)
+            document_numbers.tofile(run_file)
+            weights.tofile(run_file)
+    metrics.count('spimi_runs')
+
+def readRun(path):
+    """ Yields the (term, document numbers, weights) of a run"""
+    with open(path, 'rb') as run_file:
+        while True:
+            header = run_file.read(RUN_HEADER_SIZE)
+            if not header:
+                break
+            term_length, number_of_postings = struct.unpack(RUN_HEADER_FORMAT, header)
+            term = run_file.read(term_length)
+            document_numbers = array.array('I')
+            document_numbers.fromfile(run_file, number_of_postings)
+            weights = array.array('d')
+            weights.fromfile(run_file, number_of_postings)
+            yield term, document_numbers, weights
+
+def mergeRuns(paths):
+    """ Yields (term, document numbers, weights) of every term of the runs, in alphabetical order, its postings in run order"""
+    # the run number breaks the ties between the runs of a term, so its postings stay in run order
+    numbered_runs = [((term, run_number, document_numbers, weights) for term, document_numbers, weights in readRun(path)) for run_number, path in enumerate(paths)]
+    for term, run_postings in groupby(heapq.merge(*numbered_runs), key = lambda run_posting: run_posting[0]):
+        document_numbers = array.array('I')
+        weights = array.array('d')
+        for term, run_number, run_document_numbers, run_weights in run_postings:
+            document_numbers.extend(run_document_numbers)
+            weights.extend(run_weights)
+        yield term, document_numbers, weights
+
+class BlockWriter(object):
+    """ Accumulates the postings of the documents in a block and writes the block as a run when it reaches the memory budget"""
+
+    def __init__(self, runs_directory, memory_bytes):
+        self.runs_directory = runs_directory
+        self.memory_bytes = memory_bytes
+        self.run_paths = []
+        self.startBlock()
+
+    def startBlock(self):
+        # term -> (document numbers, weights)
+        self.block = {}
+        self.block_bytes = 0
+
+    def addPosting(self, term, document_number, weight):
+        posting_list = self.block.get(term)
+        if posting_list is None:
+            posting_list = self.block[term] = (array.array('I'), array.array('d'))
+            self.block_bytes += TERM_BYTES
+        posting_list[0].append(document_number)
+        posting_list[1].append(weight)
+        self.block_bytes += POSTING_BYTES
+
+    def isFull(self):
+        return self.block_bytes >= self.memory_bytes
+
+    @metrics.timed('spimi_flush')
+    def flush(self):
+        """ Writes the block as a run and starts a new one"""
+        if not self.block:
+            return
+        path = os.path.join(self.runs_directory, 'run-%06d' % len(self.run_paths))
+        writeRun(path, ((term, self.block[term][0], self.block[term][1]) for term in sorted(self.block)))
+        self.run_paths.append(path)
+        self.startBlock()
+
+def reduceRuns(runs_directory, run_paths):
+    """ Merges the runs MERGE_FAN_IN at a time until at most MERGE_FAN_IN are left. Returns the runs left"""
+    generation = 0
+    while len(run_paths) > MERGE_FAN_IN:
+        merged_paths = []
+        for start in range(0, len(run_paths), MERGE_FAN_IN):
+            path = os.path.join(runs_directory, 'merged-%d-%06d' % (generation, len(merged_paths)))
+            writeRun(path, mergeRuns(run_paths[start:start + MERGE_FAN_IN]))
+            merged_paths.append(path)
+        for path in run_paths:
+            os.remove(path)
+        run_paths = merged_paths
+        generation += 1
+    return run_paths
+
+def buildIndex(input_directory, output_directory, memory_bytes, skip_documents = (), champion_size = 0):
+    """ Builds the index of the tokenized files of input_directory but skip_documents, holding at most memory_bytes of postings"""
+    import index
+    stopwords = index.getStopWordsList()
+    statistics = CorpusStatistics()
+    with metrics.span('spimi_statistics'):
+        for document_name, counts in readDocuments(input_directory, skip_documents, stopwords):
+            statistics.addDocument(counts)
+    inverse_document_frequency_factors = statistics.inverseDocumentFrequencyFactors()
+    term_ids = statistics.term_ids
+
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    runs_directory = os.path.join(output_directory, RUNS_DIRECTORY)
+    shutil.rmtree(runs_directory, ignore_errors = True)
+    os.makedirs(runs_directory)
+    try:
+        # documents are numbered in the order they are read, so the postings of every run are in document number order
+        document_names = []
+        indexed = array.array('b')
+        block_writer = BlockWriter(runs_directory, memory_bytes)
+        with metrics.span('spimi_invert'):
+            for document_name, counts in readDocuments(input_directory, skip_documents, stopwords):
+                if not counts:
+                    continue
+                document_number = len(document_names)
+                document_names.append(document_name)
+                max_count = max(counts.itervalues())
+                has_indexed_term = False
+                for term, count in counts.iteritems():
+                    inverse_document_frequency_factor = inverse_document_frequency_factors[term_ids[term]]
+                    # Ignore the terms that occur only once in the entire corpus
+                    if inverse_document_frequency_factor is None:
+                        continue
+                    weight = a + (1 - a) * count / max_count
+                    weight *= inverse_document_frequency_factor
+                    block_writer.addPosting(term, document_number, weight)
+                    has_indexed_term = True
+                indexed.append(has_indexed_term)
+                if block_writer.isFull():
+                    block_writer.flush()
+            block_writer.flush()
+
+        # postings.txt lists the postings of a term in the order the default build does, see compactindex.termPostings
+        document_numbers = dict(izip(document_names, xrange(len(document_names))))
+        listing_order = array.array('L', [0]) * len(document_names)
+        for position, document_name in enumerate(compactindex.listingOrder(document_names, lambda document_name: indexed[document_numbers[document_name]])):
+            listing_order[document_numbers[document_name]] = position
+        document_numbers = None
+
+        def termPostings():
+            for term, term_document_numbers, weights in mergeRuns(run_paths):
+                posting_list = sorted(izip(term_document_numbers, weights), key = lambda posting: listing_order[posting[0]])
+                yield term, statistics.document_frequencies[term_ids[term]], [(document_names[document_number], weight) for document_number, weight in posting_list]
+
+        with metrics.span('spimi_merge'):
+            run_paths = reduceRuns(runs_directory, block_writer.run_paths)
+            index.writeTermIndices(termPostings(), [document_name for document_name, has_indexed_term in izip(document_names, indexed) if has_indexed_term], output_directory, champion_size = champion_size)
+    finally:
+        shutil.rmtree(runs_directory, ignore_errors = True)
@@ -0,0 +1,100 @@
+"""Module termdict:
+    This module writes and searches the binary term dictionary.
+    The binary dictionary holds the same information as dictionary.txt, laid out so that
+    a term can be found with a binary search over a memory mapped file.
+
+    Layout (all integers little endian):
+        header      magic 'TDIC', version, number of terms
+        offsets     (number of terms + 1) uint32 offsets of each term in the term table
+        records     one fixed size record per term: document frequency, postings start line,
+                    byte offset and byte length of the binary posting list, largest weight of the term
+        term table  the sorted terms, concatenated
+	"""
+
+import mmap
+import struct
+from collections import defaultdict
+
+MAGIC = 'TDIC'
+# Version 5 posting lists are weights, a skip table and bit packed document id gaps, see postings.py
+VERSION = 5
+HEADER_FORMAT = '<4sII'
+OFFSET_FORMAT = '<I'
+RECORD_FORMAT = '<IIQIf'
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+def writeBinaryDictionary(path, entries):
+    """ Writes the binary dictionary. entries is a list of (term, document frequency, postings start line,
+        postings byte offset, postings byte length, max weight) sorted by term"""
+    term_offsets = [0]
+    for entry in entries:
+        term_offsets.append(term_offsets[-1] + len(entry[0]))
+
+    with open(path, 'wb') as dictionary_file:
+        dictionary_file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(entries)))
+        dictionary_file.write(struct.pack('<%dI' % len(term_offsets), *term_offsets))
+        for entry in entries:
+            dictionary_file.write(struct.pack(RECORD_FORMAT, *entry[1:]))
+        for entry in entries:
+            dictionary_file.write(entry[0])
+
+def roundMaxWeight(max_weight):
+    """ Rounds the max weight to the precision it is stored with, so it can be used to quantize the weights"""
+    return struct.unpack('<f', struct.pack('<f', max_weight))[0]
+
+def readHeader(dictionary_map):
+    """ Returns the magic, version and number of terms of the memory mapped dictionary"""
+    magic, version, number_of_terms = struct.unpack_from(HEADER_FORMAT, dictionary_map, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("ERROR:[SearchEngine] Unsupported binary dictionary format.")
+    return magic, version, number_of_terms
+
+def readTerm(dictionary_map, term_number):
+    """ Returns the term stored at the given position of the term table"""
+    magic, version, number_of_terms = struct.unpack_from(HEADER_FORMAT, dictionary_map, 0)
+    terms_start = HEADER_SIZE + (number_of_terms + 1) * OFFSET_SIZE + number_of_terms * RECORD_SIZE
+    term_start, term_end = struct.unpack_from('<2I', dictionary_map, HEADER_SIZE + term_number * OFFSET_SIZE)
+    return dictionary_map[terms_start + term_start:terms_start + term_end]
+
+def readRecord(dictionary_map, term_number):
+    """ Returns the record stored at the given position"""
+    magic, version, number_of_terms = struct.unpack_from(HEADER_FORMAT, dictionary_map, 0)
+    records_start = HEADER_SIZE + (number_of_terms + 1) * OFFSET_SIZE
+    return list(struct.unpack_from(RECORD_FORMAT, dictionary_map, records_start + term_number * RECORD_SIZE))
+
+def findTerm(dictionary_map, term):
+    """ Binary searches the memory mapped dictionary for the term. Returns the record of the term or None"""
+    magic, version, number_of_terms = readHeader(dictionary_map)
+
+    low = 0
+    high = number_of_terms - 1
+    while low <= high:
+        middle = (low + high) // 2
+        middle_term = readTerm(dictionary_map, middle)
+        if middle_term < term:
+            low = middle + 1
+        elif middle_term > term:
+            high = middle - 1
+        else:
+            return readRecord(dictionary_map, middle)
+
+    return None
+
+def searchInBinaryDictionary(query_dict, path):
+    "Gets the term information from the binary dictionary file, in the same form as searchInDictionaryFile"
+    results_from_dictionary = defaultdict(list)
+    with open(path, 'rb') as dictionary_file:
+        dictionary_map = mmap.mmap(dictionary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for term in query_dict.keys():
+                record = findTerm(dictionary_map, term)
+                if record is not None:
+                    results_from_dictionary[term] = record
+                    del query_dict[term]
+        finally:
+            dictionary_map.close()
+
+    return results_from_dictionary
@@ -0,0 +1,126 @@
+"""Module test_indexbuild:
+    This module checks that the index builders of index.py write the index the first version of
+    index.py wrote. A small fixed corpus is indexed with the single pass, compact, vectorized and
+    SPIMI builders, and their dictionary and postings files are compared byte for byte with the
+    files the first version wrote for it.
+
+    usage: python -m unittest test_indexbuild
+	"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from collections import defaultdict
+import index
+import spimi
+import sparseweights
+
+STOPWORDS = ['the', 'and', 'of']
+
+# Tokenized files as tokenize.py writes them. The names sort differently as strings and as numbers,
+# "rare" and "unique" occur once in the corpus, 3.txt holds only stopwords and one letter tokens and
+# 4.txt only a term that occurs once, so neither has an indexed term
+CORPUS = {
+    '1.txt': 'search,engine,the,index\nsearch,query,rank\n',
+    '2.txt': 'index,index,postings,and,query\n',
+    '3.txt': 'the,of,a,b\n',
+    '4.txt': 'unique\n',
+    '10.txt': 'engine,rank,rank,rare,of\nsearch\n',
+    '11.txt': 'postings,query,engine,search,search\n',
+    '20.txt': 'weight,weight,index\n',
+    '21.txt': 'weight,rank,postings,query,engine\n',
+}
+
+INDEX_FILES = ['dictionary.txt', 'postings.txt']
+BINARY_INDEX_FILES = ['postings.bin', 'dictionary.bin', 'documents.txt']
+
+# The files the first version of index.py, which looks for every term in every document, writes for CORPUS.
+# It lists the postings of a term in the iteration order of its term_weights dict, so 21.txt comes before 20.txt
+BASELINE_FILES = {
+    'dictionary.txt': 'engine\n4\n1\nindex\n3\n5\npostings\n3\n8\nquery\n4\n11\nrank\n3\n15\nsearch\n3\n18\nweight\n2\n21\n',
+    'postings.txt': '1.txt,0.00000\n10.txt,0.00000\n11.txt,0.00000\n21.txt,0.00000\n'
+                    '1.txt,0.48520\n2.txt,0.69315\n20.txt,0.48520\n'
+                    '11.txt,0.48520\n2.txt,0.48520\n21.txt,0.69315\n'
+                    '1.txt,0.00000\n11.txt,0.00000\n2.txt,0.00000\n21.txt,0.00000\n'
+                    '1.txt,0.48520\n10.txt,0.69315\n21.txt,0.69315\n'
+                    '1.txt,0.69315\n10.txt,0.48520\n11.txt,0.69315\n'
+                    '21.txt,1.09861\n20.txt,1.09861\n',
+}
+
+class IndexBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_directory = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        # index.py reads the stop words from the current directory
+        os.chdir(self.directory)
+        with open('stopwords.txt', 'w') as stopwords_file:
+            stopwords_file.write('\n'.join(STOPWORDS) + '\n')
+        self.input_directory = os.path.join(self.directory, 'tokenized')
+        os.makedirs(self.input_directory)
+        for document_name, text in CORPUS.iteritems():
+            with open(os.path.join(self.input_directory, document_name), 'w') as document_file:
+                document_file.write(text)
+
+    def tearDown(self):
+        os.chdir(self.previous_directory)
+        shutil.rmtree(self.directory)
+
+    def countTerms(self):
+        term_frequency = defaultdict(lambda : defaultdict(dict))
+        inverse_document_frequency = defaultdict(int)
+        term_count_in_corpus = defaultdict(int)
+        index.calculateTermFreqAndInverseDocFreq(input_directory = self.input_directory, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+        return term_frequency, inverse_document_frequency, term_count_in_corpus
+
+    def buildNestedDicts(self, output_directory, calculate_weights = index.calculateWeights):
+        term_frequency, inverse_document_frequency, term_count_in_corpus = self.countTerms()
+        term_weights = defaultdict(lambda : defaultdict(dict))
+        calculate_weights(term_weights = term_weights, term_frequency = term_frequency, inverse_document_frequency = inverse_document_frequency, term_count_in_corpus = term_count_in_corpus)
+        index.calculateTermIndices(term_weights = term_weights, term_count_in_corpus = term_count_in_corpus, inverse_document_frequency = inverse_document_frequency, output_directory = output_directory)
+
+    def assertSameFiles(self, expected_directory, directory, file_names):
+        for file_name in file_names:
+            with open(os.path.join(expected_directory, file_name), 'rb') as expected_file:
+                expected = expected_file.read()
+            with open(os.path.join(directory, file_name), 'rb') as built_file:
+                self.assertEqual(expected, built_file.read(), "%s of %s differs" % (file_name, directory))
+
+    def assertBaselineFiles(self, directory):
+        for file_name in INDEX_FILES:
+            with open(os.path.join(directory, file_name), 'rb') as built_file:
+                self.assertEqual(BASELINE_FILES[file_name], built_file.read(), "%s of %s differs" % (file_name, directory))
+
+    def testNestedDicts(self):
+        self.buildNestedDicts('nested')
+        self.assertBaselineFiles('nested')
+
+    def testCompact(self):
+        self.buildNestedDicts('nested')
+        index.buildCompactIndex(self.input_directory, 'compact')
+        self.assertBaselineFiles('compact')
+        self.assertSameFiles('nested', 'compact', BINARY_INDEX_FILES)
+
+    @unittest.skipUnless(sparseweights.isAvailable(), "the vectorized weights need numpy and scipy")
+    def testVectorized(self):
+        self.buildNestedDicts('nested')
+        self.buildNestedDicts('vectorized', sparseweights.calculateWeightsVectorized)
+        self.assertBaselineFiles('vectorized')
+        self.assertSameFiles('nested', 'vectorized', BINARY_INDEX_FILES)
+
+    def testSpimi(self):
+        self.buildNestedDicts('nested')
+        # a budget of one posting writes a run per document, and a fan in of 2 merges the runs in several passes
+        merge_fan_in = spimi.MERGE_FAN_IN
+        spimi.MERGE_FAN_IN = 2
+        try:
+            spimi.buildIndex(self.input_directory, 'spimi', spimi.POSTING_BYTES)
+        finally:
+            spimi.MERGE_FAN_IN = merge_fan_in
+        self.assertBaselineFiles('spimi')
+        self.assertSameFiles('nested', 'spimi', BINARY_INDEX_FILES)
+        self.assertFalse(os.path.exists(os.path.join('spimi', spimi.RUNS_DIRECTORY)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Module test_shards:
+    This module checks that a sharded index is built from tokenized files whose terms hold tabs, as the
+    tokens.txt and sorted_by_*.txt files tokenize.py writes next to the documents do, and that the
+    shards index the terms of the unsharded index. A rebuild writes new shard directories and keeps the
+    ones of the build before.
+
+    usage: python -m unittest test_shards
+	"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import index
+import shards
+
+STOPWORDS = ['the', 'and', 'of']
+
+# "tab\tterm" and "term\t3" are split on commas only, so the tabs stay in the terms
+CORPUS = {
+    '1.txt': 'search,tab\tterm,index\n',
+    '2.txt': 'tab\tterm,index,query\n',
+    '3.txt': 'search,query,term\t3\n',
+    'tokens.txt': 'term\t3\nsearch\n',
+}
+
+class ShardedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_directory = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        # index.py reads the stop words from the current directory
+        os.chdir(self.directory)
+        with open('stopwords.txt', 'w') as stopwords_file:
+            stopwords_file.write('\n'.join(STOPWORDS) + '\n')
+        self.input_directory = os.path.join(self.directory, 'tokenized')
+        os.makedirs(self.input_directory)
+        for document_name, text in CORPUS.iteritems():
+            with open(os.path.join(self.input_directory, document_name), 'w') as document_file:
+                document_file.write(text)
+
+    def tearDown(self):
+        os.chdir(self.previous_directory)
+        shutil.rmtree(self.directory)
+
+    def testTermsWithTabs(self):
+        shard_names = shards.buildShards(self.input_directory, 'sharded', 3)
+        self.assertEqual(shard_names, shards.readManifest('sharded'))
+        number_of_documents, inverse_document_frequency, term_count_in_corpus, max_normalized_frequencies = shards.readStatistics(os.path.join('sharded', shards.STATISTICS))
+        self.assertEqual(4, number_of_documents)
+        self.assertEqual(2, inverse_document_frequency['tab\tterm'])
+        self.assertEqual(2, term_count_in_corpus['term\t3'])
+        self.assertEqual(1.0, max_normalized_frequencies['term\t3'])
+        index.buildCompactIndex(self.input_directory, 'unsharded')
+        with open(os.path.join('unsharded', 'dictionary.txt')) as dictionary_file:
+            unsharded_terms = set(dictionary_file.read().split('\n')[0:-1:3])
+        self.assertIn('tab\tterm', unsharded_terms)
+        self.assertIn('term\t3', unsharded_terms)
+        sharded_terms = set()
+        for shard_name in shard_names:
+            with open(os.path.join('sharded', shard_name, 'dictionary.txt')) as dictionary_file:
+                sharded_terms.update(dictionary_file.read().split('\n')[0:-1:3])
+        self.assertEqual(unsharded_terms, sharded_terms)
+
+    def testRebuildKeepsPreviousShards(self):
+        # a server may have read the manifest of the build before and still be opening its shards
+        first_names = shards.buildShards(self.input_directory, 'sharded', 2)
+        second_names = shards.buildShards(self.input_directory, 'sharded', 2)
+        self.assertFalse(set(first_names) & set(second_names))
+        self.assertEqual(second_names, shards.readManifest('sharded'))
+        for shard_name in first_names + second_names:
+            self.assertTrue(os.path.isdir(os.path.join('sharded', shard_name)))
+        third_names = shards.buildShards(self.input_directory, 'sharded', 2)
+        shard_directories = set(filename for filename in os.listdir('sharded') if shards.SHARD_DIRECTORY.match(filename))
+        self.assertEqual(set(second_names + third_names), shard_directories)
+
+if __name__ == "__main__":
+    unittest.main()
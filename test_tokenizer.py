@@ -0,0 +1,42 @@
+"""Module test_tokenizer:
+    This module checks that every installed text extraction backend of tokenizer.py gives the same tokens.
+
+    usage: python -m unittest test_tokenizer
+	"""
+
+import codecs
+import unittest
+import tokenizer
+
+# Pages with the constructs the backends read differently unless they are handled
+PAGES = {
+    'plain': '<html><head><title>Plain page</title></head>\n<body><p>Some text, some more.</p></body></html>',
+    'bom': codecs.BOM_UTF8 + '<html><body>bom text</body></html>',
+    'bom_windows_1252': codecs.BOM_UTF8 + '<html><body>bom caf\xe9</body></html>',
+    'skipped': '<html><body>shown<script>hidden()</script><style>p {}</style><!-- comment --> text</body></html>',
+    'references': '<html><body>fish &amp; chips &copy caf&#233; &#150;</body></html>',
+    'cdata': '<?xml version="1.0"?><html><body><![CDATA[cdata text]]> after</body></html>',
+}
+
+EXPECTED_TOKENS = {
+    'plain': ['plain', 'page', 'some', 'text', 'some', 'more'],
+    'bom': ['bom', 'text'],
+}
+
+class BackendTest(unittest.TestCase):
+
+    def testSameTokens(self):
+        for page_name, html_data in sorted(PAGES.iteritems()):
+            reference_tokens = list(tokenizer.tokenizeHtml(html_data, 'htmlparser'))
+            if page_name in EXPECTED_TOKENS:
+                self.assertEqual(EXPECTED_TOKENS[page_name], reference_tokens)
+            for backend in tokenizer.availableBackends():
+                self.assertEqual(reference_tokens, list(tokenizer.tokenizeHtml(html_data, backend)), "%s tokens of %s differ" % (backend, page_name))
+
+    def testByteOrderMark(self):
+        for backend in tokenizer.availableBackends():
+            self.assertEqual('bom', next(tokenizer.tokenizeHtml(PAGES['bom'], backend)))
+            self.assertEqual('bom', next(tokenizer.tokenizeHtml(PAGES['bom'].decode('utf-8'), backend)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,13 +5,14 @@
 from sys import argv
 from os import listdir, makedirs, path
 from collections import deque, defaultdict
-import re
 from time import time
+import tokenizer
 
 start_time = time()
 
 def tokenize_file(filepath):
-    """ This tokenizer splits on non-alphanumeric characters and html tags. It converts all tokens to lower case.
+    """ This tokenizer extracts the text of an html file with the shared tokenizer module, so it gives the same
+        tokens as tokenize.py. It converts all tokens to lower case.
         :type  filepath: str
         :param filepath: path to file to tokenize
 
@@ -20,14 +21,10 @@ def tokenize_file(filepath):
         """
     output = {'tokens': deque([]), 'counts': defaultdict(int)}
     with open(filepath, 'r') as open_file:
-        for line in open_file:
-            line_tokes = re.split(pattern='<.*?>|\W+?', string=line.lower())
-                                                            # Regexp split on html tags or non alpha-numeric characters,
-                                                            # this is the tokenization step for the line
-            line_tokes = list(filter(None, line_tokes))     # hack to remove empty strings
-            output['tokens'].extend(line_tokes)             # accumulate these tokens through the entire file
-            for tok in line_tokes:                          # update token counts
-                output['counts'][tok] += 1
+        html_data = open_file.read()
+    for tok in tokenizer.tokenizeHtml(html_data):                  # extract the text and split it into tokens
+        output['tokens'].append(tok)                                # accumulate these tokens through the entire file
+        output['counts'][tok] += 1                                  # update token counts
     return output
 
 
@@ -58,7 +55,7 @@ def tokenize_all_files(input_path, output_path, tokenizer=tokenize_file, num_fil
         tokenizer_output = tokenizer(input_path + '/' + filename)           # tokenize
         with open(path.join(output_path, filename + '.tokens'), 'w') as open_file:
             open_file.write(', '.join(tokenizer_output['tokens']))          # write tokenized output to file
-        open_file.write('\n')
+            open_file.write('\n')
         for token, count in tokenizer_output['counts'].iteritems():
             all_tokens[token] += count                      # accumulate tokens with their frequency/counts
                                                             # write token: frequency lists to file
@@ -5,15 +5,21 @@ import sys
 import time
 import glob
 import os
+import argparse
+import itertools
+import multiprocessing
+import tokenizer
+import metrics
 from string import maketrans
-from bs4 import BeautifulSoup
-from collections import defaultdict
+from collections import OrderedDict
 
 start_time = time.time()
 
-def tokenize(html_data, filecount, dictionary, directory):
+def tokenize(html_data, filecount, dictionary, directory, backend = None):
     "This function tokenizes the given file and stores the tokens into an output file"
-    parsedhtml = BeautifulSoup(html_data)
+    # tokenizer is looked up at call time: this module shadows the standard tokenize module,
+    # so it can be imported while tokenizer itself is still being imported
+    backend = backend or tokenizer.DEFAULT_BACKEND
     try:
         output_file_path = "/" + str(filecount) + ".txt";
         output_file_path = os.path.basename(output_file_path)
@@ -22,25 +28,16 @@ def tokenize(html_data, filecount, dictionary, directory):
     except IOError:
         print "ERROR:[SearchEngine] Unable to open output file in tokenized files directory."
     else:
-        text = parsedhtml.get_text()
-
-        for line in text.splitlines():
-            line.strip()
-            for token in line.split():
-                output_token = token.strip(".,[]\"?|!;:-&#'()$^%*+-/<>=_@`\\0123456789").lower()
-                output_token = output_token.encode('utf8')
-                output_token = ''.join([ c for c in output_token if c not in ('(',')','/','=','[',']','.','"','?','!','_',':',';',',','\'','&','$')])
-
-                if output_token:
-                    dictionary[output_token] += 1
-                    output_file.write(output_token + '\n')
+        for output_token in tokenizer.tokenizeHtml(html_data, backend):
+            dictionary[output_token] = dictionary.get(output_token, 0) + 1
+            output_file.write(output_token + '\n')
 
         output_file.close()
 
-def writeTokenCountsToFile(dictionary):
+def writeTokenCountsToFile(dictionary, output_directory):
     "This function writes the total tokens and their counts to an output file"
     try:
-        output_file = open(sys.argv[2] + "/tokens.txt",'w')
+        output_file = open(os.path.join(output_directory, "tokens.txt"),'w')
     except IOError:
         print "ERROR:[SearchEngine] Unable to open output file",output_file
     else:
@@ -48,10 +45,10 @@ def writeTokenCountsToFile(dictionary):
             output_file.write(key + "\t" + str(value) + '\n')
         output_file.close()
 
-def sortByNameAndWriteToFile(dictionary):
+def sortByNameAndWriteToFile(dictionary, output_directory):
     "This function sorts the tokens alphabetically by name into a file"
     try:
-        output_file = open(sys.argv[2] + "/sorted_by_name.txt",'w')
+        output_file = open(os.path.join(output_directory, "sorted_by_name.txt"),'w')
     except IOError:
         print "ERROR:[SearchEngine] Unable to open output file",output_file
     else:
@@ -59,10 +56,10 @@ def sortByNameAndWriteToFile(dictionary):
             output_file.write(key + "\t" + str(value) +'\n')
         output_file.close()
 
-def sortByCountAndWriteToFile(dictionary):
+def sortByCountAndWriteToFile(dictionary, output_directory):
     "This function sorts the tokens by count in descendng order into a file"
     try:
-        output_file = open(sys.argv[2] + "/sorted_by_count.txt",'w')
+        output_file = open(os.path.join(output_directory, "sorted_by_count.txt"),'w')
     except IOError:
         print "ERROR:[SearchEngine] Unable to open output file",output_file
     else:
@@ -70,39 +67,71 @@ def sortByCountAndWriteToFile(dictionary):
             output_file.write(word + "\t" + str(dictionary.get(word)) + '\n')
         output_file.close()
 
-def performTokenization():
+def tokenizeFile(job):
+    "This function tokenizes one input file, possibly in a worker process, and returns its token counts in order of first occurrence"
+    filename, filecount, directory, backend = job
+    file_token_counts = OrderedDict()
+    try:
+        file = open(filename,'r')
+    except IOError:
+        print "ERROR:[SearchEngine] Unable to open input file."
+    else:
+        with file:
+            file_content = file.read()
+        metrics.count('bytes_read', len(file_content))
+        tokenize(html_data = file_content, filecount = filecount, dictionary = file_token_counts, directory = directory, backend = backend)
+    return file_token_counts
+
+def performTokenization(input_directory, output_directory, workers, backend):
     "This function reads all the files to generate tokens and writes the output into files"
-    filecount = 0
-    token_count_dict = defaultdict(int)
+    # token counts in order of first occurrence in the corpus, so the output does not depend on the number of workers
+    token_count_dict = OrderedDict()
 
     print "parsing input files now:"
-    input_directory = sys.argv[1] + "/*.html"
-    files = glob.glob(input_directory)
+    files = sorted(glob.glob(os.path.join(input_directory, "*.html")))
+    # number the output files up front so every worker knows where to write
+    jobs = [(filename, filecount, output_directory, backend) for filecount, filename in enumerate(files, 1)]
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(tokenizeFile, jobs, chunksize = 16)
+    else:
+        results = itertools.imap(tokenizeFile, jobs)
 
-    timingFile = open(sys.argv[2]+"/timingFile.txt",'w')
+    timingFile = open(os.path.join(output_directory, "timingFile.txt"),'w')
     timingfilecount = 0
-    for filename in files:
-        try:
-            timingfilecount = timingfilecount + 1
-            if timingfilecount % 50 == 0:
-                timingFile.write(str(timingfilecount)+'\t'+str(time.time() - start_time)+'\n')
-            file = open(filename,'r')
-        except IOError:
-            print "ERROR:[SearchEngine] Unable to open input file."
-        else:
-            file_content = file.read()
-            filecount += 1
-            tokenize(html_data = file_content, filecount = filecount, dictionary = token_count_dict, directory = sys.argv[2])
-        finally:
-            file.close()
-    writeTokenCountsToFile(dictionary = token_count_dict)
-    sortByNameAndWriteToFile(dictionary = token_count_dict)
-    sortByCountAndWriteToFile(dictionary = token_count_dict)
+    # merge the partial counts of each file in input file order
+    for file_token_counts in results:
+        timingfilecount = timingfilecount + 1
+        if timingfilecount % 50 == 0:
+            timingFile.write(str(timingfilecount)+'\t'+str(time.time() - start_time)+'\n')
+        for token, count in file_token_counts.iteritems():
+            token_count_dict[token] = token_count_dict.get(token, 0) + count
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    writeTokenCountsToFile(dictionary = token_count_dict, output_directory = output_directory)
+    sortByNameAndWriteToFile(dictionary = token_count_dict, output_directory = output_directory)
+    sortByCountAndWriteToFile(dictionary = token_count_dict, output_directory = output_directory)
     timingFile.close()
 
+def parseArguments():
+    "This function parses the command line: tokenize.py <input-dir> <output-dir> [--workers N] [--backend NAME]"
+    parser = argparse.ArgumentParser(description = "Tokenizes the html files of a directory")
+    parser.add_argument("input_directory")
+    parser.add_argument("output_directory")
+    parser.add_argument("--workers", type = int, default = 1, help = "number of tokenizer processes")
+    parser.add_argument("--backend", choices = tokenizer.availableBackends(), default = tokenizer.DEFAULT_BACKEND, help = "html text extraction backend")
+    metrics.addArgument(parser)
+    return parser.parse_args()
+
 def main():
     "This function is the base caller of tokenization for search engine"
-    performTokenization()
+    arguments = parseArguments()
+    metrics.configure(arguments.metrics)
+    performTokenization(input_directory = arguments.input_directory, output_directory = arguments.output_directory, workers = arguments.workers, backend = arguments.backend)
     print "Running time = %s seconds" %(time.time() - start_time)
 
 if __name__ == "__main__":
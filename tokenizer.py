@@ -0,0 +1,222 @@
+"""Module tokenizer:
+    This module extracts the text of html documents and splits it into tokens.
+    The text can be extracted by one of several backends. Every backend returns the text
+    BeautifulSoup's get_text() would: all text outside script, style and template elements,
+    without comments and declarations, with character references decoded. So every backend
+    gives the same tokens.
+
+    usage: python tokenizer.py <input-dir>
+        benchmarks every available backend on the html files of input-dir
+	"""
+
+import sys
+import os
+import glob
+import time
+import re
+import cgi
+import codecs
+import htmlentitydefs
+from HTMLParser import HTMLParser, HTMLParseError
+import metrics
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+# Characters stripped from both ends of a token
+STRIP_CHARACTERS = ".,[]\"?|!;:-&#'()$^%*+-/<>=_@`\\0123456789"
+# Characters removed from anywhere in a token
+DELETE_CHARACTERS = "()/=[].\"?!_:;,'&$"
+# Elements whose content is not text
+SKIPPED_ELEMENTS = ('script', 'style', 'template')
+# C1 control characters, which character references in the windows-1252 range decode to in lxml
+C1_TRANSLATION = dict((codepoint, chr(codepoint).decode('windows-1252', 'ignore') or None) for codepoint in range(0x80, 0xa0))
+C1_CHARACTER = re.compile(u'[\x80-\x9f]')
+
+ENTITY_WITHOUT_SEMICOLON = re.compile(r'&([a-zA-Z][-.a-zA-Z0-9]*)(?=[^a-zA-Z0-9;])')
+CDATA_SECTION = re.compile(r'<!\[CDATA\[(.*?)\]\]>', re.DOTALL)
+XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*>')
+
+class TextExtractor(HTMLParser):
+    """ Streaming html.parser extractor. Collects the text without building a document tree"""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.text = []
+        # depth of open script, style and template elements
+        self.skipped_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_ELEMENTS:
+            self.skipped_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_ELEMENTS and self.skipped_depth > 0:
+            self.skipped_depth -= 1
+
+    def handle_data(self, data):
+        if not self.skipped_depth:
+            self.text.append(data)
+
+    def handle_entityref(self, name):
+        if self.skipped_depth:
+            return
+        # unknown entities are kept as the literal string, like BeautifulSoup does
+        if name in htmlentitydefs.name2codepoint:
+            self.text.append(unichr(htmlentitydefs.name2codepoint[name]))
+        else:
+            self.text.append(u'&' + name)
+
+    def handle_charref(self, name):
+        if self.skipped_depth:
+            return
+        try:
+            if name[0] in 'xX':
+                codepoint = int(name[1:], 16)
+            else:
+                codepoint = int(name)
+        except ValueError:
+            self.text.append(u'\N{REPLACEMENT CHARACTER}')
+            return
+        # references below 256 are often meant as windows-1252, as BeautifulSoup assumes
+        character = None
+        if codepoint < 256:
+            try:
+                character = chr(codepoint).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not character:
+            try:
+                character = unichr(codepoint)
+            except (ValueError, OverflowError):
+                character = u'\N{REPLACEMENT CHARACTER}'
+        self.text.append(character)
+
+    def unknown_decl(self, data):
+        # CDATA sections are text, other declarations are not
+        if data.upper().startswith('CDATA[') and not self.skipped_depth:
+            self.text.append(data[len('CDATA['):])
+
+def decodeHtml(html_data):
+    """ Decodes the raw bytes of a document, as utf-8 if possible, else as windows-1252.
+        A leading byte order mark is dropped, as lxml drops it"""
+    if isinstance(html_data, unicode):
+        return html_data[1:] if html_data.startswith(u'\ufeff') else html_data
+    if html_data.startswith(codecs.BOM_UTF8):
+        html_data = html_data[len(codecs.BOM_UTF8):]
+    try:
+        return html_data.decode('utf-8')
+    except UnicodeDecodeError:
+        return html_data.decode('windows-1252', 'replace')
+
+def extractTextHtmlParser(html_data):
+    """ Extracts the text with the streaming html.parser backend"""
+    extractor = TextExtractor()
+    try:
+        extractor.feed(decodeHtml(html_data))
+        extractor.close()
+    except HTMLParseError:
+        pass
+    return u''.join(extractor.text)
+
+def extractTextLxml(html_data):
+    """ Extracts the text with the lxml backend"""
+    text = XML_DECLARATION.sub(u'', decodeHtml(html_data))
+    if not text.strip():
+        return u''
+    # libxml2 drops CDATA sections and keeps entity references without a semicolon literally,
+    # so rewrite both the way html.parser reads them
+    text = CDATA_SECTION.sub(lambda match: cgi.escape(match.group(1)), text)
+    text = ENTITY_WITHOUT_SEMICOLON.sub(lambda match: match.group(0) + ';' if match.group(1) in htmlentitydefs.name2codepoint else match.group(0), text)
+
+    document = lxml.html.document_fromstring(text)
+    for element in list(document.iter(*SKIPPED_ELEMENTS)):
+        element.drop_tree()
+    text = unicode(document.text_content())
+    if C1_CHARACTER.search(text):
+        text = text.translate(C1_TRANSLATION)
+    return text
+
+def extractTextBeautifulSoup(html_data):
+    """ Extracts the text with the BeautifulSoup backend"""
+    return BeautifulSoup(decodeHtml(html_data), 'html.parser').get_text()
+
+EXTRACTORS = {
+    'htmlparser': extractTextHtmlParser,
+    'lxml': extractTextLxml,
+    'bs4': extractTextBeautifulSoup,
+}
+
+def availableBackends():
+    """ Returns the names of the backends whose libraries are installed"""
+    backends = ['htmlparser']
+    if lxml is not None:
+        backends.append('lxml')
+    if BeautifulSoup is not None:
+        backends.append('bs4')
+    return backends
+
+# The fastest installed backend
+DEFAULT_BACKEND = 'lxml' if lxml is not None else 'htmlparser'
+
+def extractText(html_data, backend = DEFAULT_BACKEND):
+    """ Returns the text of the html document using the given backend"""
+    if backend not in availableBackends():
+        raise ValueError("ERROR:[SearchEngine] Text extraction backend " + backend + " is not available.")
+    return EXTRACTORS[backend](html_data)
+
+def normalizeTokens(text):
+    """ Splits the text into lower case utf-8 tokens, stripping punctuation and digits"""
+    for line in text.splitlines():
+        for token in line.split():
+            output_token = token.strip(STRIP_CHARACTERS).lower().encode('utf8')
+            output_token = output_token.translate(None, DELETE_CHARACTERS)
+            if output_token:
+                yield output_token
+
+def tokenizeHtml(html_data, backend = DEFAULT_BACKEND):
+    """ Returns the tokens of the html document"""
+    if not metrics.enabled:
+        return normalizeTokens(extractText(html_data, backend))
+    # with metrics on the tokens are normalized up front, so that the normalization can be timed
+    with metrics.span('html_parse'):
+        text = extractText(html_data, backend)
+    with metrics.span('token_normalization'):
+        tokens = list(normalizeTokens(text))
+    metrics.count('html_documents')
+    metrics.count('tokens', len(tokens))
+    return iter(tokens)
+
+def benchmarkBackends(input_directory):
+    """ Tokenizes the html files of input_directory with every backend and prints the throughput in MB/s"""
+    documents = []
+    for filename in sorted(glob.glob(os.path.join(input_directory, "*.html"))):
+        with open(filename, 'r') as html_file:
+            documents.append(html_file.read())
+    megabytes = sum(len(document) for document in documents) / (1024.0 * 1024.0)
+    print "%d documents, %.2f MB" % (len(documents), megabytes)
+
+    reference_tokens = None
+    for backend in availableBackends():
+        backend_start_time = time.time()
+        tokens = [list(tokenizeHtml(document, backend)) for document in documents]
+        elapsed_time = time.time() - backend_start_time
+
+        if reference_tokens is None:
+            reference_tokens = tokens
+        same_tokens = "same tokens" if tokens == reference_tokens else "DIFFERENT tokens"
+        print "%-12s %8.2f MB/s  %s" % (backend, megabytes / elapsed_time if elapsed_time else float('inf'), same_tokens)
+
+def main():
+    "This function is the base caller of the tokenizer benchmark"
+    benchmarkBackends(input_directory = sys.argv[1])
+
+if __name__ == "__main__":
+    sys.exit(main())
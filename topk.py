@@ -0,0 +1,226 @@
+"""Module topk:
+    This module selects the top k documents of a query without sorting every score.
+    maxScoreTopK scores document id sorted posting lists term at a time and uses the largest
+    weight of every term (stored in the binary dictionary) to stop adding documents, and then
+    to stop looking up documents, that cannot reach the top k (MaxScore dynamic pruning).
+    It returns the same documents and scores as exhaustive scoring.
+    accumulateTopK scores numpy arrays of postings, adding a whole posting list at a time to an
+    array of the scores of the documents of the lists, or of every document when the lists hold
+    postings for a large part of them, and returns the same documents and scores.
+    conjunctiveTopK scores only the documents holding every query term, document at a time: the
+    posting cursors leapfrog each other from the shortest list, searching the longer lists for the
+    next candidate instead of walking them, so the cost follows the shortest list.
+    championTopK scores the documents of the champion lists of the query terms (see champions.py)
+    and returns their top k only when no other document can reach it.
+	"""
+
+import heapq
+import bisect
+from itertools import izip
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bounds are compared with this much slack, so rounding in partial sums never prunes a document of the top k
+PRUNING_SLACK = 1e-9
+
+# accumulateTopK scores every document when the posting lists hold at least one posting per this many documents
+DENSE_SCORES_RATIO = 16
+
+def selectTopK(document_scores, k):
+    """ Returns the k highest scoring (document, score) pairs, best first, ties broken by document name"""
+    return heapq.nsmallest(k, document_scores.iteritems(), key = lambda item: (-item[1], item[0]))
+
+def exhaustiveTopK(posting_lists, k):
+    """ Scores every document of every posting list. posting_lists is a list of
+        (query term weight, max weight, document ids, weights). Returns the top k (document id, score)"""
+    document_scores = {}
+    for query_term_weight, max_weight, document_ids, weights in posting_lists:
+        for index in range(0, len(document_ids)):
+            document_scores[document_ids[index]] = document_scores.get(document_ids[index], 0.0) + weights[index] * query_term_weight
+    return selectTopK(document_scores, k)
+
+def maxScoreTopK(posting_lists, k):
+    """ Same as exhaustiveTopK, with MaxScore pruning. The document ids of every list must be ascending"""
+    # bounds only hold for non negative query term weights
+    for query_term_weight, max_weight, document_ids, weights in posting_lists:
+        if query_term_weight < 0:
+            return exhaustiveTopK(posting_lists, k)
+    if k <= 0:
+        return []
+
+    # process the lists term at a time, highest score upper bound first
+    order = sorted(range(0, len(posting_lists)), key = lambda index: posting_lists[index][0] * posting_lists[index][1], reverse = True)
+    # remaining_bounds[i] is the largest score a document can still get from the lists order[i:]
+    remaining_bounds = [0.0] * (len(order) + 1)
+    for list_number in range(len(order) - 1, -1, -1):
+        query_term_weight, max_weight = posting_lists[order[list_number]][:2]
+        remaining_bounds[list_number] = remaining_bounds[list_number + 1] + query_term_weight * max_weight
+
+    accumulators = {}
+    for list_number in range(0, len(order)):
+        query_term_weight, max_weight, document_ids, weights = posting_lists[order[list_number]]
+        # the partial scores are lower bounds, so k documents score at least the k-th best partial score
+        threshold = float('-inf')
+        if len(accumulators) >= k:
+            threshold = heapq.nlargest(k, accumulators.itervalues())[-1]
+
+        if remaining_bounds[list_number] + PRUNING_SLACK < threshold:
+            # no new document can reach the top k: only look up the candidates that still can
+            accumulators = dict((document_id, score) for document_id, score in accumulators.iteritems() if score + remaining_bounds[list_number] + PRUNING_SLACK >= threshold)
+            for document_id in accumulators:
+                position = bisect.bisect_left(document_ids, document_id)
+                if position < len(document_ids) and document_ids[position] == document_id:
+                    accumulators[document_id] += weights[position] * query_term_weight
+        else:
+            for position in range(0, len(document_ids)):
+                accumulators[document_ids[position]] = accumulators.get(document_ids[position], 0.0) + weights[position] * query_term_weight
+
+    if not accumulators:
+        return []
+
+    # rescore the documents that can be in the top k summing in query order, as exhaustive scoring does
+    threshold = heapq.nlargest(k, accumulators.itervalues())[-1]
+    document_scores = {}
+    for document_id, score in accumulators.iteritems():
+        if score + PRUNING_SLACK < threshold:
+            continue
+        score = 0.0
+        for query_term_weight, max_weight, document_ids, weights in posting_lists:
+            position = bisect.bisect_left(document_ids, document_id)
+            if position < len(document_ids) and document_ids[position] == document_id:
+                score += weights[position] * query_term_weight
+        document_scores[document_id] = score
+
+    return selectTopK(document_scores, k)
+
+def accumulateTopK(posting_lists, number_of_documents, k):
+    """ Same as exhaustiveTopK for numpy arrays of document ids and weights, in [0, number_of_documents).
+        Returns the top k (document id, score). The cost follows the number of postings read: the scores are accumulated
+        in an array of the documents of the posting lists, or of all the documents when the lists hold that many postings"""
+    if k <= 0 or not posting_lists:
+        return []
+    number_of_postings = sum(len(document_ids) for query_term_weight, max_weight, document_ids, weights in posting_lists)
+    if number_of_postings * DENSE_SCORES_RATIO >= number_of_documents:
+        # indexing the scores by document id costs less than sorting the documents of the lists
+        document_scores = numpy.zeros(number_of_documents)
+        scored = numpy.zeros(number_of_documents, dtype = bool)
+        for query_term_weight, max_weight, document_ids, weights in posting_lists:
+            # the document ids of a list are distinct, so every posting is added once, in query order as exhaustiveTopK adds them
+            document_scores[document_ids] += weights * query_term_weight
+            scored[document_ids] = True
+        candidates = numpy.flatnonzero(scored)
+        candidate_scores = document_scores[candidates]
+    else:
+        if len(posting_lists) == 1:
+            candidates = posting_lists[0][2]
+        else:
+            candidates = numpy.unique(numpy.concatenate([document_ids for query_term_weight, max_weight, document_ids, weights in posting_lists]))
+        candidate_scores = numpy.zeros(len(candidates))
+        for query_term_weight, max_weight, document_ids, weights in posting_lists:
+            candidate_scores[numpy.searchsorted(candidates, document_ids)] += weights * query_term_weight
+    if len(candidates) > k:
+        # only the documents scoring at least the k-th best score can be in the top k
+        kth_score = numpy.partition(candidate_scores, len(candidates) - k)[len(candidates) - k]
+        kept = candidate_scores >= kth_score
+        candidates = candidates[kept]
+        candidate_scores = candidate_scores[kept]
+    # best first, ties broken by document id as selectTopK breaks them
+    order = numpy.lexsort((candidates, -candidate_scores))[:k]
+    return [(int(candidates[position]), float(candidate_scores[position])) for position in order]
+
+def conjunctiveTopK(posting_cursors, k):
+    """ Returns the top k (document id, score) of the documents in every posting list. posting_cursors is a list of
+        (query term weight, postings.PostingCursor), and the scores are summed in that order as exhaustiveTopK sums them"""
+    if not posting_cursors or k <= 0:
+        return []
+    cursors = sorted((cursor for query_term_weight, cursor in posting_cursors), key = lambda cursor: cursor.document_frequency)
+    lead_cursor = cursors[0]
+    document_scores = {}
+    candidate = lead_cursor.document_id
+    while candidate is not None:
+        for cursor in cursors[1:]:
+            document_id = cursor.advance(candidate)
+            if document_id != candidate:
+                break
+        else:
+            # every cursor is on the candidate
+            score = 0.0
+            for query_term_weight, cursor in posting_cursors:
+                score += cursor.weight() * query_term_weight
+            document_scores[candidate] = score
+            candidate = lead_cursor.next()
+            continue
+        if document_id is None:
+            break
+        # a list has no document between the candidate and document_id, so the lead jumps there
+        candidate = lead_cursor.advance(document_id)
+    return selectTopK(document_scores, k)
+
+def championTopK(champion_lists, k, exact = True):
+    """ Returns the top k (document id, score) of the documents of the champion lists, or None if a document in no
+        champion list could be in the top k. champion_lists is a list of (query term weight, champion document ids,
+        champion weights, threshold, lookup) in query order: every posting of the term but the champions weighs at most
+        threshold, and lookup(ascending document ids) returns their weights in the full list of the term, None for the
+        documents it does not hold, as postings.lookupWeights. lookup is None when the champions are the full list.
+        The scores are summed in query order as exhaustiveTopK sums them. Without exact the candidates are scored from
+        the champion lists alone and always returned, which can miss documents of the exhaustive top k"""
+    if k <= 0:
+        return []
+    # the threshold only bounds the contribution of a term for non negative query term weights
+    for query_term_weight, document_ids, weights, threshold, lookup in champion_lists:
+        if query_term_weight < 0 and exact:
+            return None
+    champion_weights = [dict(izip(document_ids, weights)) for query_term_weight, document_ids, weights, threshold, lookup in champion_lists]
+    candidates = set().union(*champion_weights)
+    complete = all(lookup is None for query_term_weight, document_ids, weights, threshold, lookup in champion_lists)
+    # the weights of the candidates in the full list of the terms with one, once looked up
+    full_weights = [None] * len(champion_lists)
+    if exact and not complete:
+        # a document in no champion list scores at most the sum of the thresholds, so it cannot reach a k-th score above that
+        unseen_bound = sum(query_term_weight * threshold for query_term_weight, document_ids, weights, threshold, lookup in champion_lists)
+        # the champion weights give a lower bound of the score of a candidate, and the thresholds of the terms it is no champion of an upper bound
+        lower_bounds = dict.fromkeys(candidates, 0.0)
+        upper_bounds = dict.fromkeys(candidates, unseen_bound)
+        for query_term_weight, document_ids, weights, threshold, lookup in champion_lists:
+            unseen_weight = threshold * query_term_weight if lookup is not None else 0.0
+            for document_id, weight in izip(document_ids, weights):
+                lower_bounds[document_id] += weight * query_term_weight
+                upper_bounds[document_id] += weight * query_term_weight - unseen_weight
+        # the full lists are looked up a term at a time, the term leaving the bounds widest first, and the bounds are
+        # tightened after each, so that a query the champion lists cannot settle stops before looking up every term
+        lookup_order = sorted((-query_term_weight * threshold, term_index) for term_index, (query_term_weight, document_ids, weights, threshold, lookup) in enumerate(champion_lists) if lookup is not None)
+        for bound_width, term_index in lookup_order:
+            if len(candidates) < k or heapq.nlargest(k, [upper_bounds[document_id] for document_id in candidates])[-1] <= unseen_bound + PRUNING_SLACK:
+                return None
+            # only the candidates that can reach the k-th best lower bound can be in the top k, and when the champion lists
+            # settle the query its k-th best score is above the unseen bound, so a candidate that cannot beat it is left out
+            kth_lower_bound = max(heapq.nlargest(k, [lower_bounds[document_id] for document_id in candidates])[-1], unseen_bound)
+            candidates = sorted(document_id for document_id in candidates if upper_bounds[document_id] + PRUNING_SLACK >= kth_lower_bound)
+            query_term_weight, document_ids, weights, threshold, lookup = champion_lists[term_index]
+            term_weights = champion_weights[term_index]
+            # the full list weights of the candidates, champions included, which have the same weight in both
+            full_weights[term_index] = dict(izip(candidates, lookup(candidates)))
+            for document_id, weight in full_weights[term_index].iteritems():
+                if document_id not in term_weights:
+                    upper_bounds[document_id] -= threshold * query_term_weight
+                    if weight is not None:
+                        lower_bounds[document_id] += weight * query_term_weight
+                        upper_bounds[document_id] += weight * query_term_weight
+        if len(candidates) < k or heapq.nlargest(k, [upper_bounds[document_id] for document_id in candidates])[-1] <= unseen_bound + PRUNING_SLACK:
+            return None
+
+    document_scores = dict((document_id, 0.0) for document_id in candidates)
+    for (query_term_weight, document_ids, weights, threshold, lookup), term_weights, term_full_weights in izip(champion_lists, champion_weights, full_weights):
+        if term_full_weights is not None:
+            term_weights = term_full_weights
+        for document_id in document_scores:
+            weight = term_weights.get(document_id)
+            if weight is not None:
+                document_scores[document_id] += weight * query_term_weight
+    top_documents = selectTopK(document_scores, k)
+    if exact and not complete and (len(top_documents) < k or top_documents[-1][1] <= unseen_bound + PRUNING_SLACK):
+        return None
+    return top_documents